@@ -45,6 +45,7 @@ QUERY_ENGINE_ALIASES = {
     "mssql": "ehrql.query_engines.mssql.MSSQLQueryEngine",
     "sqlite": "ehrql.query_engines.sqlite.SQLiteQueryEngine",
     "localfile": "ehrql.query_engines.local_file.LocalFileQueryEngine",
+    "localfile-columnar": "ehrql.query_engines.local_file.ColumnarLocalFileQueryEngine",
     "trino": "ehrql.query_engines.trino.TrinoQueryEngine",
     # Kept as an alias for backwards compatibility
     "csv": "ehrql.query_engines.local_file.LocalFileQueryEngine",
@@ -541,6 +542,16 @@ def add_serialize_definition(subparsers, environ, user_args):
         type=Path,
         dest="output_file",
     )
+    parser.add_argument(
+        "--record-inputs",
+        help=strip_indent(
+            """
+            Also record the files read by the definition, for use by the definition
+            cache.
+            """
+        ),
+        action="store_true",
+    )
     parser.add_argument(
         "definition_file",
         help="Definition file path",
@@ -4,7 +4,6 @@ import sys
 import typing
 from dataclasses import dataclass
 
-from ehrql.query_engines.debug import DebugQueryEngine
 from ehrql.query_engines.in_memory_database import (
     EventColumn,
     PatientColumn,
@@ -14,6 +13,10 @@ from ehrql.query_language import BaseSeries, Dataset, DateDifference
 from ehrql.query_model import nodes as qm
 
 
+if typing.TYPE_CHECKING:  # pragma: no cover
+    from ehrql.query_engines.debug import DebugQueryEngine
+
+
 DEBUG_CONTEXT = None
 
 
@@ -95,6 +98,10 @@ def show(
 
 @contextlib.contextmanager
 def activate_debug_context(*, dummy_tables_path, render_function):
+    # The debug query engine depends on the file formats, and hence `pyarrow`, which
+    # we don't want to import just to load a definition file
+    from ehrql.query_engines.debug import DebugQueryEngine
+
     global DEBUG_CONTEXT
     DEBUG_CONTEXT = DebugContext(
         query_engine=DebugQueryEngine(dummy_tables_path),
@@ -110,7 +117,7 @@ def activate_debug_context(*, dummy_tables_path, render_function):
 class DebugContext:
     """Record the currently active query engine and render function."""
 
-    query_engine: DebugQueryEngine
+    query_engine: "DebugQueryEngine"
     render_function: typing.Callable
 
     def render(
@@ -4,9 +4,11 @@ from ehrql.file_formats.main import (
     get_file_extension,
     input_filename_supports_multiple_tables,
     output_filename_supports_multiple_tables,
+    output_supports_record_batches,
     read_rows,
     read_tables,
     split_directory_and_extension,
+    write_batches,
     write_rows,
     write_tables,
 )
@@ -18,9 +20,11 @@ __all__ = [
     "get_file_extension",
     "input_filename_supports_multiple_tables",
     "output_filename_supports_multiple_tables",
+    "output_supports_record_batches",
     "read_rows",
     "read_tables",
     "split_directory_and_extension",
+    "write_batches",
     "write_rows",
     "write_tables",
 ]
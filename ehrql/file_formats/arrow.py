@@ -45,18 +45,38 @@ ROWS_PER_BATCH = 64000
 
 
 def write_rows_arrow(filename, rows, column_specs):
-    schema, batch_to_pyarrow = get_schema_and_convertor(column_specs)
+    batches = rows_to_record_batches(rows, column_specs, ROWS_PER_BATCH)
+    write_batches_arrow(filename, batches, column_specs)
+
+
+def write_batches_arrow(filename, batches, column_specs):
+    schema, _ = get_schema_and_convertor(column_specs)
     options = pyarrow.ipc.IpcWriteOptions(compression="zstd", use_threads=True)
 
     with pyarrow.OSFile(str(filename), "wb") as sink:
         with pyarrow.ipc.new_file(sink, schema, options=options) as writer:
-            for row_batch in batch_and_transpose(rows, ROWS_PER_BATCH):
-                record_batch = pyarrow.record_batch(
-                    batch_to_pyarrow(row_batch), schema=schema
-                )
+            for record_batch in batches:
                 writer.write(record_batch)
 
 
+def rows_to_record_batches(rows, column_specs, batch_size=ROWS_PER_BATCH):
+    """
+    Takes an iterable over rows and returns an iterator over `pyarrow.RecordBatch`es
+    of (at most) `batch_size` rows, with the schema given by `column_specs`
+    """
+    schema, batch_to_pyarrow = get_schema_and_convertor(column_specs)
+    for row_batch in batch_and_transpose(rows, batch_size):
+        yield pyarrow.record_batch(batch_to_pyarrow(row_batch), schema=schema)
+
+
+def record_batches_to_rows(batches):
+    """
+    The inverse of `rows_to_record_batches`
+    """
+    for batch in batches:
+        yield from zip(*[column.to_pylist() for column in batch.columns])
+
+
 def get_schema_and_convertor(column_specs):
     fields = []
     convertors = []
@@ -201,7 +221,7 @@ class ArrowRowsReader(BaseRowsReader):
         # Arrow enforces that all record batches have a consistent schema and that any
         # categorical columns use the same dictionary, so we only need to get the first
         # batch in order to validate
-        batch = self._reader.get_record_batch(0)
+        batch = self._get_first_record_batch()
         validate_columns(
             batch.schema.names, self.column_specs, self.allow_missing_columns
         )
@@ -247,21 +267,38 @@ class ArrowRowsReader(BaseRowsReader):
                 )
 
     def __iter__(self):
-        for i in range(self._reader.num_record_batches):
-            batch = self._reader.get_record_batch(i)
+        for columns in self.iter_column_batches():
             # Use `zip(*...)` to transpose from column-wise to row-wise
-            yield from zip(*(fetcher(batch) for fetcher in self._column_fetchers))
+            yield from zip(*(column.to_pylist() for column in columns))
+
+    def iter_column_batches(self):
+        """
+        Yield each record batch in the file as a list of `pyarrow.Array` objects, one
+        for each column in `column_specs`
+
+        This allows consumers which work with columns to read the data without creating
+        a Python object for every value, as iterating over rows does.
+        """
+        for batch in self._iter_record_batches():
+            yield [fetcher(batch) for fetcher in self._column_fetchers]
+
+    def _get_first_record_batch(self):
+        return self._reader.get_record_batch(0)
+
+    def _iter_record_batches(self):
+        for i in range(self._reader.num_record_batches):
+            yield self._reader.get_record_batch(i)
 
     @staticmethod
     def _create_fetcher(column_name):
         def fetcher(batch):
-            return batch.column(column_name).to_pylist()
+            return batch.column(column_name)
 
         return fetcher
 
     @staticmethod
     def _null_fetcher(batch):
-        return [None] * batch.num_rows
+        return pyarrow.nulls(batch.num_rows)
 
     def close(self):
         # `self._reader` does not need closing: it acts as a contextmanager, but its exit
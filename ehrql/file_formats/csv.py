@@ -1,12 +1,33 @@
 import csv
 import datetime
+import functools
 import gzip
+import os
+import re
 
+import pyarrow
+import pyarrow.compute
+import pyarrow.csv
+
+from ehrql.file_formats.arrow import ROWS_PER_BATCH, batch_and_transpose
 from ehrql.file_formats.base import (
     BaseRowsReader,
     FileValidationError,
     validate_columns,
 )
+from ehrql.utils.gzip_utils import open_gzip_for_writing_text
+
+
+GZIP_COMPRESSION_LEVEL = 6
+# Compression is usually the bottleneck when writing large gzipped files so by default
+# we compress on several threads, but not so many that we swamp shared machines
+GZIP_MAX_DEFAULT_THREADS = 4
+
+# Characters which cause `csv.writer` to quote a value
+CSV_QUOTED_CHARS = re.compile(r'[,"\r\n]')
+
+# Size in bytes of the blocks of CSV which Arrow parses and converts at a time
+ARROW_BLOCK_SIZE = 1024 * 1024
 
 
 def write_rows_csv(filename, rows, column_specs):
@@ -15,44 +36,63 @@ def write_rows_csv(filename, rows, column_specs):
         write_rows_csv_lines(f, rows, column_specs)
 
 
-def write_rows_csv_gz(filename, rows, column_specs):
+def write_rows_csv_gz(filename, rows, column_specs, compresslevel=None, threads=None):
+    if compresslevel is None:
+        compresslevel = GZIP_COMPRESSION_LEVEL
+    if threads is None:
+        threads = min(os.cpu_count() or 1, GZIP_MAX_DEFAULT_THREADS)
     # Set `newline` as per Python docs: https://docs.python.org/3/library/csv.html#id3
-    with gzip.open(filename, "wt", newline="", compresslevel=6) as f:
+    with open_gzip_for_writing_text(
+        filename, compresslevel=compresslevel, threads=threads, newline=""
+    ) as f:
         write_rows_csv_lines(f, rows, column_specs)
 
 
 def write_rows_csv_lines(fileobj, rows, column_specs):
     headers = list(column_specs.keys())
-    format_row = create_row_formatter(column_specs.values())
+    formatters = [create_column_formatter(spec) for spec in column_specs.values()]
     writer = csv.writer(fileobj)
     writer.writerow(headers)
-    writer.writerows(map(format_row, rows))
-
-
-def create_row_formatter(column_specs):
-    formatters = [create_column_formatter(spec) for spec in column_specs]
-    return lambda row: [f(value) for f, value in zip(formatters, row)]
+    # Formatting and writing values one at a time is slow, so instead we format whole
+    # columns at once and join them into lines ourselves. Provided no values need
+    # quoting this gives exactly the output `csv.writer` would; if they do, we leave
+    # it to `csv.writer` to quote them.
+    for columns in batch_and_transpose(rows, ROWS_PER_BATCH):
+        formatted = [format_(column) for format_, column in zip(formatters, columns)]
+        if needs_quoting(formatted):
+            writer.writerows(zip(*formatted))
+        else:
+            lines = list(map(",".join, zip(*formatted)))
+            # Add a line terminator after the final line
+            lines.append("")
+            fileobj.write("\r\n".join(lines))
 
 
 def create_column_formatter(spec):
     # Most types naturally format themselves as we'd like in CSV
     if spec.type in (int, float, str, datetime.date):
-        return identity
+        return format_column
     # But we need special handling for booleans
     elif spec.type is bool:
-        return format_bool
+        return format_bool_column
     else:
         assert False, f"Unhandled type: {spec.type}"
 
 
-def identity(value):
-    return value
+def format_column(values):
+    return ["" if value is None else str(value) for value in values]
+
 
+def format_bool_column(values):
+    return ["" if value is None else "T" if value else "F" for value in values]
 
-def format_bool(value):
-    if value is None:
-        return ""
-    return "T" if value else "F"
+
+def needs_quoting(columns):
+    # `csv.writer` quotes values containing any of these characters, and also an empty
+    # value on its own in a row (so it's not mistaken for a blank line)
+    if len(columns) == 1 and "" in columns[0]:
+        return True
+    return any(CSV_QUOTED_CHARS.search("".join(column)) for column in columns)
 
 
 class BaseCSVRowsReader(BaseRowsReader):
@@ -64,31 +104,232 @@ class BaseCSVRowsReader(BaseRowsReader):
             pass
 
     def __iter__(self):
-        self._fileobj.seek(0)
-        reader = csv.reader(self._fileobj)
-        headers = next(reader)
+        headers = self._read_headers()
         validate_columns(
             headers, self.column_specs, allow_missing_columns=self.allow_missing_columns
         )
-        row_parser = create_row_parser(headers, self.column_specs)
-        for n, row in enumerate(reader, start=1):
+        # Parsing and converting values in Python is slow, so we have Arrow convert
+        # whole blocks of the file at a time. Arrow is stricter than Python about the
+        # values it accepts so if it fails on a block (which it will if the block
+        # contains any invalid values) we hand that block, and the rest of the file,
+        # over to the Python parsers. These either handle the values Arrow couldn't or
+        # produce the appropriate error.
+        rows_read = 0
+        batches = self._iter_column_batches(headers)
+        while True:
             try:
-                yield row_parser(row)
-            except ValueError as e:
-                raise FileValidationError(f"'{self.filename}', row {n}: {e}") from None
+                columns, num_rows = next(batches)
+            except StopIteration:
+                return
+            except ValueError:
+                break
+            yield from zip(*columns)
+            rows_read += num_rows
+        yield from self._iter_rows_with_python(headers, skip=rows_read)
+
+    def _read_headers(self):
+        records = self._iter_records()
+        try:
+            return next(records)
+        finally:
+            records.close()
+
+    def _iter_records(self):
+        with self._open_text() as fileobj:
+            yield from csv.reader(fileobj)
+
+    def _iter_rows_with_python(self, headers, skip):
+        records = self._iter_records()
+        try:
+            # Skip headers
+            next(records)
+            row_parser = create_row_parser(headers, self.column_specs)
+            for n, row in enumerate(records, start=1):
+                if n <= skip:
+                    continue
+                try:
+                    yield row_parser(row)
+                except ValueError as e:
+                    raise FileValidationError(
+                        f"'{self.filename}', row {n}: {e}"
+                    ) from None
+        finally:
+            records.close()
+
+    def _iter_column_batches(self, headers):
+        """
+        Yield a list of columns (one for each column in `column_specs`) and a row count
+        for each block of the file, raising ValueError if Arrow can't convert a block
+        """
+        present = [name for name in self.column_specs if name in headers]
+        # Arrow can't tell us how many values each row has unless we read at least one
+        # column, so leave the (rare and useless) case of reading no columns to Python
+        if not present:
+            raise ValueError("no columns to read")
+        convertors = {
+            name: create_column_convertor(name, self.column_specs[name])
+            for name in present
+        }
+        with self._open_binary() as source:
+            yield from self._iter_converted_batches(source, present, convertors)
+
+    def _iter_converted_batches(self, source, present, convertors):
+        reader = pyarrow.csv.open_csv(
+            source,
+            # We may stop reading part way through the file, and close it, at any point
+            # so we don't want Arrow reading ahead on another thread
+            read_options=pyarrow.csv.ReadOptions(
+                use_threads=False, block_size=ARROW_BLOCK_SIZE
+            ),
+            # Match the behaviour of the `csv` module
+            parse_options=pyarrow.csv.ParseOptions(
+                newlines_in_values=True, ignore_empty_lines=False
+            ),
+            # Read everything as strings and do the conversion ourselves
+            convert_options=pyarrow.csv.ConvertOptions(
+                column_types=dict.fromkeys(present, pyarrow.string()),
+                include_columns=present,
+                strings_can_be_null=False,
+            ),
+        )
+        for batch in reader:
+            is_empty = [pyarrow.compute.equal(column, "") for column in batch.columns]
+            # Arrow reads a blank line as a row of empty strings, whereas Python treats
+            # it as an error, so let Python handle anything that looks like a blank line
+            all_empty = functools.reduce(pyarrow.compute.and_, is_empty)
+            if pyarrow.compute.any(all_empty).as_py():
+                raise ValueError("possible blank line")
+            converted = {
+                name: convertors[name](column, column_is_empty)
+                for name, column, column_is_empty in zip(
+                    batch.schema.names, batch.columns, is_empty
+                )
+            }
+            columns = [
+                converted.get(name, [None] * batch.num_rows)
+                for name in self.column_specs
+            ]
+            yield columns, batch.num_rows
+
+    def _open(self):
+        # The file is opened afresh each time we iterate over it, using the methods
+        # below: Arrow needs one of its own native file objects (it doesn't play well
+        # with Python file objects) and the Python parsers need a text file
+        pass
+
+    def _open_binary(self):
+        raise NotImplementedError()
+
+    def _open_text(self):
+        raise NotImplementedError()
 
     def close(self):
-        self._fileobj.close()
+        pass
 
 
 class CSVRowsReader(BaseCSVRowsReader):
-    def _open(self):
-        self._fileobj = open(self.filename, newline="")
+    def _open_binary(self):
+        return pyarrow.input_stream(str(self.filename), compression=None)
+
+    def _open_text(self):
+        return open(self.filename, newline="")
 
 
 class CSVGZRowsReader(BaseCSVRowsReader):
-    def _open(self):
-        self._fileobj = gzip.open(self.filename, "rt", newline="")
+    # Note that both Arrow and `gzip` transparently handle the multi-member files
+    # produced by compressing on several threads
+    def _open_binary(self):
+        return pyarrow.input_stream(str(self.filename), compression="gzip")
+
+    def _open_text(self):
+        return gzip.open(self.filename, "rt", newline="")
+
+
+# Patterns matching the values which Arrow converts exactly as Python would. Arrow
+# accepts some values which Python doesn't (e.g. hex integers) and vice versa (e.g.
+# whitespace around numbers) so we only let Arrow convert values we know are safe.
+ARROW_CONVERTIBLE_PATTERNS = {
+    int: r"^-?[0-9]+$",
+    float: r"^-?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$",
+    datetime.date: r"^[0-9]{4}-[0-9]{2}-[0-9]{2}$",
+}
+
+# Arrow type for each column type, plus a placeholder we can use in place of NULLs
+ARROW_TYPES = {
+    bool: (pyarrow.bool_(), False),
+    int: (pyarrow.int64(), 0),
+    float: (pyarrow.float64(), 0.0),
+    str: (pyarrow.string(), ""),
+    datetime.date: (pyarrow.date32(), datetime.date(1970, 1, 1)),
+}
+
+
+def create_column_convertor(name, spec):
+    """
+    Return a function which converts an Arrow array of strings (plus a mask of which
+    are empty) into a list of values of the type given by `spec`, raising ValueError
+    if it can't do so exactly as `create_column_parser` would
+    """
+    type_, fill_value = ARROW_TYPES[spec.type]
+    if spec.type in ARROW_CONVERTIBLE_PATTERNS:
+        pattern = ARROW_CONVERTIBLE_PATTERNS[spec.type]
+
+        def convert(array):
+            check(array, pyarrow.compute.match_substring_regex(array, pattern))
+            # Arrow raises an `ArrowInvalid` (a subclass of ValueError) for values out
+            # of range e.g. invalid dates or integers which overflow
+            return pyarrow.compute.cast(array, type_)
+
+    elif spec.type is str:
+
+        def convert(array):
+            return array
+
+    elif spec.type is bool:
+
+        def convert(array):
+            check(array, pyarrow.compute.is_in(array, pyarrow.array(["T", "F"])))
+            return pyarrow.compute.equal(array, "T")
+
+    else:
+        assert False, f"Unhandled type: {spec.type}"
+
+    if spec.categories is not None:
+        category_array = pyarrow.array(spec.categories, type=type_)
+
+        def convert_and_validate(array, convert=convert):
+            converted = convert(array)
+            check(converted, pyarrow.compute.is_in(converted, category_array))
+            return converted
+
+        convert = convert_and_validate
+
+    def convertor(array, is_empty):
+        # We use empty string to encode None, see `create_column_parser`
+        if pyarrow.compute.any(is_empty).as_py():
+            if not spec.nullable:
+                raise ValueError(f"NULL value in non-nullable column '{name}'")
+            array = pyarrow.compute.if_else(is_empty, None, array)
+        return to_python_list(convert(array), fill_value)
+
+    return convertor
+
+
+def check(array, is_valid):
+    # NULL values are always valid, and an empty array is trivially so
+    is_valid = pyarrow.compute.or_kleene(is_valid, pyarrow.compute.is_null(array))
+    if not pyarrow.compute.all(is_valid, min_count=0).as_py():
+        raise ValueError("value not convertible by Arrow")
+
+
+def to_python_list(array, fill_value):
+    # Going via NumPy is many times faster than `array.to_pylist()`, but NumPy has no
+    # NULL so we need to fill these in with a placeholder and put them back afterwards
+    values = array.fill_null(fill_value).to_numpy(zero_copy_only=False)
+    if array.null_count:
+        values = values.astype(object)
+        values[array.is_null().to_numpy(zero_copy_only=False)] = None
+    return values.tolist()
 
 
 def create_row_parser(headers, column_specs):
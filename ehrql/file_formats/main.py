@@ -1,34 +1,50 @@
 import contextlib
+import functools
 import urllib.parse
 
-from ehrql.file_formats.arrow import (
-    ArrowRowsReader,
-    write_rows_arrow,
-)
 from ehrql.file_formats.base import FileValidationError
-from ehrql.file_formats.console import write_rows_console, write_tables_console
-from ehrql.file_formats.csv import (
-    CSVGZRowsReader,
-    CSVRowsReader,
-    write_rows_csv,
-    write_rows_csv_gz,
-)
 from ehrql.utils.itertools_utils import eager_iterator
+from ehrql.utils.module_utils import import_attribute
 
 
+# The rows writer and reader for each format. These are given as dotted paths and only
+# imported when needed because the modules implementing them depend on `pyarrow`, which
+# is slow to import and not needed just to load a definition file.
 FILE_FORMATS = {
-    ".arrow": (write_rows_arrow, ArrowRowsReader),
-    ".csv": (write_rows_csv, CSVRowsReader),
-    ".csv.gz": (write_rows_csv_gz, CSVGZRowsReader),
+    ".arrow": (
+        "ehrql.file_formats.arrow.write_rows_arrow",
+        "ehrql.file_formats.arrow.ArrowRowsReader",
+    ),
+    ".csv": (
+        "ehrql.file_formats.csv.write_rows_csv",
+        "ehrql.file_formats.csv.CSVRowsReader",
+    ),
+    ".csv.gz": (
+        "ehrql.file_formats.csv.write_rows_csv_gz",
+        "ehrql.file_formats.csv.CSVGZRowsReader",
+    ),
+    ".parquet": (
+        "ehrql.file_formats.parquet.write_rows_parquet",
+        "ehrql.file_formats.parquet.ParquetRowsReader",
+    ),
+}
+
+# Formats which can be written directly from `pyarrow.RecordBatch`es, without
+# converting them to rows first
+BATCH_WRITERS = {
+    ".arrow": "ehrql.file_formats.arrow.write_batches_arrow",
+    ".parquet": "ehrql.file_formats.parquet.write_batches_parquet",
 }
 
 
-def write_rows(filename, rows, column_specs):
+def write_rows(filename, rows, column_specs, environ=None):
     if filename is None:
+        from ehrql.file_formats.console import write_rows_console
+
         return write_rows_console(rows, column_specs)
 
     extension = get_file_extension(filename)
-    writer = FILE_FORMATS[extension][0]
+    writer = get_writer(extension, environ or {})
     # `rows` is often a generator which won't actually execute until we start consuming
     # it. We want to make sure we trigger any potential errors (or relevant log output)
     # before we create the output file, write headers etc. But we don't want to read the
@@ -39,13 +55,58 @@ def write_rows(filename, rows, column_specs):
     writer(filename, rows, column_specs)
 
 
+def write_batches(filename, batches, column_specs, environ=None):
+    """
+    As `write_rows` but takes an iterator of `pyarrow.RecordBatch`es matching
+    `column_specs`, which are converted to rows only if the output format requires it
+    """
+    if filename is None or get_file_extension(filename) not in BATCH_WRITERS:
+        from ehrql.file_formats.arrow import record_batches_to_rows
+
+        rows = record_batches_to_rows(batches)
+        return write_rows(filename, rows, column_specs, environ=environ)
+
+    extension = get_file_extension(filename)
+    writer = import_attribute(BATCH_WRITERS[extension])
+    writer = functools.partial(writer, **get_writer_options(extension, environ or {}))
+    # See `write_rows` above
+    batches = eager_iterator(batches)
+    filename.parent.mkdir(parents=True, exist_ok=True)
+    writer(filename, batches, column_specs)
+
+
+def get_writer(extension, environ):
+    """
+    Return the rows writer for `extension`, configured with any options supplied in
+    `environ`
+    """
+    writer = import_attribute(FILE_FORMATS[extension][0])
+    options = get_writer_options(extension, environ)
+    if options:
+        writer = functools.partial(writer, **options)
+    return writer
+
+
+def get_writer_options(extension, environ):
+    options = {}
+    if extension == ".csv.gz":
+        if "EHRQL_CSV_GZ_COMPRESSION_LEVEL" in environ:
+            options["compresslevel"] = int(environ["EHRQL_CSV_GZ_COMPRESSION_LEVEL"])
+        if "EHRQL_CSV_GZ_THREADS" in environ:
+            options["threads"] = int(environ["EHRQL_CSV_GZ_THREADS"])
+    elif extension == ".parquet":
+        if "EHRQL_PARQUET_ROW_GROUP_SIZE" in environ:
+            options["row_group_size"] = int(environ["EHRQL_PARQUET_ROW_GROUP_SIZE"])
+    return options
+
+
 def read_rows(filename, column_specs, allow_missing_columns=False):
     extension = get_file_extension(filename)
     if extension not in FILE_FORMATS:
         raise FileValidationError(f"Unsupported file type: {extension}")
     if not filename.is_file():
         raise FileValidationError(f"Missing file: {filename}")
-    reader = FILE_FORMATS[extension][1]
+    reader = import_attribute(FILE_FORMATS[extension][1])
     return reader(filename, column_specs, allow_missing_columns=allow_missing_columns)
 
 
@@ -94,8 +155,22 @@ def read_tables(filename, table_specs, allow_missing_columns=False):
         ]
 
 
-def write_tables(filename, tables, table_specs):
+def write_tables(filename, tables, table_specs, as_batches=False, environ=None):
+    """
+    Write each of `tables` to `filename` using the corresponding column specs from
+    `table_specs`
+
+    If `as_batches` is True then each table is an iterator of `pyarrow.RecordBatch`es
+    rather than of rows (see `output_supports_record_batches`).
+    """
+    write_table = write_batches if as_batches else write_rows
+
     if filename is None:
+        from ehrql.file_formats.arrow import record_batches_to_rows
+        from ehrql.file_formats.console import write_tables_console
+
+        if as_batches:
+            tables = (record_batches_to_rows(batches) for batches in tables)
         return write_tables_console(tables, table_specs)
 
     # If we've got a single-table output file and only a single table to write then
@@ -104,7 +179,7 @@ def write_tables(filename, tables, table_specs):
         if len(table_specs) == 1:
             column_specs = list(table_specs.values())[0]
             rows = next(iter(tables))
-            return write_rows(filename, rows, column_specs)
+            return write_table(filename, rows, column_specs, environ=environ)
         else:
             raise FileValidationError(
                 f"Attempting to write {len(table_specs)} tables, but output only "
@@ -117,7 +192,7 @@ def write_tables(filename, tables, table_specs):
     filename, extension = split_directory_and_extension(filename)
     for rows, (table_name, column_specs) in zip(tables, table_specs.items()):
         table_filename = get_table_filename(filename, table_name, extension)
-        write_rows(table_filename, rows, column_specs)
+        write_table(table_filename, rows, column_specs, environ=environ)
 
 
 def get_file_extension(filename):
@@ -180,6 +255,20 @@ def output_filename_supports_multiple_tables(filename):
     return extension != ""
 
 
+def output_supports_record_batches(filename):
+    """
+    Return whether the output format of `filename` can be written directly from
+    `pyarrow.RecordBatch`es
+    """
+    if filename is None:
+        return False
+    elif output_filename_supports_multiple_tables(filename):
+        extension = split_directory_and_extension(filename)[1]
+    else:
+        extension = get_file_extension(filename)
+    return extension in BATCH_WRITERS
+
+
 def get_table_filename(base_filename, table_name, extension):
     # Use URL quoting as an easy way of escaping any potentially problematic characters
     # in filenames
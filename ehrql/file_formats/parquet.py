@@ -0,0 +1,83 @@
+import pyarrow
+import pyarrow.parquet
+
+from ehrql.file_formats.arrow import (
+    ArrowRowsReader,
+    get_schema_and_convertor,
+    rows_to_record_batches,
+)
+from ehrql.file_formats.base import FileValidationError
+
+
+# Parquet files are divided into row groups, each of which stores summary statistics
+# for its columns which readers can use to skip groups they don't need. Larger groups
+# compress better, and smaller groups make this skipping more effective and reduce
+# the memory needed to stream results to disk. Our default matches the batch size we
+# use for Arrow files (see `arrow.ROWS_PER_BATCH` for the rationale), but it can be
+# configured via the `EHRQL_PARQUET_ROW_GROUP_SIZE` environment variable (see
+# `main.get_writer_options`).
+ROWS_PER_ROW_GROUP = 64000
+
+
+def write_rows_parquet(filename, rows, column_specs, row_group_size=None):
+    if row_group_size is None:
+        row_group_size = ROWS_PER_ROW_GROUP
+    batches = rows_to_record_batches(rows, column_specs, row_group_size)
+    write_batches_parquet(filename, batches, column_specs, row_group_size)
+
+
+def write_batches_parquet(filename, batches, column_specs, row_group_size=None):
+    if row_group_size is None:
+        row_group_size = ROWS_PER_ROW_GROUP
+    schema, _ = get_schema_and_convertor(column_specs)
+
+    with pyarrow.parquet.ParquetWriter(
+        str(filename), schema, compression="zstd"
+    ) as writer:
+        for record_batch in batches:
+            writer.write_batch(record_batch, row_group_size=row_group_size)
+
+
+class ParquetRowsReader(ArrowRowsReader):
+    # The file is parsed differently but, once we've got record batches out of it,
+    # validation and iteration work much as they do for Arrow files. The exception is
+    # that each row group can have its own dictionary for categorical columns, so we
+    # can't validate categories just by checking the first batch.
+    def _open(self):
+        self._fileobj = pyarrow.memory_map(str(self.filename), "rb")
+        self._reader = pyarrow.parquet.ParquetFile(self._fileobj)
+        self._column_fetchers = []
+        # Parquet is a columnar format so we can avoid reading any columns we don't need
+        schema = self._reader.schema_arrow
+        self._columns = [name for name in self.column_specs if name in schema.names]
+
+    def _get_first_record_batch(self):
+        for batch in self._read_record_batches():
+            return batch
+        # A file with no rows still has a schema we can validate against
+        schema = self._reader.schema_arrow
+        fields = [schema.field(name) for name in self._columns]
+        return pyarrow.RecordBatch.from_arrays(
+            [pyarrow.array([], type=field.type) for field in fields],
+            schema=pyarrow.schema(fields),
+        )
+
+    def _iter_record_batches(self):
+        for batch in self._read_record_batches():
+            self._validate_categories(batch)
+            yield batch
+
+    def _read_record_batches(self):
+        return self._reader.iter_batches(
+            batch_size=ROWS_PER_ROW_GROUP, columns=self._columns
+        )
+
+    def _validate_categories(self, batch):
+        errors = []
+        for name, spec in self.column_specs.items():
+            if spec.categories is None or name not in batch.schema.names:
+                continue
+            if error := self._validate_column(name, batch.column(name), spec):
+                errors.append(error)
+        if errors:
+            raise FileValidationError("\n".join(errors))
@@ -0,0 +1,230 @@
+"""
+Cache of serialized definitions, so we can skip running a definition file which we've
+already run with exactly the same inputs
+
+Each entry is keyed by the definition file, the user arguments and the environment in
+which it was run, and records every file the definition read (its own source, any local
+modules it imported, any codelists or other data files it opened, any directories it
+listed and any paths whose existence it checked) along with a hash of their contents.
+An entry is only used if all of those inputs are unchanged.
+
+Note that we can't detect a definition's dependence on anything other than the files it
+reads (e.g. the current date, or files examined by code outside of Python which doesn't
+go via `os.stat`) so the cache is only enabled if explicitly configured.
+"""
+
+import contextlib
+import hashlib
+import importlib.util
+import json
+import os
+import site
+import stat
+import sys
+from pathlib import Path
+
+import ehrql
+
+
+# Paths of the files and directories read while recording, or None if not recording
+RECORDED_PATHS = None
+# Paths whose existence was checked while recording, or None if not recording
+CHECKED_PATHS = None
+AUDIT_HOOK_INSTALLED = False
+
+# Python doesn't raise audit events when a file is stat-ed, so to catch checks like
+# `Path(...).exists()` or `os.path.isfile()` we wrap these functions while recording
+STAT_FUNCTIONS = ("stat", "lstat")
+
+
+def get_cache_file(cache_dir, definition_file, user_args):
+    key = json.dumps(
+        [
+            get_ehrql_version(),
+            sys.version,
+            str(Path.cwd()),
+            str(Path(definition_file).resolve()),
+            list(user_args),
+        ]
+    )
+    return cache_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.json"
+
+
+def get_ehrql_version():
+    # A released version of ehrQL is identified by its version string, but in a
+    # development checkout this is always "dev" whatever the state of the source, so we
+    # identify it by the contents of the source instead
+    if ehrql.__version__ != "dev":
+        return ehrql.__version__
+    return f"dev-{get_source_hash(Path(ehrql.__file__).parent)}"
+
+
+def get_source_hash(directory):
+    source_hash = hashlib.sha256()
+    for path in sorted(directory.rglob("*")):
+        if path.is_file() and "__pycache__" not in path.parts:
+            source_hash.update(str(path.relative_to(directory)).encode())
+            source_hash.update(path.read_bytes())
+    return source_hash.hexdigest()
+
+
+def read_cache_entry(cache_file):
+    """
+    Return the entry stored in `cache_file` (a dict with keys `definition`, `stderr` and
+    `inputs`) or None if there is no entry or any of its inputs have changed
+    """
+    try:
+        entry = json.loads(cache_file.read_text())
+    except FileNotFoundError:
+        return None
+    for path, fingerprint in entry["inputs"]:
+        if fingerprint.startswith("exists:"):
+            current_fingerprint = get_existence_fingerprint(path)
+        else:
+            current_fingerprint = get_fingerprint(path)
+        if current_fingerprint != fingerprint:
+            return None
+    return entry
+
+
+def write_cache_entry(cache_file, entry):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file and then move it into place so that concurrent
+    # processes never see a partially written file
+    tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    tmp_file.write_text(json.dumps(entry))
+    tmp_file.replace(cache_file)
+
+
+@contextlib.contextmanager
+def record_inputs():
+    """
+    Record the files read within the context, yielding a list which is populated with
+    `[path, fingerprint]` pairs for each of them when the context exits
+
+    Paths which were only checked for existence (e.g. by `os.path.exists()`, or by
+    `Path.resolve()` for each of the path's parents) are fingerprinted by their type
+    rather than by their contents.
+
+    Files belonging to the Python installation or to ehrQL itself are not recorded:
+    these are covered by the versions included in the cache key.
+    """
+    global RECORDED_PATHS, CHECKED_PATHS, AUDIT_HOOK_INSTALLED
+    # Audit hooks can't be removed so we install ours just once and use a global to
+    # control whether it records anything
+    if not AUDIT_HOOK_INSTALLED:
+        sys.addaudithook(audit_hook)
+        AUDIT_HOOK_INSTALLED = True
+    inputs = []
+    RECORDED_PATHS = set()
+    CHECKED_PATHS = set()
+    original_functions = {name: getattr(os, name) for name in STAT_FUNCTIONS}
+    for name, function in original_functions.items():
+        setattr(os, name, recording_stat_function(function))
+    try:
+        yield inputs
+    finally:
+        for name, function in original_functions.items():
+            setattr(os, name, function)
+        paths, checked_paths = RECORDED_PATHS, CHECKED_PATHS
+        RECORDED_PATHS = CHECKED_PATHS = None
+    excluded = get_excluded_directories()
+    paths = {get_source_path(path) for path in paths} - {None}
+    paths = {
+        path
+        for path in paths
+        if not any(path.startswith(directory) for directory in excluded)
+    }
+    checked_paths = {
+        path
+        for path in checked_paths - paths
+        if not any(path.startswith(directory) for directory in excluded)
+    }
+    inputs.extend(get_input_fingerprints(paths, checked_paths))
+
+
+def audit_hook(event, args):
+    if RECORDED_PATHS is None or event not in ("open", "os.listdir", "os.scandir"):
+        return
+    path = args[0]
+    # Listing with no argument lists the current directory
+    if path is None:
+        path = "."
+    record_path(RECORDED_PATHS, path)
+
+
+def recording_stat_function(function):
+    def wrapper(path, *args, **kwargs):
+        if CHECKED_PATHS is not None:
+            record_path(CHECKED_PATHS, path)
+        return function(path, *args, **kwargs)
+
+    return wrapper
+
+
+def record_path(recorded_paths, path):
+    # Files may also be accessed by descriptor, which we can ignore as the file must
+    # already have been opened by path
+    if isinstance(path, str | bytes | os.PathLike):
+        recorded_paths.add(os.path.abspath(os.fsdecode(path)))
+
+
+def get_source_path(path):
+    # Modules may be imported from cached bytecode without their source file ever being
+    # opened, so we record the source file instead (ignoring bytecode without source)
+    if path.endswith(".pyc"):
+        try:
+            return importlib.util.source_from_cache(path)
+        except ValueError:
+            return None
+    return path
+
+
+def get_excluded_directories():
+    directories = {
+        sys.prefix,
+        sys.base_prefix,
+        sys.exec_prefix,
+        *site.getsitepackages(),
+        site.getusersitepackages(),
+        os.path.dirname(ehrql.__file__),
+    }
+    return tuple(os.path.join(os.path.abspath(d), "") for d in directories)
+
+
+def get_input_fingerprints(paths, checked_paths=()):
+    return sorted(
+        [
+            *([path, get_fingerprint(path)] for path in paths),
+            *([path, get_existence_fingerprint(path)] for path in checked_paths),
+        ]
+    )
+
+
+def get_fingerprint(path):
+    try:
+        mode = os.stat(path).st_mode
+        if stat.S_ISDIR(mode):
+            listing = "\n".join(sorted(os.listdir(path)))
+            return "dir:" + hashlib.sha256(listing.encode()).hexdigest()
+        elif stat.S_ISREG(mode):
+            with open(path, "rb") as f:
+                return "file:" + hashlib.file_digest(f, "sha256").hexdigest()
+        else:
+            # Devices and the like (e.g. `/dev/urandom`) don't have meaningful contents
+            return "other"
+    except OSError:
+        return "unavailable"
+
+
+def get_existence_fingerprint(path):
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return "unavailable"
+    if stat.S_ISDIR(mode):
+        return "exists:dir"
+    elif stat.S_ISREG(mode):
+        return "exists:file"
+    else:
+        return "exists:other"
@@ -0,0 +1,50 @@
+"""
+Entrypoint for a subprocess which imports ehrQL ahead of time and then waits to be sent
+the arguments of a single ehrQL command to run
+
+This lets us start the subprocess used to load the next definition file while we're
+still busy with the current one (see `loaders.get_worker_process`) so that we don't pay
+the cost of starting Python and importing ehrQL each time. Each process still runs just
+one command, under exactly the same isolation as before.
+"""
+
+import json
+import os
+import sys
+
+from ehrql.__main__ import main
+
+
+def run():
+    line = sys.stdin.readline()
+    # The parent process closes our stdin without sending anything if it no longer needs
+    # us
+    if not line:
+        return
+    try:
+        main(json.loads(line), environ=os.environ)
+    except SystemExit as exc:
+        exit_code = get_exit_code(exc.code)
+    else:
+        exit_code = 0
+    # Exit without the usual interpreter clean up, which takes a surprisingly large
+    # fraction of the time taken to run a typical definition file and serves no purpose
+    # here
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os._exit(exit_code)
+
+
+def get_exit_code(code):
+    # Handle the argument to `sys.exit()` just as the interpreter would
+    if code is None:
+        return 0
+    elif isinstance(code, int):
+        return code
+    else:
+        print(code, file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":  # pragma: no cover
+    run()
@@ -1,4 +1,6 @@
+import atexit
 import importlib.util
+import json
 import os
 import pathlib
 import subprocess
@@ -7,6 +9,7 @@ import tempfile
 import textwrap
 
 import ehrql
+from ehrql import loader_cache
 from ehrql.debugger import activate_debug_context
 from ehrql.exceptions import DefinitionError, get_exit_code_for_exception
 from ehrql.loader_types import ModuleDetails
@@ -170,15 +173,21 @@ def load_definition_in_subprocess(
     user_args,
     environ,
 ):
-    serialized_definition = run_ehrql_command_in_subprocess(
-        [
-            "serialize-definition",
-            definition_file,
-            "--",
-            *user_args,
-        ],
-        environ,
-    )
+    cache_dir = environ.get("EHRQL_DEFINITION_CACHE_DIR")
+    if cache_dir is not None:
+        serialized_definition = serialize_definition_via_cache(
+            definition_file, user_args, environ, pathlib.Path(cache_dir)
+        )
+    else:
+        serialized_definition = run_ehrql_command_in_subprocess(
+            [
+                "serialize-definition",
+                definition_file,
+                "--",
+                *user_args,
+            ],
+            environ,
+        )
 
     return deserialize(
         serialized_definition,
@@ -187,17 +196,52 @@ def load_definition_in_subprocess(
     )
 
 
+def serialize_definition_via_cache(definition_file, user_args, environ, cache_dir):
+    """
+    Return the serialized definition, reusing the output of an earlier run if none of
+    the files the definition read have changed since (see `loader_cache`)
+    """
+    cache_file = loader_cache.get_cache_file(cache_dir, definition_file, user_args)
+    entry = loader_cache.read_cache_entry(cache_file)
+    if entry is None:
+        stdout, stderr = get_ehrql_command_output(
+            [
+                "serialize-definition",
+                "--record-inputs",
+                definition_file,
+                "--",
+                *user_args,
+            ],
+            environ,
+        )
+        entry = json.loads(stdout) | {"stderr": stderr}
+        loader_cache.write_cache_entry(cache_file, entry)
+    # Pass through any warnings or logs, just as we do when running the subprocess
+    print(entry["stderr"], file=sys.stderr, end="")
+    return entry["definition"]
+
+
 def run_ehrql_command_in_subprocess(args, environ):
+    stdout, stderr = get_ehrql_command_output(args, environ)
+    # Pass through any warnings or logs generated by the subprocess
+    print(stderr, file=sys.stderr, end="")
+    return stdout
+
+
+def get_ehrql_command_output(args, environ):
+    """
+    Run an ehrQL command in a subprocess and return its stdout and stderr, raising a
+    DefinitionError if it fails
+    """
     # We always run code isolated if we can (even if we don't need to) for parity with
     # production so users have the best chance of catching potential issues early
+    command = [sys.executable, "-m", "ehrql.loader_worker"]
     if isolation_is_supported():
-        subprocess_run = subprocess_run_isolated
+        command = get_isolated_command(command)
     else:
         # But where isolation is not available or required we fallback to running in a
         # non-isolated subprocess so ehrQL is still usable
-        if not isolation_is_required(environ):
-            subprocess_run = subprocess.run
-        else:
+        if isolation_is_required(environ):
             # Obviously if isolation is required and unavailable we should stop
             raise RuntimeError(
                 "The current environment does not support the 'pledge' isolation "
@@ -212,29 +256,83 @@ def run_ehrql_command_in_subprocess(args, environ):
                 "answer is 'no'."
             )
 
-    result = subprocess_run(
-        [sys.executable, "-m", "ehrql", *args],
-        env={
-            # Our Docker image relies on PYTHONPATH to make the ehrql package available
-            "PYTHONPATH": os.environ.get("PYTHONPATH", ""),
-            # Our entrypoint will emit warnings if we don't set this
-            "PYTHONHASHSEED": "0",
-            # `pledge` requires this to be set
-            "TMPDIR": tempfile.gettempdir(),
-        },
-        text=True,
-        capture_output=True,
-    )
-    if result.returncode != 0:
+    process = get_worker_process(command)
+    stdout, stderr = process.communicate(json.dumps([str(arg) for arg in args]) + "\n")
+    if process.returncode != 0:
         raise DefinitionError(
-            result.stderr.removesuffix("\n"),
-            exit_code=result.returncode,
+            stderr.removesuffix("\n"),
+            exit_code=process.returncode,
         )
+
+    return stdout, stderr
+
+
+# A worker process (see `loader_worker`) started in advance of being needed, along with
+# the command, working directory and environment it was started with
+SPARE_WORKER = None
+# Whether we've already started a worker process in this process
+WORKER_STARTED = False
+
+
+def get_worker_process(command):
+    """
+    Return a worker process running `command`, ready to be sent the arguments of an
+    ehrQL command
+
+    We use the spare worker if it's suitable and, once we've seen more than one call,
+    start a replacement so that the next call doesn't have to wait for Python to start
+    up and import ehrQL. Most commands (e.g. `generate-dataset`) load just a single
+    definition, and for these a spare worker would only compete for CPU with the real
+    one before being killed unused.
+
+    Note that forking pre-started workers, as `multiprocessing`'s "forkserver" does,
+    isn't an option here: it would require granting the "proc" promise to `pledge`,
+    which the forked processes would inherit.
+    """
+    global SPARE_WORKER, WORKER_STARTED
+    env = {
+        # Our Docker image relies on PYTHONPATH to make the ehrql package available
+        "PYTHONPATH": os.environ.get("PYTHONPATH", ""),
+        # Our entrypoint will emit warnings if we don't set this
+        "PYTHONHASHSEED": "0",
+        # `pledge` requires this to be set
+        "TMPDIR": tempfile.gettempdir(),
+    }
+    key = (command, os.getcwd(), env)
+    if (
+        SPARE_WORKER is not None
+        and SPARE_WORKER[0] == key
+        and SPARE_WORKER[1].poll() is None
+    ):
+        process = SPARE_WORKER[1]
     else:
-        # Pass through any warnings or logs generated by the subprocess
-        print(result.stderr, file=sys.stderr, end="")
+        stop_spare_worker()
+        process = start_worker_process(command, env)
+    if WORKER_STARTED:
+        SPARE_WORKER = (key, start_worker_process(command, env))
+    WORKER_STARTED = True
+    return process
+
+
+def start_worker_process(command, env):
+    return subprocess.Popen(
+        command,
+        env=env,
+        text=True,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
 
-    return result.stdout
+
+@atexit.register
+def stop_spare_worker():
+    global SPARE_WORKER
+    if SPARE_WORKER is not None:
+        process = SPARE_WORKER[1]
+        process.kill()
+        process.communicate()
+        SPARE_WORKER = None
 
 
 def isolation_is_supported():
@@ -247,32 +345,33 @@ def isolation_is_supported():
 
 
 def subprocess_run_isolated(args, **kwargs):
-    return subprocess.run(
-        [
-            PLEDGE_BIN,
-            # Configure "pledge" to restrict avilable operations to the minimum needed
-            # to execute a definition file and serialize the result, which are:
-            # - stdio: allow stdio and benign system calls
-            # - rpath: read-only path ops
-            # - prot_exec: allow creating executable memory
-            #
-            # In particular, anything related to networking or socket communication,
-            # executing other processes, and any filesystem modifications are all
-            # disallowed. For a full list of the syscalls implied by these settings see:
-            # https://justine.lol/pledge/#promises
-            "-p",
-            "stdio rpath prot_exec",
-            # Use "unveil" to expose the filesystem read-only. Note that this still does
-            # not provide unfettered access to the /proc tree so in particular it's not
-            # possible to read other processes environment variables.
-            "-v",
-            "r:/",
-            # Quiet: don't log messages from pledge to stderr
-            "-q",
-            *args,
-        ],
-        **kwargs,
-    )
+    return subprocess.run(get_isolated_command(args), **kwargs)
+
+
+def get_isolated_command(args):
+    return [
+        PLEDGE_BIN,
+        # Configure "pledge" to restrict avilable operations to the minimum needed to
+        # execute a definition file and serialize the result, which are:
+        # - stdio: allow stdio and benign system calls
+        # - rpath: read-only path ops
+        # - prot_exec: allow creating executable memory
+        #
+        # In particular, anything related to networking or socket communication,
+        # executing other processes, and any filesystem modifications are all
+        # disallowed. For a full list of the syscalls implied by these settings see:
+        # https://justine.lol/pledge/#promises
+        "-p",
+        "stdio rpath prot_exec",
+        # Use "unveil" to expose the filesystem read-only. Note that this still does not
+        # provide unfettered access to the /proc tree so in particular it's not possible
+        # to read other processes environment variables.
+        "-v",
+        "r:/",
+        # Quiet: don't log messages from pledge to stderr
+        "-q",
+        *args,
+    ]
 
 
 def isolation_is_required(environ):
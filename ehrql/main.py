@@ -6,16 +6,12 @@ import sys
 from contextlib import nullcontext
 from pathlib import Path
 
-from ehrql import assurance
-from ehrql.dummy_data import DummyDataGenerator
-from ehrql.dummy_data_nextgen import DummyDataGenerator as NextGenDummyDataGenerator
-from ehrql.dummy_data_nextgen import (
-    DummyMeasuresDataGenerator as NextGenDummyMeasuresDataGenerator,
-)
+from ehrql import assurance, loader_cache
 from ehrql.exceptions import AssuranceTestError
 from ehrql.file_formats import (
     input_filename_supports_multiple_tables,
     output_filename_supports_multiple_tables,
+    output_supports_record_batches,
     read_rows,
     read_tables,
     split_directory_and_extension,
@@ -42,15 +38,18 @@ from ehrql.measures import (
     split_measure_results_into_tables,
 )
 from ehrql.permissions import enforce_permissions, enforce_permissions_for_dummy_data
-from ehrql.query_engines.local_file import LocalFileQueryEngine
-from ehrql.query_engines.sqlite import SQLiteQueryEngine
 from ehrql.query_model.column_specs import (
     get_column_specs_from_schema,
     get_table_specs,
 )
-from ehrql.query_model.graphs import graph_to_svg
 from ehrql.serializer import serialize
-from ehrql.utils.sqlalchemy_query_utils import clause_as_str
+
+
+# Note that query engines, dummy data generators and the like are imported within the
+# functions which use them. Between them they depend on `sqlalchemy`, `pyarrow`, `numpy`
+# and `networkx`, which are slow to import, and we don't want to pay that cost for
+# commands which don't need them (in particular `serialize-definition`, which we run in a
+# subprocess every time we load a definition file).
 
 
 log = logging.getLogger()
@@ -79,16 +78,20 @@ def generate_dataset(
         assure(test_data_file, environ=environ, user_args=user_args)
 
     table_specs = get_table_specs(dataset)
+    as_batches = False
 
     if dsn:
         enforce_permissions(dataset, environ)
         log.info("Generating dataset")
+        # Columnar output formats can be written straight from Arrow record batches
+        as_batches = output_supports_record_batches(output_file)
         results_tables = generate_dataset_with_dsn(
             dataset=dataset,
             dsn=dsn,
             backend_class=backend_class,
             query_engine_class=query_engine_class,
             environ=environ,
+            table_specs=table_specs if as_batches else None,
         )
     else:
         enforce_permissions_for_dummy_data(dataset, claimed_permissions)
@@ -99,14 +102,27 @@ def generate_dataset(
             table_specs=table_specs,
             dummy_data_file=dummy_data_file,
             dummy_tables_path=dummy_tables_path,
+            environ=environ,
         )
 
-    write_tables(output_file, results_tables, table_specs)
+    write_tables(
+        output_file,
+        results_tables,
+        table_specs,
+        as_batches=as_batches,
+        environ=environ,
+    )
 
 
 def generate_dataset_with_dsn(
-    *, dataset, dsn, backend_class, query_engine_class, environ
+    *, dataset, dsn, backend_class, query_engine_class, environ, table_specs=None
 ):
+    """
+    Return the results tables for `dataset` as iterators of rows or, if `table_specs`
+    are supplied, as iterators of `pyarrow.RecordBatch`es
+    """
+    from ehrql.query_engines.local_file import LocalFileQueryEngine
+
     query_engine = get_query_engine(
         dsn,
         backend_class,
@@ -114,18 +130,29 @@ def generate_dataset_with_dsn(
         environ,
         default_query_engine_class=LocalFileQueryEngine,
     )
-    return query_engine.get_results_tables(dataset)
+    if table_specs is not None:
+        return query_engine.get_results_batches(dataset, table_specs)
+    else:
+        return query_engine.get_results_tables(dataset)
 
 
 def generate_dataset_with_dummy_data(
-    *, dataset, dummy_data_config, table_specs, dummy_data_file, dummy_tables_path
+    *,
+    dataset,
+    dummy_data_config,
+    table_specs,
+    dummy_data_file,
+    dummy_tables_path,
+    environ,
 ):
     if dummy_data_file:
         log.info(f"Reading dummy data from {dummy_data_file}")
         return read_tables(dummy_data_file, table_specs)
     elif dummy_tables_path:
         log.info(f"Reading table data from {dummy_tables_path}")
-        query_engine = LocalFileQueryEngine(dummy_tables_path)
+        from ehrql.query_engines.local_file import LocalFileQueryEngine
+
+        query_engine = LocalFileQueryEngine(dummy_tables_path, environ=environ)
         return query_engine.get_results_tables(dataset)
     else:
         generator = get_dummy_data_generator(dataset, dummy_data_config)
@@ -157,23 +184,31 @@ def create_dummy_tables(definition_file, dummy_tables_path, user_args, environ):
         table.name: get_column_specs_from_schema(table.schema)
         for table in table_data.keys()
     }
-    write_tables(dummy_tables_path, table_data.values(), table_specs)
+    write_tables(dummy_tables_path, table_data.values(), table_specs, environ=environ)
 
 
 def get_dummy_data_generator(dataset, dummy_data_config):
     if dummy_data_config.legacy:
+        from ehrql.dummy_data import DummyDataGenerator
+
         return DummyDataGenerator(
             dataset,
             population_size=dummy_data_config.population_size,
             timeout=dummy_data_config.timeout,
         )
     else:
+        from ehrql.dummy_data_nextgen import (
+            DummyDataGenerator as NextGenDummyDataGenerator,
+        )
+
         return NextGenDummyDataGenerator(dataset, configuration=dummy_data_config)
 
 
 def dump_dataset_sql(
     definition_file, output_file, backend_class, query_engine_class, environ, user_args
 ):
+    from ehrql.query_engines.sqlite import SQLiteQueryEngine
+
     log.info(f"Generating SQL for {str(definition_file)}")
 
     dataset, _, _ = load_dataset_definition(definition_file, user_args, environ)
@@ -194,6 +229,8 @@ def dump_dataset_sql(
 
 
 def get_sql_strings(query_engine, dataset):
+    from ehrql.utils.sqlalchemy_query_utils import clause_as_str
+
     queries = query_engine.get_queries(dataset)
     dialect = query_engine.sqlalchemy_dialect()
     sql_strings = []
@@ -279,7 +316,7 @@ def generate_measures(
     if disclosure_control_config.enabled:
         results = apply_sdc_to_measure_results(results)
 
-    write_measure_results(output_file, results, measure_definitions)
+    write_measure_results(output_file, results, measure_definitions, environ)
 
 
 def generate_measures_with_dsn(
@@ -289,6 +326,8 @@ def generate_measures_with_dsn(
     query_engine_class,
     environ,
 ):
+    from ehrql.query_engines.local_file import LocalFileQueryEngine
+
     query_engine = get_query_engine(
         dsn,
         backend_class,
@@ -296,7 +335,10 @@ def generate_measures_with_dsn(
         environ,
         default_query_engine_class=LocalFileQueryEngine,
     )
-    return get_measure_results(query_engine, measure_definitions)
+    concurrency = int(environ.get("EHRQL_MEASURE_CONCURRENCY", 1))
+    return get_measure_results(
+        query_engine, measure_definitions, concurrency=concurrency
+    )
 
 
 def generate_measures_with_dummy_data(
@@ -310,6 +352,8 @@ def generate_measures_with_dummy_data(
         return read_measure_results(dummy_data_file, measure_definitions)
     elif dummy_tables_path:
         log.info(f"Reading data from {dummy_tables_path}")
+        from ehrql.query_engines.local_file import LocalFileQueryEngine
+
         query_engine = LocalFileQueryEngine(dummy_tables_path)
         return get_measure_results(query_engine, measure_definitions)
     else:
@@ -323,21 +367,25 @@ def get_dummy_measures_data_class(dummy_data_config):
     if dummy_data_config.legacy:
         return DummyMeasuresDataGenerator
     else:
+        from ehrql.dummy_data_nextgen import (
+            DummyMeasuresDataGenerator as NextGenDummyMeasuresDataGenerator,
+        )
+
         return NextGenDummyMeasuresDataGenerator
 
 
-def write_measure_results(output_file, results, measure_definitions):
+def write_measure_results(output_file, results, measure_definitions, environ):
     column_specs = get_column_specs_for_measures(measure_definitions)
     # Although an `output_file` of `None` (i.e. ouput to console) does support multiple
     # output tables, for consistency with previous behaviour we want to continue writing
     # results to the console as a single combined table. We might revisit this decision
     # but it seems the least surprising thing for now.
     if output_file is None or not output_filename_supports_multiple_tables(output_file):
-        write_rows(output_file, results, column_specs)
+        write_rows(output_file, results, column_specs, environ=environ)
     else:
         table_specs = get_table_specs_for_measures(measure_definitions)
         tables = split_measure_results_into_tables(results, column_specs, table_specs)
-        write_tables(output_file, tables, table_specs)
+        write_tables(output_file, tables, table_specs, environ=environ)
 
 
 def read_measure_results(input_file, measure_definitions):
@@ -400,14 +448,17 @@ def serialize_definition(
     output_file,
     user_args,
     environ,
+    record_inputs=False,
 ):
-    result = load_definition_unsafe(
-        definition_file,
-        user_args,
-        environ,
-    )
+    if not record_inputs:
+        result = load_definition_unsafe(definition_file, user_args, environ)
+        output = serialize(result)
+    else:
+        with loader_cache.record_inputs() as inputs:
+            result = load_definition_unsafe(definition_file, user_args, environ)
+        output = json.dumps({"definition": serialize(result), "inputs": inputs})
     with open_output_file(output_file) as f:
-        f.write(serialize(result))
+        f.write(output)
 
 
 def run_isolation_report():
@@ -416,5 +467,7 @@ def run_isolation_report():
 
 def graph_query(definition_file, output_file, environ, user_args):  # pragma: no cover
     log.info(f"Graphing query for {str(definition_file)}")
+    from ehrql.query_model.graphs import graph_to_svg
+
     dataset, _, _ = load_dataset_definition(definition_file, user_args, environ)
     graph_to_svg(dataset, output_file)
@@ -1,3 +1,4 @@
+import concurrent.futures
 import datetime
 import operator
 import time
@@ -20,7 +21,7 @@ from ehrql.utils.math_utils import get_grouping_level_as_int
 from ehrql.utils.sequence_utils import ordered_set
 
 
-def get_measure_results(query_engine, measures, timeout=259200.0):
+def get_measure_results(query_engine, measures, timeout=259200.0, concurrency=1):
     # Group measures by denominator and intervals as we'll handle them together
     grouped = defaultdict(list)
     for measure in measures:
@@ -31,7 +32,7 @@ def get_measure_results(query_engine, measures, timeout=259200.0):
     measure_timer = MeasureTimer.from_grouped(timeout, grouped)
     for measure_group in grouped.values():
         calculator = MeasureCalculator(measure_group)
-        results = calculator.get_results(query_engine)
+        results = calculator.get_results(query_engine, concurrency=concurrency)
         for measure, interval, numerator, denominator, group_dict in results:
             # Given the way results are constructed we should never get a zero-valued or
             # NULL denominator: we should just get no results at all for that measure
@@ -101,11 +102,24 @@ def get_table_specs_for_measures(measures):
 
 
 class MeasureTimer:
+    """
+    Raise an error if we project that calculating all measure intervals will exceed
+    the timeout
+
+    Projections are based on wall-clock throughput i.e. the number of intervals
+    completed so far divided by the elapsed time. This remains accurate when intervals
+    are calculated concurrently because results are always returned in interval order,
+    so each new interval we see has been completed along with all those before it.
+    """
+
+    # Number of intervals to complete before we have enough data to make a projection
+    min_completed = 12
+
     def __init__(self, timeout, num_iterations):
         self.timeout = timeout
         self.num_iterations = num_iterations
         self.previous_interval = None
-        self.counter = 0
+        self.completed = 0
 
     @classmethod
     def from_grouped(cls, timeout, grouped):
@@ -121,11 +135,13 @@ class MeasureTimer:
 
     def check_timeout(self, interval):
         if interval != self.previous_interval:
-            self.counter += 1
+            self.completed += 1
             self.previous_interval = interval
-            if self.counter >= 12:
+            if self.completed >= self.min_completed:
                 self.elapsed_time = time.time() - self.start_time
-                projected_time = self.elapsed_time / self.counter * self.num_iterations
+                # Equivalent to dividing by throughput, but safe if no time has elapsed
+                time_per_interval = self.elapsed_time / self.completed
+                projected_time = time_per_interval * self.num_iterations
                 if projected_time > self.timeout:
                     raise MeasuresTimeout(
                         f"Generating measures exceeded {self.timeout}s time limit."
@@ -177,48 +193,55 @@ class MeasureCalculator:
             measures=grouped_sum,
         )
 
-    def get_results(self, query_engine):
-        for interval in self.intervals:
-            results = self.get_results_for_interval(query_engine, interval)
+    def get_results(self, query_engine, concurrency=1):
+        # Build the query for each interval by replacing the interval start/end
+        # placeholders with actual dates
+        datasets = [
+            substitute_interval_parameters(self.placeholder_dataset, interval)
+            for interval in self.intervals
+        ]
+        # The query engine is free to fetch results for several intervals at once, so
+        # each row is prefixed with the index of the interval it belongs to
+        if concurrency > 1:
+            rows = get_results_concurrently(query_engine, datasets, concurrency)
+        else:
+            rows = query_engine.get_measure_results_for_intervals(datasets)
 
+        for interval_index, *row in rows:
+            interval = self.intervals[interval_index]
+            results = self.get_results_for_row(row)
             for measure, numerator, denominator, *groups in results:
                 group_dict = dict(zip(self.all_groups, groups))
                 yield measure, interval, numerator, denominator, group_dict
 
-    def get_results_for_interval(self, query_engine, interval):
-        # Build the query for this interval by replacing the interval start/end
-        # placeholders with actual dates
-        dataset = substitute_interval_parameters(self.placeholder_dataset, interval)
+    def get_results_for_row(self, row):
         groups_count = len(self.all_groups)
-
-        for table in query_engine.get_results_tables(dataset):
-            for row in table:
-                # Each row contains values in the order:
-                # [denominator, *all_numerators, *all_group_by_columns, grouping_id]
-                denominator = row[0]
-                if groups_count == 0:
-                    grouping_level = 0
-                    row = row[1:]
-                else:
-                    grouping_level = row[-1]
-                    row = row[1:-1]
-
-                for fetcher in self.measure_fetchers:
-                    # To determine which measure(s) this row applies to, we look at its
-                    # grouping level which is a numeric representation of the subset of
-                    # all group_bys that are applied to this measure
-                    # If its level matches the row's grouping level, values for this measure
-                    # should be extracted from the row
-                    if fetcher.grouping_level != grouping_level:
-                        continue
-                    # Extract the numerator for this measure
-                    numerator = row[fetcher.numerator_index]
-                    yield (
-                        fetcher.measure,
-                        numerator,
-                        denominator,
-                        *row[(len(row) - groups_count) :],
-                    )
+        # Each row contains values in the order:
+        # [denominator, *all_numerators, *all_group_by_columns, grouping_id]
+        denominator = row[0]
+        if groups_count == 0:
+            grouping_level = 0
+            row = row[1:]
+        else:
+            grouping_level = row[-1]
+            row = row[1:-1]
+
+        for fetcher in self.measure_fetchers:
+            # To determine which measure(s) this row applies to, we look at its
+            # grouping level which is a numeric representation of the subset of
+            # all group_bys that are applied to this measure
+            # If its level matches the row's grouping level, values for this measure
+            # should be extracted from the row
+            if fetcher.grouping_level != grouping_level:
+                continue
+            # Extract the numerator for this measure
+            numerator = row[fetcher.numerator_index]
+            yield (
+                fetcher.measure,
+                numerator,
+                denominator,
+                *row[(len(row) - groups_count) :],
+            )
 
     def add_measure(self, measure):
         # Record denominator and intervals from first measure
@@ -262,6 +285,42 @@ class MeasureCalculator:
             return key
 
 
+def get_results_concurrently(query_engine, datasets, concurrency):
+    """
+    Fetch results for each interval's dataset using up to `concurrency` threads,
+    returning rows in the same form and order as
+    `query_engine.get_measure_results_for_intervals()`
+    """
+
+    def get_results_for_interval(index, dataset):
+        # Query engines hold per-query state and connections, so each interval gets
+        # its own instance
+        engine = clone_query_engine(query_engine)
+        results = engine.get_measure_results_for_intervals([dataset])
+        return [(index, *row) for _, *row in results]
+
+    pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="ehrql-measures"
+    )
+    try:
+        futures = [
+            pool.submit(get_results_for_interval, index, dataset)
+            for index, dataset in enumerate(datasets)
+        ]
+        for future in futures:
+            yield from future.result()
+    finally:
+        # If we stop early (e.g. on timeout) cancel the intervals which haven't started
+        # yet, so we only wait for those which are already running
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def clone_query_engine(query_engine):
+    return type(query_engine)(
+        query_engine.dsn, backend=query_engine.backend, environ=query_engine.environ
+    )
+
+
 def series_as_bool(series):
     series_type = get_series_type(series)
     if series_type is bool:
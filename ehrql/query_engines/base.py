@@ -1,10 +1,14 @@
 from collections.abc import Iterator, Sequence
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
 from ehrql.query_model import nodes as qm
 from ehrql.utils.itertools_utils import iter_groups
 
 
+if TYPE_CHECKING:  # pragma: no cover
+    import pyarrow
+
+
 class Marker: ...
 
 
@@ -44,6 +48,26 @@ class BaseQueryEngine:
         """
         return iter_groups(self.get_results_stream(dataset), self.RESULTS_START)
 
+    def get_results_batches(
+        self, dataset: qm.Dataset, table_specs: dict
+    ) -> Iterator[Iterator["pyarrow.RecordBatch"]]:
+        """
+        As `get_results_tables` but each table is an iterator of `pyarrow.RecordBatch`es
+        whose schemas are given by the corresponding column specs in `table_specs`
+
+        This allows results to be written to columnar output formats without creating
+        Python objects for each row. The default implementation just converts the rows
+        returned by `get_results_tables`; engines which already hold their results in
+        columnar form can override it.
+        """
+        # Imported here to avoid importing `pyarrow` when the query engines are only
+        # needed to validate or load a definition file
+        from ehrql.file_formats.arrow import rows_to_record_batches
+
+        tables = self.get_results_tables(dataset)
+        for rows, column_specs in zip(tables, table_specs.values()):
+            yield rows_to_record_batches(rows, column_specs)
+
     def get_results_stream(self, dataset: qm.Dataset) -> Iterator[Sequence | Marker]:
         """
         Given a query model `Dataset` return an iterator of rows over all the results
@@ -69,3 +93,19 @@ class BaseQueryEngine:
         yield from next(tables)
         for remaining in tables:
             assert False, "Expected only one results table"
+
+    def get_measure_results_for_intervals(
+        self, datasets: Sequence[qm.Dataset]
+    ) -> Iterator[Sequence]:
+        """
+        Given a sequence of measures `Dataset`s, one per interval and differing only in
+        their interval parameters, return an iterator of the results rows for all of
+        them with each row prefixed by the index of the dataset which produced it
+
+        Rows are returned in order of dataset index. The default implementation simply
+        fetches the results for each dataset in turn; engines can override this to
+        compute results for several intervals at once.
+        """
+        for index, dataset in enumerate(datasets):
+            for row in self.get_results(dataset):
+                yield (index, *row)
@@ -1,6 +1,9 @@
+import contextlib
 import datetime
 import enum
 import logging
+import operator
+import queue
 import secrets
 import time
 from functools import cached_property
@@ -15,13 +18,16 @@ from sqlalchemy.sql.functions import Function as SQLFunction
 from sqlalchemy.sql.visitors import replacement_traverse
 
 from ehrql.backends.base import DefaultSQLBackend, MappedTable, QueryTable
+from ehrql.query_model.introspection import all_unique_nodes
 from ehrql.query_model.nodes import (
     AggregateByPatient,
+    AggregatedSeries,
     Case,
     Dataset,
     Filter,
     Function,
     InlinePatientTable,
+    PickOneRowPerPatient,
     Position,
     SelectColumn,
     SelectPatientTable,
@@ -43,9 +49,10 @@ from ehrql.query_model.transforms import (
 from ehrql.sqlalchemy_types import type_from_python_type
 from ehrql.utils import log_utils
 from ehrql.utils.functools_utils import singledispatchmethod_with_cache
-from ehrql.utils.itertools_utils import iter_flatten
+from ehrql.utils.itertools_utils import iter_flatten, iter_groups
 from ehrql.utils.sequence_utils import ordered_set
 from ehrql.utils.sqlalchemy_query_utils import (
+    ConcurrentSetupRunner,
     GeneratedTable,
     InsertMany,
     add_setup_and_cleanup_queries,
@@ -89,11 +96,28 @@ class BaseSQLQueryEngine(BaseQueryEngine):
     # Name of the database schema in which to create temporary tables (may not be
     # relevant to all query engines)
     temp_table_schema = None
+    # The number of connections to use for creating independent temporary tables
+    # concurrently. This is only possible for engines where temporary tables are
+    # visible across connections, hence the default of no concurrency and the flag
+    # below which engines must explicitly set.
+    setup_query_concurrency = 1
+    supports_concurrent_setup_queries = False
+    # The number of measure intervals to compute together in a single results query.
+    # Batching intervals means only one aggregation query per batch, at the cost of a
+    # larger intermediate table, so we default to one interval at a time.
+    measure_interval_batch_size = 1
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         if not self.backend:
             self.backend = DefaultSQLBackend(self.__class__)
+        # Mapping from each node to the tuple of nodes which share a table with it (see
+        # `get_table_groups()`) and a cache of those shared tables
+        self.table_groups = {}
+        self.group_tables = {}
+        # Cache of tables containing fixed sets of values (see
+        # `get_expr_for_multivalued_param()`)
+        self.values_tables = {}
         # Supporting generating globally unique names – the timestamp is not strictly
         # necessary but can help with debugging and manual cleanup
         self.global_unique_id = (
@@ -107,6 +131,17 @@ class BaseSQLQueryEngine(BaseQueryEngine):
         self.max_join_count = int(
             self.environ.get("EHRQL_MAX_JOIN_COUNT", self.max_join_count)
         )
+        if self.supports_concurrent_setup_queries:
+            self.setup_query_concurrency = int(
+                self.environ.get(
+                    "EHRQL_SETUP_QUERY_CONCURRENCY", self.setup_query_concurrency
+                )
+            )
+        self.measure_interval_batch_size = int(
+            self.environ.get(
+                "EHRQL_MEASURE_INTERVAL_BATCH_SIZE", self.measure_interval_batch_size
+            )
+        )
         self.temp_table_schema = self.backend.modify_temp_table_schema(
             self.temp_table_schema, self.dsn, self.environ
         )
@@ -119,7 +154,7 @@ class BaseSQLQueryEngine(BaseQueryEngine):
     def grouping_id(self, *columns):
         return sqlalchemy.func.grouping_id(*columns).label("grp_id")
 
-    def get_measure_queries(self, grouped_sum, results_query):
+    def get_measure_queries(self, grouped_sum, results_query, interval_column=None):
         """
         Return the SQL queries to fetch the results for a GroupedSum representing
         a collection of measures that share a denominator.
@@ -131,6 +166,10 @@ class BaseSQLQueryEngine(BaseQueryEngine):
         results_query is the result of calling get_results_queries on the dataset that
         the measures will aggregate over.
 
+        If interval_column is supplied then results_query contains the rows for
+        multiple intervals and every grouping set is additionally grouped by this
+        column, which is returned as the first column of the results.
+
         Uses GROUPING SETS to combine multiple group by clauses into one
         GROUP BY, meaning that we can query all the measures in one go.
         We add the numerator and denominator queries for all measures,
@@ -158,17 +197,25 @@ class BaseSQLQueryEngine(BaseQueryEngine):
             col_name: results_query.c[col_name]
             for col_name in ordered_set(iter_flatten(grouped_sum.group_bys.keys()))
         }
+        interval_cols = (
+            [results_query.c[interval_column]] if interval_column is not None else []
+        )
         grouping_sets = [
-            sqlalchemy.tuple_(*[all_group_by_cols[col_name] for col_name in group_by])
+            sqlalchemy.tuple_(
+                *interval_cols,
+                *[all_group_by_cols[col_name] for col_name in group_by],
+            )
             for group_by in grouped_sum.group_bys
         ]
 
         if not all_group_by_cols:
             measures_query = sqlalchemy.select(
+                *interval_cols,
                 *all_sum_overs,
-            )
+            ).group_by(*interval_cols)
         else:
             measures_query = sqlalchemy.select(
+                *interval_cols,
                 *all_sum_overs,
                 *all_group_by_cols.values(),
                 self.grouping_id(*all_group_by_cols.values()),
@@ -184,12 +231,61 @@ class BaseSQLQueryEngine(BaseQueryEngine):
         needed to create these tables and clean them up can be retrieved by passing the
         list of queries through `add_setup_and_cleanup_queries`.
         """
+        dataset_query, other_queries = self.get_dataset_queries(dataset)
+        if dataset.measures:
+            assert not other_queries, (
+                "Measures queries can only be applied to a single results table"
+            )
+            return self.get_measure_queries(
+                dataset.measures, self.reify_query(dataset_query)
+            )
+        return [dataset_query, *other_queries]
+
+    def get_interval_batched_measure_queries(self, indexed_datasets):
+        """
+        Return the SQL queries to fetch the results for a batch of measures datasets,
+        one per interval, which share the same GroupedSum
+
+        `indexed_datasets` is a sequence of (index, dataset) pairs. The patient-level
+        rows for each interval are tagged with the index of their dataset and combined
+        into a single table, which is then aggregated with the interval index as an
+        extra grouping column. This means we run one aggregation query for the whole
+        batch rather than one per interval.
+        """
+        grouped_sum = indexed_datasets[0][1].measures
+        interval_queries = []
+        for index, dataset in indexed_datasets:
+            assert dataset.measures == grouped_sum
+            dataset_query, other_queries = self.get_dataset_queries(dataset)
+            assert not other_queries, (
+                "Measures queries can only be applied to a single results table"
+            )
+            interval_queries.append(
+                dataset_query.add_columns(
+                    sqlalchemy.literal(index, sqlalchemy.Integer).label(
+                        "interval_index"
+                    )
+                )
+            )
+        combined = sqlalchemy.union_all(*interval_queries).subquery()
+        return self.get_measure_queries(
+            grouped_sum,
+            self.reify_query(sqlalchemy.select(*combined.c)),
+            interval_column="interval_index",
+        )
+
+    def get_dataset_queries(self, dataset):
+        """
+        Return a pair of the patient-level query for `dataset` and a list of any
+        event-level queries
+        """
         assert isinstance(dataset, Dataset)
         dataset = self.backend.modify_dataset(dataset)
         dataset = apply_transforms(dataset)
 
         # Generate a table containing the IDs all of patients matching the population
         # definition
+        self.set_table_groups([dataset.population])
         population_expression = self.get_predicate(dataset.population)
         select_patient_id = self.select_patient_id_for_population(population_expression)
         population_query = select_patient_id.where(population_expression)
@@ -199,6 +295,13 @@ class BaseSQLQueryEngine(BaseQueryEngine):
         # generating the variable expressions below
         self.population_table = population_table
 
+        # Any tables used in the population definition have already been generated
+        # (without the population condition) so we exclude them from the groups used
+        # for the variables
+        self.set_table_groups(
+            [*dataset.variables.values(), *dataset.events.values()],
+            exclude=[dataset.population],
+        )
         dataset_query = self.add_variables_to_query(
             sqlalchemy.select(population_table.c.patient_id),
             dataset.variables,
@@ -225,19 +328,19 @@ class BaseSQLQueryEngine(BaseQueryEngine):
         # this means that we can't safely re-use cached values across different calls to
         # `get_query()` because the same query node may now generate different SQL
         # depending on the population of the query to which it belongs. So we have to
-        # reset the caches and the population table reference.
+        # reset the caches and the population table reference. The same goes for the
+        # table groups.
         self.population_table = None
+        self.table_groups = {}
+        self.group_tables = {}
         self.get_sql.cache_clear()
         self.get_table.cache_clear()
 
-        if dataset.measures:
-            assert not other_queries, (
-                "Measures queries can only be applied to a single results table"
-            )
-            return self.get_measure_queries(
-                dataset.measures, self.reify_query(dataset_query)
-            )
-        return [dataset_query, *other_queries]
+        return dataset_query, other_queries
+
+    def set_table_groups(self, nodes, exclude=()):
+        self.table_groups = get_table_groups(nodes, exclude)
+        self.group_tables = {}
 
     def add_variables_to_query(self, query, variables, query_type):
         # We're relying on this shared population table reference to apply the
@@ -413,7 +516,12 @@ class BaseSQLQueryEngine(BaseQueryEngine):
         if len(node.value) <= self.max_multivalue_param_length:
             return self.get_expr(node)
         else:
-            table = self.get_table(node.value)
+            # Unlike most tables, tables of values don't depend on the population so we
+            # can share them across queries (e.g. for each interval of a measure)
+            # rather than creating the same table again each time
+            if node.value not in self.values_tables:
+                self.values_tables[node.value] = self.get_table(node.value)
+            table = self.values_tables[node.value]
             return sqlalchemy.select(table.columns[0])
 
     def get_sql_in_combine_as_set(self, node):
@@ -761,30 +869,18 @@ class BaseSQLQueryEngine(BaseQueryEngine):
         return sqlalchemy.func.coalesce(*sources)
 
     @get_sql.register(AggregateByPatient.Sum)
-    def get_sql_sum(self, node):
-        return self.aggregate_series_by_patient(node.source, sqlalchemy.func.sum)
-
     @get_sql.register(AggregateByPatient.Min)
-    def get_sql_min(self, node):
-        return self.aggregate_series_by_patient(node.source, sqlalchemy.func.min)
-
     @get_sql.register(AggregateByPatient.Max)
-    def get_sql_max(self, node):
-        return self.aggregate_series_by_patient(node.source, sqlalchemy.func.max)
-
     @get_sql.register(AggregateByPatient.Mean)
-    def get_sql_mean(self, node):
-        return self.aggregate_series_by_patient(node.source, self.calculate_mean)
+    def get_sql_series_aggregation(self, node):
+        return self.get_aggregated_column(node)
 
     def calculate_mean(self, sql_expr):
         return SQLFunction("AVG", sql_expr, type_=sqlalchemy.Float)
 
     @get_sql.register(AggregateByPatient.CountDistinct)
     def get_sql_count_distinct(self, node):
-        return sqlalchemy.func.coalesce(
-            self.aggregate_series_by_patient(node.source, self.count_distinct),
-            0,
-        )
+        return sqlalchemy.func.coalesce(self.get_aggregated_column(node), 0)
 
     @get_sql.register(AggregateByPatient.CountEpisodes)
     def get_sql_count_episodes(self, node):
@@ -826,12 +922,9 @@ class BaseSQLQueryEngine(BaseQueryEngine):
     @get_sql.register(AggregateByPatient.Exists)
     def get_sql_exists(self, node):
         if has_many_rows_per_patient(node.source):
-            query = self.get_select_query_for_node_domain(node.source)
-            # We don't need an aggregation function here: we just need all distinct
-            # patient_ids
-            query = query.distinct()
-            query = apply_patient_joins(query)
-            table = self.reify_query(query)
+            # We don't need an aggregation function here: the aggregations table has a
+            # row for every patient with at least one row in the frame
+            table = self.get_aggregations_table(self.get_table_group(node))
         else:
             table = self.get_table(node.source)
         return table.c.patient_id.is_not(None)
@@ -839,18 +932,75 @@ class BaseSQLQueryEngine(BaseQueryEngine):
     @get_sql.register(AggregateByPatient.Count)
     def get_sql_count(self, node):
         if has_many_rows_per_patient(node.source):
-            query = self.get_select_query_for_node_domain(node.source)
-            count = self.apply_sql_aggregation(query, sqlalchemy.func.count("*"))
-            return sqlalchemy.func.coalesce(count, 0)
+            return sqlalchemy.func.coalesce(self.get_aggregated_column(node), 0)
         else:
             table = self.get_table(node.source)
             has_row = table.c.patient_id.is_not(None)
             return sqlalchemy.case((has_row, 1), else_=0)
 
-    def aggregate_series_by_patient(self, source_node, aggregation_func):
-        query = self.get_select_query_for_node_domain(source_node)
-        aggregation_expr = aggregation_func(self.get_expr(source_node))
-        return self.apply_sql_aggregation(query, aggregation_expr)
+    def get_table_group(self, node):
+        # Nodes we haven't been told about (see `get_table_groups()`) get their own
+        # table
+        return self.table_groups.get(node, (node,))
+
+    def get_aggregated_column(self, node):
+        group = self.get_table_group(node)
+        table = self.get_aggregations_table(group)
+        return table.c[f"value_{group.index(node)}"]
+
+    def get_aggregations_table(self, group):
+        """
+        Given a tuple of aggregations over the same many-rows-per-patient domain, return
+        a table with one row per patient in that domain and a `value_<i>` column giving
+        the result of the i-th aggregation (other than for `Exists`, which doesn't need
+        one)
+
+        Calculating aggregations together like this means we scan the domain once
+        rather than once per aggregation.
+        """
+        if group not in self.group_tables:
+            query = self.get_select_query_for_node_domain(group[0].source)
+            frame = get_domain(group[0].source).get_node()
+            table_node, _ = get_table_and_filter_conditions(frame)
+            patient_id = self.get_table(table_node).c.patient_id
+            aggregations = {}
+            for i, node in enumerate(group):
+                if isinstance(node, AggregateByPatient.Exists):
+                    continue
+                elif isinstance(node, AggregateByPatient.Count):
+                    aggregation = (sqlalchemy.func.count, patient_id)
+                else:
+                    function = self.get_aggregation_function(node)
+                    aggregation = (function, self.get_expr(node.source))
+                aggregations[f"value_{i}"] = aggregation
+            query = self.get_aggregations_query(query, aggregations)
+            self.group_tables[group] = self.reify_query(query)
+        return self.group_tables[group]
+
+    def get_aggregation_function(self, node):
+        return {
+            AggregateByPatient.Sum: sqlalchemy.func.sum,
+            AggregateByPatient.Min: sqlalchemy.func.min,
+            AggregateByPatient.Max: sqlalchemy.func.max,
+            AggregateByPatient.Mean: self.calculate_mean,
+            AggregateByPatient.CountDistinct: self.count_distinct,
+        }[type(node)]
+
+    def get_aggregations_query(self, query, aggregations):
+        """
+        Given a query selecting `patient_id` from some domain and a dict mapping labels
+        to `(aggregation_function, sql_expr)` pairs, return a query which groups the
+        domain by patient and includes a column with each label giving the result of
+        applying the aggregation function to the expression
+        """
+        query = query.add_columns(
+            *[
+                function(sql_expr).label(label)
+                for label, (function, sql_expr) in aggregations.items()
+            ]
+        )
+        query = query.group_by(query.selected_columns[0])
+        return apply_patient_joins(query)
 
     def apply_sql_aggregation(self, query, aggregation_expression):
         query = query.add_columns(aggregation_expression.label("value"))
@@ -939,20 +1089,51 @@ class BaseSQLQueryEngine(BaseQueryEngine):
 
     @get_table.register(PickOneRowPerPatientWithColumns)
     def get_table_pick_one_row_per_patient(self, node):
-        selected_columns = [self.get_expr(c) for c in node.selected_columns]
-        order_clauses = self.get_order_clauses(
-            get_sort_conditions(node.source), node.position
-        )
+        group = self.get_table_group(node)
+        table = self.get_picked_rows_table(group)
+        if len(group) == 1:
+            return table
+        # A shared table contains the rows picked by every member of the group, so we
+        # need to select just those picked by this node
+        row_number = table.c[f"row_number_{group.index(node)}"]
+        columns = [
+            table.c.patient_id,
+            *[table.c[c.name] for c in node.selected_columns],
+        ]
+        return sqlalchemy.select(*columns).where(row_number == 1).alias()
 
-        query = self.get_select_query_for_node_domain(node.source)
+    def get_picked_rows_table(self, group):
+        """
+        Given a tuple of picks of a single row per patient from the same domain (but
+        possibly with different sorts and positions), return a table containing the
+        selected columns of the rows picked by any of them
+
+        Where the group has more than one member, the table includes a `row_number_<i>`
+        column which is 1 for the row picked by the i-th member. Sharing a table like
+        this means we scan the domain once rather than once per pick.
+        """
+        if group in self.group_tables:
+            return self.group_tables[group]
+
+        selected_columns = {c.name: c for node in group for c in node.selected_columns}
+        selected_columns = [
+            self.get_expr(selected_columns[name]) for name in sorted(selected_columns)
+        ]
+
+        query = self.get_select_query_for_node_domain(group[0].source)
         query = query.add_columns(*selected_columns)
-        # Add an extra "row number" column to the query which gives the position of each
-        # row within its patient_id partition as implied by the order clauses
-        query = query.add_columns(
-            sqlalchemy.func.row_number().over(
-                partition_by=query.selected_columns[0], order_by=order_clauses
+        # Add an extra "row number" column to the query for each pick which gives the
+        # position of each row within its patient_id partition as implied by the order
+        # clauses
+        for i, node in enumerate(group):
+            order_clauses = self.get_order_clauses(
+                get_sort_conditions(node.source), node.position
+            )
+            query = query.add_columns(
+                sqlalchemy.func.row_number()
+                .over(partition_by=query.selected_columns[0], order_by=order_clauses)
+                .label(f"row_number_{i}")
             )
-        )
 
         query = apply_patient_joins(query)
 
@@ -961,14 +1142,20 @@ class BaseSQLQueryEngine(BaseQueryEngine):
         # database to have the chance to spot that we're just fetching the first row
         # from each partition and optimise the query.
         subquery = query.alias()
-        subquery_columns = list(subquery.columns)
-        output_columns = subquery_columns[:-1]
-        row_number = subquery_columns[-1]
+        row_numbers = [subquery.c[f"row_number_{i}"] for i in range(len(group))]
 
-        # Select the first row for each patient according to the above row numbering
-        partitioned_query = sqlalchemy.select(*output_columns).where(row_number == 1)
+        # Select the first row for each patient according to any of the above row
+        # numberings. We only need to keep the row numbers if there's more than one.
+        if len(group) == 1:
+            output_columns = list(subquery.columns)[:-1]
+        else:
+            output_columns = list(subquery.columns)
+        partitioned_query = sqlalchemy.select(*output_columns).where(
+            sqlalchemy.or_(*[row_number == 1 for row_number in row_numbers])
+        )
 
-        return self.reify_query(partitioned_query)
+        self.group_tables[group] = self.reify_query(partitioned_query)
+        return self.group_tables[group]
 
     def get_order_clauses(self, sort_conditions, position):
         order_clauses = [self.get_expr(c) for c in sort_conditions]
@@ -1092,43 +1279,123 @@ class BaseSQLQueryEngine(BaseQueryEngine):
         These are the all the queries required to get the results for the supplied
         dataset definition.
         """
-        results_queries = self.get_results_queries(dataset)
+        return self.get_setup_and_results_queries(self.get_results_queries(dataset))
+
+    def get_setup_and_results_queries(self, results_queries):
         all_queries = add_setup_and_cleanup_queries(results_queries)
         is_results_query = set(results_queries).__contains__
         return [(is_results_query(query), query) for query in all_queries]
 
     def get_results_stream(self, dataset):
-        queries = self.get_queries(dataset)
+        results_queries = self.get_results_queries(dataset)
+        yield from self.get_results_stream_for_queries(results_queries)
+
+    def get_measure_results_for_intervals(self, datasets):
+        batch_size = self.measure_interval_batch_size
+        if batch_size <= 1:
+            yield from super().get_measure_results_for_intervals(datasets)
+            return
+
+        indexed_datasets = list(enumerate(datasets))
+        for start in range(0, len(indexed_datasets), batch_size):
+            batch = indexed_datasets[start : start + batch_size]
+            results_queries = self.get_interval_batched_measure_queries(batch)
+            tables = iter_groups(
+                self.get_results_stream_for_queries(results_queries),
+                self.RESULTS_START,
+            )
+            # Aggregated results are small so we can afford to sort them in memory,
+            # which keeps the order consistent with fetching one interval at a time
+            rows = sorted(next(tables), key=operator.itemgetter(0))
+            for remaining in tables:
+                assert False, "Expected only one results table"
+            yield from rows
+
+    def get_results_stream_for_queries(self, results_queries):
+        if self.setup_query_concurrency > 1:
+            yield from self.get_results_stream_with_concurrent_setup(results_queries)
+            return
+
+        queries = self.get_setup_and_results_queries(results_queries)
 
         with self.engine.connect() as connection:
             for i, (has_results, query) in enumerate(queries, start=1):
                 query_id = f"query {i:03} / {len(queries):03}"
-                # Compile the SQL so we can log it
-                sql_string = str(query.compile(dialect=self.engine.dialect))
-                sql_log = log_utils.indent(f"SQL:\n{sql_string.strip()}")
-
-                start_time = time.monotonic()
                 if has_results:
-                    log.info(f"Fetching results from {query_id}")
-                    log.info(sql_log)
                     yield self.RESULTS_START
-                    yield from self.execute_query_with_results(
-                        connection, query, query_id
-                    )
-                    duration = time.monotonic() - start_time
-                    # Append newlines to make the logs visually parseable
-                    log.info(
-                        f"Finished fetching results from {query_id} (duration={duration:.2f})\n\n"
-                    )
+                    yield from self.run_query_with_results(connection, query, query_id)
                 else:
-                    log.info(f"Running {query_id}")
-                    log.info(sql_log)
-                    self.execute_query_no_results(connection, query, query_id)
-                    duration = time.monotonic() - start_time
-                    # Append newlines to make the logs visually parseable
-                    log.info(
-                        f"Finished running {query_id} (duration={duration:.2f})\n\n"
-                    )
+                    self.run_query_no_results(connection, query, query_id)
+
+    def get_results_stream_with_concurrent_setup(self, results_queries):
+        """
+        Equivalent to `get_results_stream_for_queries` but creates independent
+        temporary tables concurrently, using a pool of `setup_query_concurrency`
+        connections
+        """
+        # We number queries according to their position in the sequential ordering so
+        # that logs remain comparable with those produced by non-concurrent runs
+        all_queries = add_setup_and_cleanup_queries(results_queries)
+        query_ids = {
+            query: f"query {i:03} / {len(all_queries):03}"
+            for i, query in enumerate(all_queries, start=1)
+        }
+
+        with contextlib.ExitStack() as stack:
+            connection = stack.enter_context(self.engine.connect())
+            setup_connections = queue.SimpleQueue()
+            for _ in range(self.setup_query_concurrency):
+                setup_connections.put(stack.enter_context(self.engine.connect()))
+
+            def execute(queries):
+                setup_connection = setup_connections.get()
+                try:
+                    for query in queries:
+                        self.run_query_no_results(
+                            setup_connection, query, query_ids[query]
+                        )
+                finally:
+                    setup_connections.put(setup_connection)
+
+            runner = stack.enter_context(
+                ConcurrentSetupRunner(
+                    results_queries, execute, self.setup_query_concurrency
+                )
+            )
+            for query in results_queries:
+                runner.setup(query)
+                yield self.RESULTS_START
+                yield from self.run_query_with_results(
+                    connection, query, query_ids[query]
+                )
+                runner.cleanup(query)
+
+    def run_query_with_results(self, connection, query, query_id):
+        # Compile the SQL so we can log it
+        sql_log = self.get_sql_log(query)
+        start_time = time.monotonic()
+        log.info(f"Fetching results from {query_id}")
+        log.info(sql_log)
+        yield from self.execute_query_with_results(connection, query, query_id)
+        duration = time.monotonic() - start_time
+        # Append newlines to make the logs visually parseable
+        log.info(
+            f"Finished fetching results from {query_id} (duration={duration:.2f})\n\n"
+        )
+
+    def run_query_no_results(self, connection, query, query_id):
+        sql_log = self.get_sql_log(query)
+        start_time = time.monotonic()
+        log.info(f"Running {query_id}")
+        log.info(sql_log)
+        self.execute_query_no_results(connection, query, query_id)
+        duration = time.monotonic() - start_time
+        # Append newlines to make the logs visually parseable
+        log.info(f"Finished running {query_id} (duration={duration:.2f})\n\n")
+
+    def get_sql_log(self, query):
+        sql_string = str(query.compile(dialect=self.engine.dialect))
+        return log_utils.indent(f"SQL:\n{sql_string.strip()}")
 
     def execute_query_no_results(self, connection, query, query_id=None):
         connection.execute(query)
@@ -1267,6 +1534,66 @@ def replace_placeholder_references(query):
     return replacement_traverse(query, {}, replace=replace)
 
 
+# Aggregations which `get_aggregations_table()` can calculate together with any others
+# over the same domain. (`Count` and `Exists` can also be applied to one-row-per-patient
+# frames, which need no aggregating, so these are excluded below.)
+GROUPABLE_AGGREGATIONS = (
+    AggregateByPatient.Sum,
+    AggregateByPatient.Min,
+    AggregateByPatient.Max,
+    AggregateByPatient.Mean,
+    AggregateByPatient.CountDistinct,
+    AggregateByPatient.Count,
+    AggregateByPatient.Exists,
+)
+
+# Nodes for which we generate tables (other than those of the underlying data)
+TABLE_GENERATING_NODES = (
+    AggregatedSeries,
+    AggregateByPatient.Count,
+    AggregateByPatient.Exists,
+    PickOneRowPerPatient,
+)
+
+
+def get_table_groups(nodes, exclude=()):
+    """
+    Return a dict mapping each node found in `nodes` (but not in `exclude`) whose table
+    can be shared with others to a tuple of all such nodes over the same domain
+
+    These are aggregations (see `get_aggregations_table()`) and picks of a single row
+    per patient (see `get_picked_rows_table()`), which are grouped separately.
+    """
+    excluded = all_unique_nodes(*exclude)
+    groups = {}
+    for node in all_unique_nodes(*nodes):
+        if node in excluded:
+            continue
+        if isinstance(node, GROUPABLE_AGGREGATIONS):
+            if not has_many_rows_per_patient(node.source):
+                continue
+            group_type = AggregateByPatient
+        elif isinstance(node, PickOneRowPerPatientWithColumns):
+            group_type = PickOneRowPerPatient
+        else:
+            continue
+        if depends_on_other_tables(node):
+            continue
+        key = group_type, get_domain(node.source).get_node()
+        groups.setdefault(key, []).append(node)
+    return {node: tuple(group) for group in groups.values() for node in group}
+
+
+def depends_on_other_tables(node):
+    # A node whose source involves other generated tables might depend on another
+    # member of its group (possibly indirectly, via some other group) in which case they
+    # couldn't share a table. To keep things simple we give all such nodes their own.
+    return any(
+        isinstance(subnode, TABLE_GENERATING_NODES)
+        for subnode in all_unique_nodes(node.source)
+    )
+
+
 def get_table_and_filter_conditions(frame):
     """
     Given a ManyRowsPerPatientFrame, return a base SelectTable operation and a list of
@@ -3,7 +3,7 @@ from functools import reduce
 from ehrql.query_engines.in_memory_database import apply_function
 from ehrql.query_engines.local_file import LocalFileQueryEngine
 from ehrql.query_language import Dataset, DateDifference, EventTable
-from ehrql.query_model.introspection import get_table_nodes
+from ehrql.query_model.introspection import get_table_columns, get_table_nodes
 from ehrql.query_model.nodes import AggregateByPatient, Function
 from ehrql.query_model.nodes import Dataset as DatasetQM
 
@@ -22,8 +22,7 @@ class DebugQueryEngine(LocalFileQueryEngine):
                 )
         else:
             population_qm = dataset.population._qm_node
-            table_nodes = get_table_nodes(population_qm, *variables_qm.values())
-        self.populate_database(table_nodes)
+        self.populate_database(get_table_columns(population_qm, *variables_qm.values()))
         results_tables = self.get_results_as_in_memory_tables(
             DatasetQM(
                 population=population_qm,
@@ -39,10 +38,10 @@ class DebugQueryEngine(LocalFileQueryEngine):
             population_qm = None
         else:
             population_qm = element._dataset.population._qm_node
-        table_nodes = get_table_nodes(
+        table_columns = get_table_columns(
             element._qm_node, *([] if population_qm is None else [population_qm])
         )
-        self.populate_database(table_nodes)
+        self.populate_database(table_columns)
         self.cache = {}
         result = self.visit(element._qm_node)
         if population_qm is not None:
@@ -60,8 +59,7 @@ class DebugQueryEngine(LocalFileQueryEngine):
             element.days if isinstance(original_element, DateDifference) else element
         )
 
-        table_nodes = get_table_nodes(element._qm_node)
-        self.populate_database(table_nodes)
+        self.populate_database(get_table_columns(element._qm_node))
         self.cache = {}
         column = self.visit(element._qm_node)
 
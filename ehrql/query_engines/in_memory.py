@@ -32,6 +32,13 @@ class InMemoryQueryEngine(BaseQueryEngine):
     tests, and a to provide a reference implementation for other engines.
     """
 
+    # The classes used to represent intermediate results, which subclasses can override
+    # to use a different representation
+    patient_column_class = PatientColumn
+    patient_table_class = PatientTable
+    event_table_class = EventTable
+    apply_function = staticmethod(apply_function)
+
     def get_results_tables(self, dataset):
         if dataset.measures:
             yield from self.get_measures_results_tables(dataset)
@@ -99,22 +106,22 @@ class InMemoryQueryEngine(BaseQueryEngine):
 
         # Determine the population
         population = self.visit(dataset.population)
-        assert isinstance(population, PatientColumn)
+        assert isinstance(population, self.patient_column_class)
 
         # Build PatientColumns for the ID and each patient-level variable
         name_to_col = {
-            "patient_id": PatientColumn(
+            "patient_id": self.make_patient_column(
                 {patient: patient for patient in all_patients},
                 default=None,
             )
         }
         for name, node in dataset.variables.items():
             col = self.visit(node)
-            assert isinstance(col, PatientColumn)
+            assert isinstance(col, self.patient_column_class)
             name_to_col[name] = col
 
         # Combine the columns into a PatientTable
-        table = PatientTable(name_to_col)
+        table = self.patient_table_class(name_to_col)
         # Filter out any rows associated with patients not in the population
         table = table.filter(population)
 
@@ -162,13 +169,16 @@ class InMemoryQueryEngine(BaseQueryEngine):
             value = frozenset(self.convert_value(v) for v in node.value)
         else:
             value = self.convert_value(node.value)
-        return PatientColumn(
+        return self.make_patient_column(
             {patient: value for patient in self.all_patients},
             default=value,
         )
 
     def visit_NoneType(self, node):
-        return PatientColumn({}, None)
+        return self.make_patient_column({}, None)
+
+    def make_patient_column(self, patient_to_value, default):
+        return self.patient_column_class(patient_to_value, default)
 
     def convert_value(self, value):
         if hasattr(value, "_to_primitive_type"):
@@ -194,14 +204,19 @@ class InMemoryQueryEngine(BaseQueryEngine):
         return source.sort(sort_column.sort_index())
 
     def visit_PickOneRowPerPatient(self, node):
-        ix = {
-            qm.Position.FIRST: 0,
-            qm.Position.LAST: -1,
-        }[node.position]
+        ix = get_pick_index(node.position)
         return self.visit(node.source).pick_at_index(ix)
 
     def visit_PickOneRowPerPatientWithColumns(self, node):
-        return self.visit_PickOneRowPerPatient(node)
+        # Rather than fully sorting the frame once for each sort and then picking a
+        # single row, we gather up the stack of sorts and pick using all of them at once
+        source = node.source
+        sort_columns = []
+        while isinstance(source, qm.Sort):
+            sort_columns.insert(0, self.visit(source.sort_by))
+            source = source.source
+        ix = get_pick_index(node.position)
+        return self.visit(source).sort_and_pick_at_index(sort_columns, ix)
 
     def visit_Exists(self, node):
         return self.visit(node.source).exists()
@@ -251,7 +266,7 @@ class InMemoryQueryEngine(BaseQueryEngine):
 
     def visit_unary_op(self, node, op):
         series = self.visit(node.source)
-        return apply_function(op, series)
+        return self.apply_function(op, series)
 
     def visit_unary_op_with_null(self, node, op):
         return self.visit_unary_op(node, handle_null(op))
@@ -259,12 +274,12 @@ class InMemoryQueryEngine(BaseQueryEngine):
     def visit_binary_op(self, node, op):
         lhs = self.visit(node.lhs)
         rhs = self.visit(node.rhs)
-        return apply_function(op, lhs, rhs)
+        return self.apply_function(op, lhs, rhs)
 
     def visit_nary_op(self, node, op):
         sources = [*node.sources]
         columns = [self.visit(s) for s in sources]
-        return apply_function(op, *columns)
+        return self.apply_function(op, *columns)
 
     def visit_nary_op_disregarding_null(self, node, op):
         return self.visit_nary_op(node, disregard_null(op))
@@ -425,11 +440,11 @@ class InMemoryQueryEngine(BaseQueryEngine):
         default = self.visit(node.default)
         # Flatten arguments into a single list for easier handling
         arguments = [default, *[i for pair in cases for i in pair]]
-        return apply_function(case_flattened, *arguments)
+        return self.apply_function(case_flattened, *arguments)
 
     def visit_InlinePatientTable(self, node):
         col_names = node.schema.column_names
-        return PatientTable.from_records(
+        return self.patient_table_class.from_records(
             col_names=["patient_id"] + col_names,
             row_records=node.rows,
         )
@@ -445,9 +460,9 @@ class InMemoryQueryEngine(BaseQueryEngine):
         # Combine the list of columns into a single column of tuples (doing things
         # this way allows us to use `apply_fuction` which handles lining everything
         # up correctly for us)
-        combined = apply_function(lambda *args: args, *columns)
+        combined = self.apply_function(lambda *args: args, *columns)
         # Expand the single column of tuples out into a table of multiple columns
-        return EventTable.from_records(
+        return self.event_table_class.from_records(
             ["patient_id", "row_id", *node.members.keys()],
             (
                 (record["patient_id"], record["row_id"], *record["value"])
@@ -456,6 +471,13 @@ class InMemoryQueryEngine(BaseQueryEngine):
         )
 
 
+def get_pick_index(position):
+    return {
+        qm.Position.FIRST: 0,
+        qm.Position.LAST: -1,
+    }[position]
+
+
 def case_flattened(default, *cases):
     """
     Implements CASE WHEN x THEN y ELSE x END logic but takes its arguments in a
@@ -0,0 +1,138 @@
+import numpy as np
+import pyarrow
+
+from ehrql.file_formats.arrow import ROWS_PER_BATCH, get_field_and_convertor
+from ehrql.query_engines import in_memory_columnar_ops as ops
+from ehrql.query_engines.in_memory import InMemoryQueryEngine
+from ehrql.query_engines.in_memory_columnar_database import (
+    CannotVectorise,
+    ColumnarEventTable,
+    ColumnarPatientColumn,
+    ColumnarPatientTable,
+    apply_array_function,
+    apply_function,
+    make_arrow_array,
+)
+from ehrql.query_model import nodes as qm
+
+
+class InMemoryColumnarQueryEngine(InMemoryQueryEngine):
+    """A variant of the in-memory engine which runs against a `ColumnarDatabase`.
+
+    Query evaluation follows the `InMemoryQueryEngine`, which remains the reference
+    implementation. Where possible operations are evaluated over whole arrays at once
+    (see `in_memory_columnar_ops`), falling back to the per-value implementation
+    otherwise.
+    """
+
+    patient_column_class = ColumnarPatientColumn
+    patient_table_class = ColumnarPatientTable
+    event_table_class = ColumnarEventTable
+    apply_function = staticmethod(apply_function)
+
+    def get_results_batches(self, dataset, table_specs):
+        # Measures results are aggregated row by row so there's nothing to gain here
+        if dataset.measures:
+            yield from super().get_results_batches(dataset, table_specs)
+            return
+        tables = self.get_results_as_in_memory_tables(dataset)
+        for table, column_specs in zip(tables, table_specs.values()):
+            yield iter_record_batches(table.to_columns(), column_specs)
+
+    def visit_Value(self, node):
+        if isinstance(node.value, frozenset):
+            value = frozenset(self.convert_value(v) for v in node.value)
+        else:
+            value = self.convert_value(node.value)
+        return ColumnarPatientColumn.from_scalar(
+            self.database.patient_ids, value, default=value
+        )
+
+    def make_patient_column(self, patient_to_value, default):
+        return ColumnarPatientColumn.from_dict(patient_to_value, default)
+
+    def apply_array_function(self, array_fn, *columns):
+        """Apply `array_fn` to columns, returning None if it can't handle them"""
+        if array_fn is None:
+            return None
+        try:
+            return apply_array_function(array_fn, *columns)
+        except CannotVectorise:
+            return None
+
+    def visit_unary_op_with_null(self, node, op):
+        array_fn = ops.get_null_propagating_array_function(op)
+        series = self.visit(node.source)
+        result = self.apply_array_function(array_fn, series)
+        if result is None:
+            result = super().visit_unary_op_with_null(node, op)
+        return result
+
+    def visit_binary_op_with_null(self, node, op):
+        array_fn = ops.get_null_propagating_array_function(op)
+        lhs = self.visit(node.lhs)
+        rhs = self.visit(node.rhs)
+        result = self.apply_array_function(array_fn, lhs, rhs)
+        if result is None:
+            result = super().visit_binary_op_with_null(node, op)
+        return result
+
+    def visit_And(self, node):
+        return apply_array_function(
+            ops.and_, self.visit(node.lhs), self.visit(node.rhs)
+        )
+
+    def visit_Or(self, node):
+        return apply_array_function(ops.or_, self.visit(node.lhs), self.visit(node.rhs))
+
+    def visit_Not(self, node):
+        return apply_array_function(ops.not_, self.visit(node.source))
+
+    def visit_IsNull(self, node):
+        return apply_array_function(ops.is_null, self.visit(node.source))
+
+    def visit_In(self, node):
+        result = None
+        if isinstance(node.rhs, qm.Value):
+            items = self.visit(node.rhs).default
+            result = self.apply_array_function(ops.isin(items), self.visit(node.lhs))
+        if result is None:
+            result = super().visit_In(node)
+        return result
+
+    def visit_Case(self, node):
+        arguments = [self.visit(node.default)]
+        for condition, value in node.cases.items():
+            arguments.extend([self.visit(condition), self.visit(value)])
+        return apply_array_function(ops.case_flattened, *arguments)
+
+    def visit_MaximumOf(self, node):
+        array_fn = ops.aggregate_disregarding_null(np.maximum)
+        columns = [self.visit(source) for source in node.sources]
+        result = self.apply_array_function(array_fn, *columns)
+        if result is None:
+            result = super().visit_MaximumOf(node)
+        return result
+
+    def visit_MinimumOf(self, node):
+        array_fn = ops.aggregate_disregarding_null(np.minimum)
+        columns = [self.visit(source) for source in node.sources]
+        result = self.apply_array_function(array_fn, *columns)
+        if result is None:
+            result = super().visit_MinimumOf(node)
+        return result
+
+
+def iter_record_batches(columns, column_specs):
+    """Convert a dict of (values, nulls) pairs, as returned by `to_columns()`, into
+    `pyarrow.RecordBatch`es with the schema given by `column_specs`
+    """
+    fields = []
+    arrays = []
+    for name, spec in column_specs.items():
+        field, column_to_pyarrow = get_field_and_convertor(name, spec)
+        fields.append(field)
+        arrays.append(make_arrow_array(*columns[name], field.type, column_to_pyarrow))
+    record_batch = pyarrow.record_batch(arrays, schema=pyarrow.schema(fields))
+    for offset in range(0, record_batch.num_rows, ROWS_PER_BATCH):
+        yield record_batch.slice(offset, ROWS_PER_BATCH)
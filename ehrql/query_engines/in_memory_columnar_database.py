@@ -0,0 +1,765 @@
+"""A columnar alternative to the structures in `in_memory_database`, backed by NumPy
+arrays rather than Python dicts.
+
+Each column stores its values in a NumPy array alongside a boolean array marking which
+values are NULL. Where values are of a type with a natural NumPy representation (bool,
+int, float, date) the array is typed; otherwise it holds Python objects.
+
+Patient-level columns hold a sorted array of patient IDs with one value per patient, plus
+a default value for any patient not in the column. Event-level columns hold one entry
+per row, with each patient's rows stored contiguously and patients in ascending order.
+Every row also carries the ID of the row in its original table, which is what we use to
+line up columns from the same table which may have been sorted differently.
+
+These classes implement the same interface as their dict-based counterparts (`filter`,
+`sort`, `pick_at_index`, `aggregate_values` and so on) and are driven by the
+`InMemoryColumnarQueryEngine`.
+"""
+
+import datetime
+from dataclasses import dataclass
+
+import numpy as np
+import pyarrow
+import pyarrow.compute
+
+from ehrql.query_engines.in_memory_database import Rows, parse_value, render_value
+from ehrql.query_model.nodes import has_one_row_per_patient
+from ehrql.renderers import DISPLAY_RENDERERS
+
+
+# Map Python types to the NumPy dtype we use to store them, and the value we store in
+# NULL slots (which is never read, but needs to be valid for the dtype)
+DTYPES = {
+    bool: (np.dtype(bool), False),
+    int: (np.dtype(np.int64), 0),
+    float: (np.dtype(np.float64), 0.0),
+    datetime.date: (np.dtype("datetime64[D]"), None),
+}
+
+OBJECT_DTYPE = np.dtype(object)
+
+# Map tests for Arrow types to the Arrow type we convert them to before moving them into
+# NumPy, and a value to put in NULL slots (which again is never read)
+ARROW_TYPES = [
+    (pyarrow.types.is_boolean, pyarrow.bool_(), False),
+    (pyarrow.types.is_integer, pyarrow.int64(), 0),
+    (pyarrow.types.is_floating, pyarrow.float64(), 0.0),
+    (pyarrow.types.is_date, pyarrow.date32(), datetime.date(1970, 1, 1)),
+]
+
+
+class ColumnarDatabase:
+    def __init__(self, table_data=None):
+        self.populate(table_data or {})
+
+    def populate(self, table_data):
+        self.patient_ids = np.array([], dtype=np.int64)
+        self.tables = {}
+        for qm_table, rows in table_data.items():
+            self.add_table(
+                name=qm_table.name,
+                one_row_per_patient=has_one_row_per_patient(qm_table),
+                columns=["patient_id", *qm_table.schema.column_names],
+                rows=rows,
+            )
+
+    def add_table(self, name, one_row_per_patient, columns, rows):
+        col_records = list(zip(*rows))
+        # For empty tables we need to create the empty columns explicitly
+        if not col_records:
+            col_records = [[]] * len(columns)
+        arrays = [make_array(col_record) for col_record in col_records]
+        self.add_table_from_arrays(name, one_row_per_patient, columns, arrays)
+
+    def add_table_from_arrays(self, name, one_row_per_patient, columns, arrays):
+        """Add a table whose data is given as a (values, nulls) pair for each column"""
+        if one_row_per_patient:
+            table_cls = ColumnarPatientTable
+        else:
+            table_cls = ColumnarEventTable
+            # Insert the synthetic "row_id" column after the patient_id
+            row_ids = np.arange(1, len(arrays[0][0]) + 1, dtype=np.int64)
+            columns = [columns[0], "row_id", *columns[1:]]
+            arrays = [
+                arrays[0],
+                (row_ids, np.zeros_like(row_ids, dtype=bool)),
+                *arrays[1:],
+            ]
+
+        table = table_cls.from_arrays(columns, arrays)
+        self.tables[name] = table
+        self.patient_ids = np.union1d(self.patient_ids, table.patient_ids())
+
+    @property
+    def all_patients(self):
+        return set(self.patient_ids.tolist())
+
+
+@dataclass
+class ColumnarPatientTable:
+    """A wrapper around a mapping from column names to ColumnarPatientColumn instances."""
+
+    name_to_col: dict
+
+    @classmethod
+    def from_records(cls, col_names, row_records):
+        col_records = list(zip(*row_records))
+        # For empty tables we need to create the empty column objects explicitly
+        if not col_records:
+            col_records = [[]] * len(col_names)
+        return cls.from_arrays(col_names, [make_array(r) for r in col_records])
+
+    @classmethod
+    def from_arrays(cls, col_names, arrays):
+        assert col_names[0] == "patient_id"
+        patient_ids = arrays[0][0].astype(np.int64)
+        # Sort by patient, and where a patient appears more than once keep the last
+        # record (matching the behaviour of building a dict from the records)
+        order = np.argsort(patient_ids, kind="stable")
+        sorted_ids = patient_ids[order]
+        is_last = np.ones(len(sorted_ids), dtype=bool)
+        is_last[:-1] = sorted_ids[1:] != sorted_ids[:-1]
+        keep = order[is_last]
+        name_to_col = {}
+        for col_name, (values, nulls) in zip(col_names, arrays):
+            name_to_col[col_name] = ColumnarPatientColumn(
+                patient_ids[keep], values[keep], nulls[keep]
+            )
+        return cls(name_to_col)
+
+    @classmethod
+    def parse(cls, s):
+        """Create instance by parsing string.
+        >>> tbl = ColumnarPatientTable.parse(
+        ...     '''
+        ...       |  i1 |  i2
+        ...     --+-----+-----
+        ...     1 | 101 | 111
+        ...     2 | 201 |
+        ...     '''
+        ... )
+        >>> tbl.name_to_col.keys()
+        dict_keys(['patient_id', 'i1', 'i2'])
+        >>> tbl['i2'][2] is None
+        True
+        """
+
+        header, _, *lines = s.strip().splitlines()
+        col_names = [token.strip() for token in header.split("|")]
+        col_names[0] = "patient_id"
+        row_records = [
+            [parse_value(token.strip()) for token in line.split("|")] for line in lines
+        ]
+        return cls.from_records(col_names, row_records)
+
+    def __repr__(self):
+        return self._render_(DISPLAY_RENDERERS["ascii"])
+
+    def _render_(self, render_fn):
+        return render_fn(list(self.to_records(convert_null=True)))
+
+    def __getitem__(self, name):
+        return self.name_to_col[name]
+
+    def to_records(self, convert_null=False):
+        columns = {
+            name: [render_value(v, convert_null) for v in to_python_list(*column)]
+            for name, column in self.to_columns().items()
+        }
+        for i in range(len(self["patient_id"].patient_ids)):
+            yield {name: values[i] for name, values in columns.items()}
+
+    def to_columns(self):
+        """Return a dict mapping each column name to a (values, nulls) pair with an
+        entry for each patient, in the same order as the rows of `to_records()`
+        """
+        patient_ids = self["patient_id"].patient_ids
+        return {name: col.lookup(patient_ids) for name, col in self.name_to_col.items()}
+
+    def patient_ids(self):
+        return self["patient_id"].patient_ids
+
+    def patients(self):
+        return self["patient_id"].patients()
+
+    def exists(self):
+        patient_ids = self.patient_ids()
+        return ColumnarPatientColumn.from_scalar(patient_ids, True, default=False)
+
+    def count(self):
+        patient_ids = self.patient_ids()
+        return ColumnarPatientColumn.from_scalar(patient_ids, 1, default=0)
+
+    def filter(self, predicate):  # noqa A003
+        return ColumnarPatientTable(
+            {name: col.filter(predicate) for name, col in self.name_to_col.items()}
+        )
+
+
+@dataclass
+class ColumnarEventTable:
+    """A wrapper around a mapping from column names to ColumnarEventColumn instances.
+
+    All columns in a table share the same rows in the same order, so operations which
+    select or re-order rows are calculated once and applied to every column.
+    """
+
+    name_to_col: dict
+
+    @classmethod
+    def from_records(cls, col_names, row_records):
+        col_records = list(zip(*row_records))
+        # For empty tables we need to create the empty column objects explicitly
+        if not col_records:
+            col_records = [[]] * len(col_names)
+        return cls.from_arrays(col_names, [make_array(r) for r in col_records])
+
+    @classmethod
+    def from_arrays(cls, col_names, arrays):
+        assert col_names[0] == "patient_id"
+        assert col_names[1] == "row_id"
+        patient_ids = arrays[0][0].astype(np.int64)
+        row_ids = arrays[1][0].astype(np.int64)
+        # Group rows by patient while preserving the original order of each patient's
+        # rows
+        order = np.argsort(patient_ids, kind="stable")
+        name_to_col = {}
+        for col_name, (values, nulls) in zip(col_names, arrays):
+            name_to_col[col_name] = ColumnarEventColumn(
+                patient_ids[order], row_ids[order], values[order], nulls[order]
+            )
+        return cls(name_to_col)
+
+    @classmethod
+    def parse(cls, s):
+        """Create instance by parsing string.
+        >>> tbl = ColumnarEventTable.parse(
+        ...     '''
+        ...       |   |  i1 |  i2
+        ...     --+---+-----+-----
+        ...     1 | 0 | 100 | 110
+        ...     1 | 1 | 101 |
+        ...     2 | 2 | 200 | 210
+        ...     '''
+        ... )
+        >>> tbl.name_to_col.keys()
+        dict_keys(['patient_id', 'row_id', 'i1', 'i2'])
+        >>> tbl['i1'][1]
+        Rows({0: 100, 1: 101})
+        """
+
+        header, _, *lines = s.strip().splitlines()
+        col_names = [token.strip() for token in header.split("|")]
+        col_names[0] = "patient_id"
+        col_names[1] = "row_id"
+        row_records = [
+            [parse_value(token) for token in line.split("|")] for line in lines
+        ]
+        return cls.from_records(col_names, row_records)
+
+    def __repr__(self):
+        return self._render_(DISPLAY_RENDERERS["ascii"])
+
+    def _render_(self, render_fn):
+        return render_fn(list(self.to_records(convert_null=True)))
+
+    def __getitem__(self, name):
+        return self.name_to_col[name]
+
+    def to_records(self, convert_null=False):
+        columns = {
+            name: [render_value(v, convert_null) for v in to_python_list(*column)]
+            for name, column in self.to_columns().items()
+        }
+        for i in range(len(self["patient_id"].row_ids)):
+            yield {name: values[i] for name, values in columns.items()}
+
+    def to_columns(self):
+        """Return a dict mapping each column name to a (values, nulls) pair with an
+        entry for each row, in the same order as the rows of `to_records()`
+        """
+        rows = self["patient_id"]
+        return {
+            name: align_to_rows(col, rows) for name, col in self.name_to_col.items()
+        }
+
+    def patient_ids(self):
+        return np.unique(self["patient_id"].patient_ids)
+
+    def patients(self):
+        return self["patient_id"].patients()
+
+    def exists(self):
+        return self["patient_id"].aggregate_values(bool, False)
+
+    def count(self):
+        return self["patient_id"].aggregate_values(len, 0)
+
+    def take(self, indices):
+        return ColumnarEventTable(
+            {name: col.take(indices) for name, col in self.name_to_col.items()}
+        )
+
+    def filter(self, predicate):  # noqa A003
+        return self.take(self["patient_id"].filter_indices(predicate))
+
+    def sort(self, sort_index):
+        return self.take(self["patient_id"].sort_indices(sort_index))
+
+    def sort_and_pick_at_index(self, sort_columns, ix):
+        """Equivalent to sorting by each of sort_columns in turn and then picking at
+        index, but using a single sort over all the sort keys
+        """
+        rows = self["patient_id"]
+        ranks = [align_to_rows(col.sort_index(), rows)[0] for col in sort_columns]
+        # `lexsort` treats its last key as the most significant, which is the order we
+        # want: patient ID, then the last sort applied, and so on back to the first.
+        # Being stable, it keeps tied rows in their current order.
+        return self.take(np.lexsort((*ranks, rows.patient_ids))).pick_at_index(ix)
+
+    def pick_at_index(self, ix):
+        patient_ids, indices = self["patient_id"].pick_indices(ix)
+        return ColumnarPatientTable(
+            {
+                name: ColumnarPatientColumn(
+                    patient_ids, col.values[indices], col.nulls[indices]
+                )
+                for name, col in self.name_to_col.items()
+                if name != "row_id"
+            }
+        )
+
+
+@dataclass(eq=False)
+class ColumnarPatientColumn:
+    """A sorted array of patient IDs with a corresponding array of values, with a
+    default value for missing patients.
+    """
+
+    patient_ids: np.ndarray
+    values: np.ndarray
+    nulls: np.ndarray
+    default: object = None
+
+    @classmethod
+    def from_dict(cls, patient_to_value, default=None):
+        patient_ids = np.array(sorted(patient_to_value), dtype=np.int64)
+        values, nulls = make_array([patient_to_value[p] for p in patient_ids.tolist()])
+        return cls(patient_ids, values, nulls, default)
+
+    @classmethod
+    def from_scalar(cls, patient_ids, value, default=None):
+        values, nulls = make_scalar_array(value, len(patient_ids))
+        return cls(patient_ids, values, nulls, default)
+
+    @classmethod
+    def parse(cls, s, default=None):
+        """Create instance by parsing string.
+        >>> col = ColumnarPatientColumn.parse(
+        ...     '''
+        ...     1 | 101
+        ...     2 |
+        ...     '''
+        ... )
+        >>> col.to_dict()
+        {1: 101, 2: None}
+        """
+
+        patient_to_value = {}
+        lines = s.strip().splitlines()
+        if "patient_id" in lines[0]:  # ignore headers from ascii-formatted tables
+            lines = lines[2:]
+
+        for line in lines:
+            p, v = line.split("|")
+            patient_to_value[int(p)] = parse_value(v)
+        return cls.from_dict(patient_to_value, default)
+
+    def __repr__(self):
+        return self._render_(DISPLAY_RENDERERS["ascii"])
+
+    def _render_(self, render_fn):
+        return render_fn(list(self.to_records(convert_null=True)))
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, ColumnarPatientColumn)
+            and self.to_dict() == other.to_dict()
+            and self.default == other.default
+        )
+
+    def __getitem__(self, patient):
+        values, nulls = self.lookup(np.array([patient], dtype=np.int64))
+        return to_python_list(values, nulls)[0]
+
+    def to_dict(self):
+        return dict(
+            zip(self.patient_ids.tolist(), to_python_list(self.values, self.nulls))
+        )
+
+    def to_records(self, convert_null=False):
+        return (
+            {"patient_id": p, "value": render_value(v, convert_null)}
+            for p, v in self.to_dict().items()
+        )
+
+    def patients(self):
+        return set(self.patient_ids.tolist())
+
+    def lookup(self, patient_ids):
+        """Return a (values, nulls) pair giving the value for each of `patient_ids`,
+        using the default value for any patient not in this column
+        """
+        if not len(self.patient_ids):
+            return make_scalar_array(self.default, len(patient_ids))
+        indices = np.searchsorted(self.patient_ids, patient_ids)
+        indices = np.minimum(indices, len(self.patient_ids) - 1)
+        found = self.patient_ids[indices] == patient_ids
+        values, nulls = self.values[indices], self.nulls[indices]
+        if found.all():
+            return values, nulls
+        return where(found, (values, nulls), make_scalar_array(self.default, 1))
+
+    def filter(self, predicate):  # noqa A003
+        keep = is_true(*predicate.lookup(self.patient_ids))
+        return ColumnarPatientColumn(
+            self.patient_ids[keep], self.values[keep], self.nulls[keep], self.default
+        )
+
+
+@dataclass(eq=False)
+class ColumnarEventColumn:
+    """Arrays giving the patient ID, row ID and value of each row, with each patient's
+    rows stored contiguously and patients in ascending order.
+    """
+
+    patient_ids: np.ndarray
+    row_ids: np.ndarray
+    values: np.ndarray
+    nulls: np.ndarray
+
+    @classmethod
+    def parse(cls, s):
+        """Create instance by parsing string.
+        >>> col = ColumnarEventColumn.parse(
+        ...     '''
+        ...     1 | 0 | 101
+        ...     1 | 1 | 102
+        ...     2 | 2 | 201
+        ...     '''
+        ... )
+        >>> col.to_dict()
+        {1: Rows({0: 101, 1: 102}), 2: Rows({2: 201})}
+        """
+
+        records = []
+        lines = s.strip().splitlines()
+        if "patient_id" in lines[0]:  # ignore headers from ascii-formatted tables
+            lines = lines[2:]
+
+        for line in lines:
+            p, k, v = line.split("|")
+            records.append((int(p), int(k), parse_value(v)))
+        table = ColumnarEventTable.from_records(["patient_id", "row_id", "v"], records)
+        return table["v"]
+
+    def __repr__(self):
+        return self._render_(DISPLAY_RENDERERS["ascii"])
+
+    def _render_(self, render_fn):
+        return render_fn(list(self.to_records(convert_null=True)))
+
+    def __eq__(self, other):
+        return isinstance(other, ColumnarEventColumn) and self.to_dict() == (
+            other.to_dict()
+        )
+
+    def __getitem__(self, patient):
+        return self.to_dict().get(patient, Rows({}))
+
+    def to_dict(self):
+        patient_to_rows = {}
+        values = to_python_list(self.values, self.nulls)
+        for p, k, v in zip(self.patient_ids.tolist(), self.row_ids.tolist(), values):
+            patient_to_rows.setdefault(p, Rows({}))[k] = v
+        return patient_to_rows
+
+    def to_records(self, convert_null=False):
+        return (
+            {"patient_id": p, "row_id": k, "value": render_value(v, convert_null)}
+            for p, k, v in zip(
+                self.patient_ids.tolist(),
+                self.row_ids.tolist(),
+                to_python_list(self.values, self.nulls),
+            )
+        )
+
+    def patients(self):
+        return set(self.patient_ids.tolist())
+
+    def take(self, indices):
+        return ColumnarEventColumn(
+            self.patient_ids[indices],
+            self.row_ids[indices],
+            self.values[indices],
+            self.nulls[indices],
+        )
+
+    def patient_boundaries(self):
+        """Return the patient IDs in this column, along with the start and end index of
+        each patient's rows
+        """
+        is_start = np.ones(len(self.patient_ids), dtype=bool)
+        is_start[1:] = self.patient_ids[1:] != self.patient_ids[:-1]
+        starts = np.flatnonzero(is_start)
+        ends = np.empty_like(starts)
+        ends[:-1] = starts[1:]
+        ends[-1:] = len(self.patient_ids)
+        return self.patient_ids[starts], starts, ends
+
+    def aggregate_values(self, fn, default):
+        """Apply aggregation function to all non-null values for each patient.
+
+        See https://github.com/opensafely-core/ehrql/issues/465.
+        """
+
+        patient_ids, starts, ends = self.patient_boundaries()
+        values = to_python_list(self.values, self.nulls)
+        results = []
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            filtered = [v for v in values[start:end] if v is not None]
+            results.append(fn(filtered) if filtered else default)
+        result_values, result_nulls = make_array(results)
+        return ColumnarPatientColumn(patient_ids, result_values, result_nulls, default)
+
+    def filter_indices(self, predicate):
+        return np.flatnonzero(is_true(*align_to_rows(predicate, self)))
+
+    def filter(self, predicate):  # noqa A003
+        return self.take(self.filter_indices(predicate))
+
+    def sort_index(self):
+        """Map each value to its ordinal position in the set of unique values.
+
+        Equal values are given the same position so that sorting remains stable. We
+        rank values across all patients at once: this gives the same relative order as
+        ranking within each patient, which is all that sorting needs.
+        """
+
+        ranks = np.zeros(len(self.values), dtype=np.int64)
+        present = ~self.nulls
+        _, inverse = np.unique(self.values[present], return_inverse=True)
+        # NULLs sort first, so they keep position 0
+        ranks[present] = inverse + 1
+        return ColumnarEventColumn(
+            self.patient_ids, self.row_ids, ranks, np.zeros(len(ranks), dtype=bool)
+        )
+
+    def sort_indices(self, sort_index):
+        ranks, _ = align_to_rows(sort_index, self)
+        # `lexsort` is stable so rows with equal rank keep their current order, and
+        # sorting on patient ID first keeps each patient's rows together
+        return np.lexsort((ranks, self.patient_ids))
+
+    def sort(self, sort_index):
+        return self.take(self.sort_indices(sort_index))
+
+    def pick_indices(self, ix):
+        patient_ids, starts, ends = self.patient_boundaries()
+        if ix == 0:
+            return patient_ids, starts
+        elif ix == -1:
+            return patient_ids, ends - 1
+        else:
+            assert False, f"Unsupported index: {ix}"
+
+    def pick_at_index(self, ix):
+        # As with `EventColumn.pick_at_index()`, patients with no rows are omitted
+        # rather than given a NULL value
+        patient_ids, indices = self.pick_indices(ix)
+        return ColumnarPatientColumn(
+            patient_ids, self.values[indices], self.nulls[indices]
+        )
+
+
+def apply_function(fn, *columns):
+    """Apply function to list containing ColumnarEventColumn and/or
+    ColumnarPatientColumn instances.
+    """
+
+    event_columns = [col for col in columns if isinstance(col, ColumnarEventColumn)]
+    if event_columns:
+        rows = event_columns[0]
+        args = [to_python_list(*align_to_rows(col, rows)) for col in columns]
+        values, nulls = make_array([fn(*arg) for arg in zip(*args)])
+        return ColumnarEventColumn(rows.patient_ids, rows.row_ids, values, nulls)
+    else:
+        patient_ids = get_all_patient_ids(columns)
+        args = [to_python_list(*col.lookup(patient_ids)) for col in columns]
+        values, nulls = make_array([fn(*arg) for arg in zip(*args)])
+        default = fn(*[col.default for col in columns])
+        return ColumnarPatientColumn(patient_ids, values, nulls, default)
+
+
+def apply_array_function(array_fn, *columns):
+    """Apply function to list containing ColumnarEventColumn and/or
+    ColumnarPatientColumn instances, operating on whole arrays at once.
+
+    `array_fn` is called with a (values, nulls) pair for each column, lined up in the
+    same way as by `apply_function`, and must return a (values, nulls) pair. It may
+    raise `CannotVectorise` if it can't handle its arguments, in which case the caller
+    should fall back to using `apply_function`.
+    """
+
+    event_columns = [col for col in columns if isinstance(col, ColumnarEventColumn)]
+    if event_columns:
+        rows = event_columns[0]
+        values, nulls = array_fn(*[align_to_rows(col, rows) for col in columns])
+        return ColumnarEventColumn(rows.patient_ids, rows.row_ids, values, nulls)
+    else:
+        patient_ids = get_all_patient_ids(columns)
+        values, nulls = array_fn(*[col.lookup(patient_ids) for col in columns])
+        default_args = [make_scalar_array(col.default, 1) for col in columns]
+        (default,) = to_python_list(*array_fn(*default_args))
+        return ColumnarPatientColumn(patient_ids, values, nulls, default)
+
+
+class CannotVectorise(Exception):
+    """Raised by array functions given arguments they can't handle"""
+
+
+def get_all_patient_ids(columns):
+    patient_ids = np.array([], dtype=np.int64)
+    for col in columns:
+        patient_ids = np.union1d(patient_ids, col.patient_ids)
+    return patient_ids
+
+
+def align_to_rows(column, rows):
+    """Return a (values, nulls) pair giving the value of `column` for each row in the
+    ColumnarEventColumn `rows`
+
+    Patient-level columns are broadcast across each patient's rows. Event-level columns
+    must contain every row in `rows`, although possibly in a different order and
+    possibly along with other rows (e.g. when filtering an already-filtered frame by a
+    condition on the original frame).
+    """
+    if isinstance(column, ColumnarPatientColumn):
+        return column.lookup(rows.patient_ids)
+    if np.array_equal(column.row_ids, rows.row_ids):
+        return column.values, column.nulls
+    order = np.argsort(column.row_ids)
+    positions = np.searchsorted(column.row_ids, rows.row_ids, sorter=order)
+    indices = order[np.minimum(positions, len(order) - 1)]
+    # This is a sense check that both columns are derived from the same frame, rather
+    # than a check that the query model has supplied compatible series
+    assert np.array_equal(column.row_ids[indices], rows.row_ids)
+    return column.values[indices], column.nulls[indices]
+
+
+def make_array(values):
+    """Convert a sequence of Python values, which may include None, into a pair of NumPy
+    arrays: the values themselves, and a boolean array marking which are NULL
+    """
+    nulls = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+    types = {type(v) for v in values if v is not None}
+    if len(types) == 1 and (dtype_and_fill := DTYPES.get(types.pop())):
+        dtype, fill = dtype_and_fill
+        try:
+            array = np.array(
+                [fill if v is None else v for v in values],
+                dtype=dtype,
+            )
+            return array, nulls
+        except OverflowError:
+            # Integers too large for int64 are stored as Python objects below
+            pass
+    array = np.fromiter(values, dtype=OBJECT_DTYPE, count=len(values))
+    return array, nulls
+
+
+def make_array_from_arrow(chunks):
+    """Convert a sequence of `pyarrow.Array` chunks into a (values, nulls) pair, as
+    `make_array` does for Python values but without creating a Python object for every
+    value where the type has a NumPy representation
+    """
+    if not chunks:
+        return make_array([])
+    arrays = [make_array_from_arrow_chunk(chunk) for chunk in chunks]
+    return (
+        np.concatenate([values for values, _ in arrays]),
+        np.concatenate([nulls for _, nulls in arrays]),
+    )
+
+
+def make_array_from_arrow_chunk(array):
+    if pyarrow.types.is_dictionary(array.type):
+        array = array.dictionary_decode()
+    nulls = array.is_null().to_numpy(zero_copy_only=False)
+    for type_test, arrow_type, fill in ARROW_TYPES:
+        if type_test(array.type):
+            try:
+                array = array.cast(arrow_type)
+            except pyarrow.ArrowInvalid:
+                # Integers too large for int64 are stored as Python objects
+                return make_array(array.to_pylist())
+            filled = pyarrow.compute.fill_null(array, fill)
+            return filled.to_numpy(zero_copy_only=False), nulls
+    # Anything else (e.g. strings) becomes an array of Python objects
+    return array.to_numpy(zero_copy_only=False).astype(OBJECT_DTYPE, copy=False), nulls
+
+
+def make_arrow_array(values, nulls, type_, column_to_pyarrow):
+    """The inverse of `make_array_from_arrow`: convert a (values, nulls) pair into a
+    `pyarrow.Array` of type `type_`
+
+    Arrays with a NumPy representation are converted directly, anything else (or
+    anything which doesn't fit `type_`) is converted to Python values and passed to
+    `column_to_pyarrow`, so errors are reported just as they are for rows of results.
+    """
+    if values.dtype != OBJECT_DTYPE and not pyarrow.types.is_dictionary(type_):
+        try:
+            return pyarrow.array(values, mask=nulls, type=type_)
+        except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+            pass
+    return column_to_pyarrow(to_python_list(values, nulls))
+
+
+def make_scalar_array(value, length):
+    values, nulls = make_array([value])
+    return np.repeat(values, length), np.repeat(nulls, length)
+
+
+def to_python_list(values, nulls):
+    """The inverse of `make_array`"""
+    python_values = values.tolist()
+    for i in np.flatnonzero(nulls).tolist():
+        python_values[i] = None
+    return python_values
+
+
+def where(condition, if_true, if_false):
+    """Select between two (values, nulls) pairs elementwise according to `condition`,
+    converting values to a common dtype where necessary
+    """
+    values_1, nulls_1 = if_true
+    values_2, nulls_2 = if_false
+    if values_1.dtype != values_2.dtype:
+        # An array containing only NULLs tells us nothing about the type of its values
+        # so we can give it whatever type the other array has
+        if nulls_2.all():
+            values_2 = np.zeros(values_2.shape, dtype=values_1.dtype)
+        elif nulls_1.all():
+            values_1 = np.zeros(values_1.shape, dtype=values_2.dtype)
+        else:
+            values_1 = values_1.astype(OBJECT_DTYPE)
+            values_2 = values_2.astype(OBJECT_DTYPE)
+    return np.where(condition, values_1, values_2), np.where(
+        condition, nulls_1, nulls_2
+    )
+
+
+def is_true(values, nulls):
+    # Values in boolean columns are True, False or NULL and only True counts as true
+    return values.astype(bool) & ~nulls
@@ -0,0 +1,418 @@
+"""Whole-array implementations of the operations in the in-memory engine, for use by
+the `InMemoryColumnarQueryEngine`.
+
+Each function here takes a (values, nulls) pair of NumPy arrays for each argument and
+returns a (values, nulls) pair for the result, and must give exactly the same results as
+the per-value implementation it replaces. Where that's not possible (e.g. because the
+values have no native NumPy type, or because an integer result might overflow) the
+function raises `CannotVectorise` and the engine falls back to the per-value
+implementation. This means that arguments which would make the per-value
+implementation raise an error (e.g. date arithmetic which goes out of range) still
+raise the same error.
+"""
+
+import datetime
+import operator
+
+import numpy as np
+
+from ehrql.query_engines.in_memory_columnar_database import (
+    CannotVectorise,
+    is_true,
+    make_array,
+    where,
+)
+from ehrql.utils import date_utils, math_utils
+
+
+# Integers up to this magnitude convert exactly to floats
+MAX_EXACT_FLOAT_INT = 2**53
+# We need to fall back to Python integers for results beyond this magnitude, which we
+# pick to leave plenty of headroom for the imprecision of checking results using floats
+MAX_SAFE_INT = 2**62
+
+MIN_DATE = np.datetime64(datetime.date.min, "D")
+MAX_DATE = np.datetime64(datetime.date.max, "D")
+
+
+def require(condition):
+    if not condition:
+        raise CannotVectorise()
+
+
+def propagate_nulls(array_fn):
+    """Wrap a function which takes an array of values for each argument so that the
+    result is NULL wherever any argument is NULL, like `handle_null()` does for per-value
+    functions.
+
+    As well as its arguments, the wrapped function is passed a boolean array marking
+    which rows have no NULL arguments (the values in other rows are meaningless). It
+    returns either an array of values, or a (values, nulls) pair if it produces NULLs of
+    its own.
+    """
+
+    def array_fn_with_null(*args):
+        nulls = np.logical_or.reduce([arg_nulls for _, arg_nulls in args])
+        # An argument which is entirely NULL tells us nothing about its type, and we
+        # already know the answer
+        if any(arg_nulls.all() for _, arg_nulls in args):
+            return np.full(len(nulls), None, dtype=object), nulls
+        with np.errstate(all="ignore"):
+            result = array_fn(~nulls, *[values for values, _ in args])
+        if isinstance(result, tuple):
+            values, extra_nulls = result
+            return values, nulls | extra_nulls
+        else:
+            return result, nulls
+
+    return array_fn_with_null
+
+
+def is_int(values):
+    return values.dtype.kind == "i"
+
+
+def is_float(values):
+    return values.dtype.kind == "f"
+
+
+def is_numeric(values):
+    return is_int(values) or is_float(values)
+
+
+def is_date(values):
+    return values.dtype.kind == "M"
+
+
+def max_abs(present, values):
+    return np.abs(values[present]).max(initial=0)
+
+
+def check_int_result(present, result, float_result):
+    # If the result was calculated using integers we check it using floats, which won't
+    # overflow silently
+    if is_int(result):
+        require(max_abs(present, float_result) < MAX_SAFE_INT)
+    return result
+
+
+def check_comparable(present, lhs, rhs):
+    if is_numeric(lhs) and is_numeric(rhs):
+        # Python compares ints and floats exactly, but NumPy converts the int to a float
+        # first
+        if lhs.dtype != rhs.dtype:
+            require(max_abs(present, lhs) < MAX_EXACT_FLOAT_INT)
+            require(max_abs(present, rhs) < MAX_EXACT_FLOAT_INT)
+    else:
+        require(lhs.dtype == rhs.dtype and lhs.dtype.kind in "bM")
+
+
+def comparison(ufunc):
+    def compare(present, lhs, rhs):
+        check_comparable(present, lhs, rhs)
+        return ufunc(lhs, rhs)
+
+    return compare
+
+
+def eq(present, lhs, rhs):
+    # Equality is well-defined between arbitrary Python objects, and the NULL slots in
+    # object arrays hold `None` which can be compared with anything
+    if lhs.dtype == rhs.dtype == object:
+        return np.equal(lhs, rhs).astype(bool)
+    check_comparable(present, lhs, rhs)
+    return np.equal(lhs, rhs)
+
+
+def ne(present, lhs, rhs):
+    return ~eq(present, lhs, rhs)
+
+
+def negate(present, values):
+    require(is_numeric(values))
+    return check_int_result(present, np.negative(values), values.astype(float))
+
+
+def absolute(present, values):
+    require(is_numeric(values))
+    return check_int_result(present, np.abs(values), values.astype(float))
+
+
+def arithmetic(ufunc):
+    def apply(present, lhs, rhs):
+        require(is_numeric(lhs) and is_numeric(rhs))
+        return check_int_result(
+            present, ufunc(lhs, rhs), ufunc(lhs.astype(float), rhs.astype(float))
+        )
+
+    return apply
+
+
+def truediv(present, lhs, rhs):
+    require(is_numeric(lhs) and is_numeric(rhs))
+    # Python divides integers exactly and then rounds, whereas NumPy converts them to
+    # floats first
+    for values in (lhs, rhs):
+        if is_int(values):
+            require(max_abs(present, values) < MAX_EXACT_FLOAT_INT)
+    divide_by_zero = rhs == 0
+    return np.true_divide(lhs, np.where(divide_by_zero, 1, rhs)), divide_by_zero
+
+
+def floordiv(present, lhs, rhs):
+    # Python's floor division of floats doesn't quite match NumPy's in all edge cases
+    # so we only handle integers here
+    require(is_int(lhs) and is_int(rhs))
+    divide_by_zero = rhs == 0
+    result = np.floor_divide(lhs, np.where(divide_by_zero, 1, rhs))
+    # The only way integer floor division can overflow is MIN_INT // -1
+    return check_int_result(present, result, lhs.astype(float)), divide_by_zero
+
+
+def cast_to_int(present, values):
+    if is_int(values):
+        return values
+    elif values.dtype == bool:
+        return values.astype(np.int64)
+    else:
+        require(is_float(values))
+        require(np.isfinite(values[present]).all())
+        require(max_abs(present, values) < MAX_SAFE_INT)
+        return np.trunc(values).astype(np.int64)
+
+
+def cast_to_float(present, values):
+    require(is_numeric(values) or values.dtype == bool)
+    return values.astype(np.float64)
+
+
+def date_parts(dates):
+    months = dates.astype("datetime64[M]")
+    years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    month = months.astype(np.int64) % 12 + 1
+    day = (dates - months).astype(np.int64) + 1
+    return years, month, day
+
+
+def month_start(year, month):
+    return ((year - 1970) * 12 + month - 1).astype("datetime64[M]")
+
+
+def check_dates(present, dates):
+    require(((dates[present] >= MIN_DATE) & (dates[present] <= MAX_DATE)).all())
+    return dates
+
+
+def year_from_date(present, dates):
+    require(is_date(dates))
+    return date_parts(dates)[0]
+
+
+def month_from_date(present, dates):
+    require(is_date(dates))
+    return date_parts(dates)[1]
+
+
+def day_from_date(present, dates):
+    require(is_date(dates))
+    return date_parts(dates)[2]
+
+
+def to_first_of_year(present, dates):
+    require(is_date(dates))
+    return dates.astype("datetime64[Y]").astype("datetime64[D]")
+
+
+def to_first_of_month(present, dates):
+    require(is_date(dates))
+    return dates.astype("datetime64[M]").astype("datetime64[D]")
+
+
+def date_add_days(present, dates, num_days):
+    require(is_date(dates) and is_int(num_days))
+    require(max_abs(present, num_days) <= 999999999)
+    return check_dates(present, dates + num_days.astype("timedelta64[D]"))
+
+
+def date_add_months(present, dates, num_months):
+    require(is_date(dates) and is_int(num_months))
+    # Anything bigger than this takes us out of the range of valid dates, and we need
+    # to avoid overflowing below
+    require(max_abs(present, num_months) < 12 * 10000)
+    year, month, day = date_parts(dates)
+    zero_indexed_months = year * 12 + month - 1 + num_months
+    new_year = zero_indexed_months // 12
+    new_month = zero_indexed_months % 12 + 1
+    require(((new_year[present] >= 1) & (new_year[present] <= 9999)).all())
+    start = month_start(new_year, new_month).astype("datetime64[D]")
+    days_in_month = (start.astype("datetime64[M]") + 1).astype("datetime64[D]") - start
+    days_in_month = days_in_month.astype(np.int64)
+    # Where the new month has no corresponding day we roll forward to the first of the
+    # next month, matching `date_utils.date_add_months()`
+    offset = np.where(day > days_in_month, days_in_month, day - 1)
+    return start + offset.astype("timedelta64[D]")
+
+
+def date_add_years(present, dates, num_years):
+    require(is_date(dates) and is_int(num_years))
+    require(max_abs(present, num_years) < 10000)
+    # Adding years is the same as adding twelve times as many months: in both cases the
+    # only day which can be missing from the new month is 29 Feb, which rolls forward to
+    # 1 Mar
+    return date_add_months(present, dates, num_years * 12)
+
+
+def date_difference_in_days(present, end, start):
+    require(is_date(end) and is_date(start))
+    return (end - start).astype(np.int64)
+
+
+def date_difference_in_months(present, end, start):
+    require(is_date(end) and is_date(start))
+    end_year, end_month, end_day = date_parts(end)
+    start_year, start_month, start_day = date_parts(start)
+    month_diff = end_month - start_month + 12 * (end_year - start_year)
+    return month_diff - (end_day < start_day)
+
+
+def date_difference_in_years(present, end, start):
+    require(is_date(end) and is_date(start))
+    end_year, end_month, end_day = date_parts(end)
+    start_year, start_month, start_day = date_parts(start)
+    before_anniversary = (end_month < start_month) | (
+        (end_month == start_month) & (end_day < start_day)
+    )
+    return end_year - start_year - before_anniversary
+
+
+# Maps the per-value functions passed to `handle_null()` in the in-memory engine to their
+# array equivalents
+NULL_PROPAGATING_ARRAY_FUNCTIONS = {
+    operator.eq: eq,
+    operator.ne: ne,
+    operator.lt: comparison(np.less),
+    operator.le: comparison(np.less_equal),
+    operator.gt: comparison(np.greater),
+    operator.ge: comparison(np.greater_equal),
+    operator.neg: negate,
+    operator.abs: absolute,
+    operator.add: arithmetic(np.add),
+    operator.sub: arithmetic(np.subtract),
+    operator.mul: arithmetic(np.multiply),
+    math_utils.truediv: truediv,
+    math_utils.floordiv: floordiv,
+    int: cast_to_int,
+    float: cast_to_float,
+    date_utils.year_from_date: year_from_date,
+    date_utils.month_from_date: month_from_date,
+    date_utils.day_from_date: day_from_date,
+    date_utils.to_first_of_year: to_first_of_year,
+    date_utils.to_first_of_month: to_first_of_month,
+    date_utils.date_add_days: date_add_days,
+    date_utils.date_add_months: date_add_months,
+    date_utils.date_add_years: date_add_years,
+    date_utils.date_difference_in_days: date_difference_in_days,
+    date_utils.date_difference_in_months: date_difference_in_months,
+    date_utils.date_difference_in_years: date_difference_in_years,
+}
+
+
+def get_null_propagating_array_function(fn):
+    array_fn = NULL_PROPAGATING_ARRAY_FUNCTIONS.get(fn)
+    return propagate_nulls(array_fn) if array_fn is not None else None
+
+
+# The functions below implement ehrQL's three-valued logic directly on the NULL masks
+# and so don't need wrapping with `propagate_nulls()`
+
+
+def and_(lhs, rhs):
+    lhs_values, lhs_nulls = lhs
+    rhs_values, rhs_nulls = rhs
+    lhs_true, lhs_false = truth_masks(lhs_values, lhs_nulls)
+    rhs_true, rhs_false = truth_masks(rhs_values, rhs_nulls)
+    true = lhs_true & rhs_true
+    false = lhs_false | rhs_false
+    return true, ~(true | false)
+
+
+def or_(lhs, rhs):
+    lhs_values, lhs_nulls = lhs
+    rhs_values, rhs_nulls = rhs
+    lhs_true, lhs_false = truth_masks(lhs_values, lhs_nulls)
+    rhs_true, rhs_false = truth_masks(rhs_values, rhs_nulls)
+    true = lhs_true | rhs_true
+    false = lhs_false & rhs_false
+    return true, ~(true | false)
+
+
+def not_(arg):
+    values, nulls = arg
+    true, false = truth_masks(values, nulls)
+    return false, nulls
+
+
+def truth_masks(values, nulls):
+    true = is_true(values, nulls)
+    return true, ~true & ~nulls
+
+
+def is_null(arg):
+    _, nulls = arg
+    return nulls.copy(), np.zeros(len(nulls), dtype=bool)
+
+
+def case_flattened(default, *cases):
+    """Array equivalent of `in_memory.case_flattened()`"""
+    values, nulls = default
+    # Apply the cases in reverse order so that earlier cases take priority
+    for condition, value in reversed(list(zip(cases[::2], cases[1::2]))):
+        values, nulls = where(is_true(*condition), value, (values, nulls))
+    return values, nulls
+
+
+def aggregate_disregarding_null(ufunc):
+    """Return an array function equivalent to `disregard_null(fn)` where `ufunc` is the
+    array equivalent of `fn`
+    """
+
+    def apply(*args):
+        length = len(args[0][1])
+        # Arguments which are entirely NULL make no difference to the result
+        args = [(values, nulls) for values, nulls in args if not nulls.all()]
+        if not args:
+            return np.full(length, None, dtype=object), np.ones(length, dtype=bool)
+        require(len({values.dtype for values, _ in args}) == 1)
+        require(args[0][0].dtype != object)
+        values, nulls = args[0]
+        for other_values, other_nulls in args[1:]:
+            values = np.where(
+                nulls | other_nulls,
+                np.where(nulls, other_values, values),
+                ufunc(values, other_values),
+            )
+            nulls = nulls & other_nulls
+        return values, nulls
+
+    return apply
+
+
+def isin(items):
+    """Return an array function equivalent to the per-value `In` operation with a
+    constant set of `items` on the right hand side
+    """
+
+    def apply(arg):
+        values, nulls = arg
+        if not items:
+            return np.zeros(len(values), dtype=bool), np.zeros(len(values), dtype=bool)
+        if values.dtype == object:
+            present = np.flatnonzero(~nulls)
+            result = np.zeros(len(values), dtype=bool)
+            result[present] = [v in items for v in values[present].tolist()]
+            return result, nulls
+        item_values, _ = make_array(list(items))
+        require(item_values.dtype == values.dtype)
+        return np.isin(values, item_values), nulls
+
+    return apply
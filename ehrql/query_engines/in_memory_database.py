@@ -4,6 +4,7 @@ the in-memory engine.
 See tests in test_database.py for comprehensive examples of how this all works.
 """
 
+import itertools
 from collections import defaultdict
 from dataclasses import dataclass
 
@@ -220,6 +221,26 @@ class EventTable:
             }
         )
 
+    def sort_and_pick_at_index(self, sort_columns, ix):
+        """Equivalent to sorting by each of sort_columns in turn and then picking at
+        index, but without sorting the rows.
+        """
+
+        patient_to_key = {
+            p: rows.pick_key_after_sorts([col[p] for col in sort_columns], ix)
+            for p, rows in self["patient_id"].patient_to_rows.items()
+            if rows
+        }
+        return PatientTable(
+            {
+                name: PatientColumn(
+                    {p: col.patient_to_rows[p][k] for p, k in patient_to_key.items()}
+                )
+                for name, col in self.name_to_col.items()
+                if name != "row_id"
+            }
+        )
+
 
 @dataclass
 class PatientColumn:
@@ -423,7 +444,8 @@ class Rows(dict):
         """
 
         sorted_values = sorted(set(self.values()), key=nulls_first_order)
-        return Rows({k: sorted_values.index(v) for k, v in self.items()})
+        positions = {v: i for i, v in enumerate(sorted_values)}
+        return Rows({k: positions[v] for k, v in self.items()})
 
     def sort(self, sort_index):
         """Sort rows by position in sort_index.
@@ -445,9 +467,30 @@ class Rows(dict):
     def pick_at_index(self, ix):
         """Return element at given position."""
 
-        k = list(self)[ix]
+        # Avoid building a list of all the keys just to pick one of them
+        if ix >= 0:
+            k = next(itertools.islice(self, ix, None))
+        else:
+            k = next(itertools.islice(reversed(self), -ix - 1, None))
         return self[k]
 
+    def pick_key_after_sorts(self, sort_keys, ix):
+        """Return the key of the row which would be picked by pick_at_index(ix) after
+        sorting by each of sort_keys in turn, without sorting the rows.
+
+        Because sorting is stable, the last sort is the most significant and rows which
+        are tied on every sort keep their current order.
+        """
+
+        def key(k):
+            return [nulls_first_order(sort_key[k]) for sort_key in reversed(sort_keys)]
+
+        # `min()` and `max()` both return the first of any tied items
+        if ix == 0:
+            return min(self, key=key)
+        assert ix == -1, f"Unsupported index: {ix}"
+        return max(reversed(self), key=key)
+
 
 def apply_function(fn, *columns):
     """Apply function to list containing EventColumn and/or PatientColumn instances."""
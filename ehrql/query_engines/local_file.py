@@ -1,10 +1,32 @@
+import collections
+import hashlib
+import os
+import threading
 from pathlib import Path
 
 from ehrql.file_formats import read_tables
+from ehrql.file_formats.arrow import ArrowRowsReader, write_rows_arrow
 from ehrql.query_engines.in_memory import InMemoryQueryEngine
+from ehrql.query_engines.in_memory_columnar import InMemoryColumnarQueryEngine
+from ehrql.query_engines.in_memory_columnar_database import (
+    ColumnarDatabase,
+    make_array_from_arrow,
+)
 from ehrql.query_engines.in_memory_database import InMemoryDatabase
 from ehrql.query_model.column_specs import get_column_specs_from_schema
-from ehrql.query_model.introspection import get_table_nodes
+from ehrql.query_model.introspection import get_table_columns
+from ehrql.query_model.nodes import has_one_row_per_patient
+
+
+# Rows we've already read from table files, keyed by the reader which produced them
+# (readers compare equal if they read the same file with the same column specs) and
+# stored along with the fingerprint of the file at the time we read it. We keep only the
+# most recently used entries, so that the cache can't grow without bound over the life
+# of the process, but enough of them that alternating between different columns of the
+# same few tables (as the debugger does) doesn't cause misses.
+TABLE_ROWS_CACHE = collections.OrderedDict()
+TABLE_ROWS_CACHE_SIZE = 16
+TABLE_ROWS_CACHE_LOCK = threading.Lock()
 
 
 class LocalFileQueryEngine(InMemoryQueryEngine):
@@ -13,25 +35,127 @@ class LocalFileQueryEngine(InMemoryQueryEngine):
     """
 
     database = None
+    database_class = InMemoryDatabase
 
     def get_results_tables(self, dataset):
-        # Given the dataset supplied determine the tables used and load the associated
-        # data into the database
+        # Given the dataset supplied determine the tables and columns used and load the
+        # associated data into the database
         self.populate_database(
-            get_table_nodes(dataset),
+            get_table_columns(dataset),
         )
         # Run the query as normal
         return super().get_results_tables(dataset)
 
-    def populate_database(self, table_nodes, allow_missing_columns=True):
+    def populate_database(self, table_columns, allow_missing_columns=True):
+        """
+        Load data into the database for the tables in `table_columns` (a dict mapping
+        table nodes to the names of the columns required from them)
+
+        Only the required columns are read, so columns which aren't used don't need to
+        be parsed, or even to be present in the data files.
+        """
         table_specs = {
-            table.name: get_column_specs_from_schema(table.schema)
-            for table in table_nodes
+            table.name: {
+                name: spec
+                for name, spec in get_column_specs_from_schema(table.schema).items()
+                if name == "patient_id" or name in column_names
+            }
+            for table, column_names in table_columns.items()
         }
-        table_rows = read_tables(
+        readers = read_tables(
             Path(self.dsn),
             table_specs,
             allow_missing_columns=allow_missing_columns,
         )
-        table_data = dict(zip(table_nodes, table_rows))
-        self.database = InMemoryDatabase(table_data)
+        self.database = self.database_class()
+        for reader, (table, column_names) in zip(readers, table_columns.items()):
+            self.load_table(table, ["patient_id", *column_names], reader)
+
+    def load_table(self, table, columns, reader):
+        cache_dir = self.environ.get("EHRQL_DUMMY_TABLES_CACHE_DIR")
+        self.database.add_table(
+            name=table.name,
+            one_row_per_patient=has_one_row_per_patient(table),
+            columns=columns,
+            rows=read_rows_cached(reader, cache_dir),
+        )
+
+
+class ColumnarLocalFileQueryEngine(LocalFileQueryEngine, InMemoryColumnarQueryEngine):
+    """
+    Variant of the local file engine which holds its data in NumPy arrays rather than
+    Python dicts, making it practical to use with much larger data files
+    """
+
+    database_class = ColumnarDatabase
+
+    def load_table(self, table, columns, reader):
+        if not isinstance(reader, ArrowRowsReader):
+            return super().load_table(table, columns, reader)
+        # Arrow data can be moved straight into arrays without creating a Python object
+        # for every value
+        batches = list(reader.iter_column_batches())
+        self.database.add_table_from_arrays(
+            name=table.name,
+            one_row_per_patient=has_one_row_per_patient(table),
+            columns=columns,
+            arrays=[
+                make_array_from_arrow([batch[i] for batch in batches])
+                for i in range(len(columns))
+            ],
+        )
+
+
+def read_rows_cached(reader, cache_dir=None):
+    """
+    Return all rows from `reader`, reusing the results of any earlier read of the same
+    unchanged file in this process
+
+    If `cache_dir` is supplied, parsed rows are also stored there as Arrow files so that
+    subsequent processes can skip parsing the original file.
+    """
+    fingerprint = get_file_fingerprint(reader.filename)
+    with TABLE_ROWS_CACHE_LOCK:
+        cached = TABLE_ROWS_CACHE.get(reader)
+        if cached is not None and cached[0] == fingerprint:
+            TABLE_ROWS_CACHE.move_to_end(reader)
+            return cached[1]
+    # Arrow files are already as cheap to read as anything we could cache them as
+    if cache_dir is not None and not isinstance(reader, ArrowRowsReader):
+        rows = read_rows_via_cache_dir(reader, fingerprint, Path(cache_dir))
+    else:
+        rows = tuple(reader)
+    with TABLE_ROWS_CACHE_LOCK:
+        TABLE_ROWS_CACHE[reader] = (fingerprint, rows)
+        TABLE_ROWS_CACHE.move_to_end(reader)
+        while len(TABLE_ROWS_CACHE) > TABLE_ROWS_CACHE_SIZE:
+            TABLE_ROWS_CACHE.popitem(last=False)
+    return rows
+
+
+def read_rows_via_cache_dir(reader, fingerprint, cache_dir):
+    key = repr(
+        (
+            str(reader.filename.resolve()),
+            fingerprint,
+            reader.column_specs,
+            reader.allow_missing_columns,
+        )
+    )
+    cache_file = cache_dir / f"{hashlib.sha256(key.encode()).hexdigest()}.arrow"
+    if cache_file.exists():
+        with ArrowRowsReader(cache_file, reader.column_specs) as cached_reader:
+            return tuple(cached_reader)
+    rows = tuple(reader)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file and then move it into place so that concurrent
+    # processes never see a partially written file
+    tmp_file = cache_file.with_name(f"{cache_file.name}.{os.getpid()}.tmp")
+    write_rows_arrow(tmp_file, rows, reader.column_specs)
+    tmp_file.replace(cache_file)
+    return rows
+
+
+def get_file_fingerprint(filename):
+    stat = filename.stat()
+    return stat.st_mtime_ns, stat.st_size
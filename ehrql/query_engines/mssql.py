@@ -1,3 +1,4 @@
+import contextlib
 import logging
 
 import sqlalchemy
@@ -14,6 +15,7 @@ from ehrql.utils.mssql_log_utils import execute_with_log
 from ehrql.utils.sqlalchemy_exec_utils import (
     execute_with_retry_factory,
     fetch_table_in_batches,
+    fetch_table_in_partitions,
 )
 from ehrql.utils.sqlalchemy_query_utils import GeneratedTable, InsertMany
 
@@ -24,16 +26,50 @@ log = logging.getLogger()
 class MSSQLQueryEngine(BaseSQLQueryEngine):
     sqlalchemy_dialect = MSSQLDialect
 
-    # Use a CTE as the source for the aggregate query rather than a
-    # subquery in order to avoid the "Cannot perform an aggregate function
+    # Provided we use global temporary tables (see `temp_table_name()`) these can be
+    # created concurrently on separate connections
+    supports_concurrent_setup_queries = True
+
+    # The number of connections to use for downloading results. Where this is greater
+    # than one, the results table is split into ranges of patient IDs which are
+    # fetched concurrently and then returned in order.
+    results_fetch_concurrency = 1
+    # The number of partitions to create per connection: using more, smaller
+    # partitions than connections stops a single slow range holding up the rest
+    results_partitions_per_connection = 4
+    # If fetching results still fails after `execute_with_retry` has exhausted its
+    # retries, we resume the download from the last row fetched rather than failing
+    # the job. The results tables stay alive for as long as the connection which
+    # created them, so this lets us ride out much longer outages without repeating the
+    # (potentially hours of) work which produced them.
+    results_fetch_max_resumes = 3
+    results_fetch_resume_sleep = 300.0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.results_fetch_concurrency = int(
+            self.environ.get(
+                "EHRQL_RESULTS_FETCH_CONCURRENCY", self.results_fetch_concurrency
+            )
+        )
+
+    # Use a subquery as the source for the aggregate query, rather than aggregating the
+    # expressions directly, in order to avoid the "Cannot perform an aggregate function
     # on an expression containing an aggregate or a subquery" error
-    def aggregate_series_by_patient(self, source_node, aggregation_func):
-        query = self.get_select_query_for_node_domain(source_node)
-        from_subquery = query.add_columns(self.get_expr(source_node))
+    def get_aggregations_query(self, query, aggregations):
+        from_subquery = query.add_columns(
+            *[sql_expr.label(label) for label, (_, sql_expr) in aggregations.items()]
+        )
         from_subquery = apply_patient_joins(from_subquery).subquery()
-        query = sqlalchemy.select(from_subquery.columns[0])
-        aggregation_expr = aggregation_func(from_subquery.columns[1]).label("value")
-        return self.apply_sql_aggregation(query, aggregation_expr)
+        query = sqlalchemy.select(from_subquery.c.patient_id)
+        query = query.add_columns(
+            *[
+                function(from_subquery.c[label]).label(label)
+                for label, (function, _) in aggregations.items()
+            ]
+        )
+        query = query.group_by(query.selected_columns[0])
+        return apply_patient_joins(query)
 
     def calculate_mean(self, sql_expr):
         # Unlike other DBMSs, MSSQL will return an integer as the mean of integers so we
@@ -135,17 +171,26 @@ class MSSQLQueryEngine(BaseSQLQueryEngine):
             type_=sqlalchemy.Date,
         )
 
-    def reify_query(self, query):
+    def temp_table_name(self, prefix):
         # The `#` prefix is an MSSQL-ism which automatically makes the tables
-        # session-scoped temporary tables
+        # session-scoped temporary tables. If we're creating tables concurrently then
+        # they need to be visible to all our connections so we use the double `##`
+        # prefix to make them global temporary tables, which requires a globally unique
+        # name.
+        if self.setup_query_concurrency > 1:
+            return f"##{prefix}_{self.global_unique_id}_{self.get_next_id()}"
+        else:
+            return f"#{prefix}_{self.get_next_id()}"
+
+    def reify_query(self, query):
         return temporary_table_from_query(
-            table_name=f"#tmp_{self.get_next_id()}",
+            table_name=self.temp_table_name("tmp"),
             query=query,
             index_col="patient_id",
         )
 
     def create_inline_table(self, columns, rows):
-        table_name = f"#inline_data_{self.get_next_id()}"
+        table_name = self.temp_table_name("inline_data")
         table = GeneratedTable(
             table_name,
             sqlalchemy.MetaData(),
@@ -162,16 +207,23 @@ class MSSQLQueryEngine(BaseSQLQueryEngine):
 
     def get_results_queries(self, dataset):
         results_queries = super().get_results_queries(dataset)
+        return self.select_from_results_tables(results_queries)
+
+    def get_interval_batched_measure_queries(self, indexed_datasets):
+        results_queries = super().get_interval_batched_measure_queries(indexed_datasets)
+        return self.select_from_results_tables(results_queries)
+
+    def select_from_results_tables(self, results_queries):
         # Write results to temporary tables and select them from there. This allows us
         # to use more efficient/robust mechanisms to retrieve the results.
         select_queries = []
-        for n, results_query in enumerate(results_queries, start=1):
+        for results_query in results_queries:
             results_table = temporary_table_from_query(
                 # The double `##` prefix here makes this a global temporary table, i.e.
                 # one accessible to other sessions, hence we need a globally unique
                 # name. This allows us to use a separate connection to retrieve results
                 # which gives us more robust retries.
-                f"##results_{self.global_unique_id}_{n}",
+                f"##results_{self.global_unique_id}_{self.get_next_id()}",
                 results_query,
                 index_col=0,
             )
@@ -193,55 +245,88 @@ class MSSQLQueryEngine(BaseSQLQueryEngine):
         # We use a separate connection to retrieve the results. Our intial connection
         # keeps the temporary table "alive" and then this connection can be safely reset
         # and retried if we hit errors during the download (which we often do for
-        # reasons we don't yet understand).
-        with self.engine.connect() as results_connection:
-            # Retry 4 times over the course of 1 minute
-            execute_with_retry = execute_with_retry_factory(
-                results_connection,
-                max_retries=4,
-                retry_sleep=4.0,
-                backoff_factor=2,
-                log=log.info,
-            )
+        # reasons we don't yet understand). Batched results can be fetched over several
+        # such connections concurrently.
+        if query_type is self.QueryType.AGGREGATED:
+            connection_count = 1
+        else:
+            connection_count = self.results_fetch_concurrency
+
+        with contextlib.ExitStack() as stack:
+            executes = []
+            for _ in range(connection_count):
+                results_connection = stack.enter_context(self.engine.connect())
+                # Retry 4 times over the course of 1 minute
+                execute_with_retry = execute_with_retry_factory(
+                    results_connection,
+                    max_retries=4,
+                    retry_sleep=4.0,
+                    backoff_factor=2,
+                    log=log.info,
+                )
+                executes.append(execute_with_retry)
 
             if query_type is self.QueryType.PATIENT_LEVEL:
                 yield from self.fetch_results_batched(
-                    execute_with_retry,
+                    executes,
                     query,
                     key_is_unique=True,
                 )
             elif query_type is self.QueryType.EVENT_LEVEL:
                 yield from self.fetch_results_batched(
-                    execute_with_retry,
+                    executes,
                     query,
                     key_is_unique=False,
                 )
             elif query_type is self.QueryType.AGGREGATED:
                 yield from self.fetch_results_in_one_go(
-                    execute_with_retry,
+                    executes[0],
                     query,
                 )
             else:
                 assert False, f"Unhandled query type: {query_type}"
 
-    def fetch_results_batched(self, execute, query, key_is_unique):
+    def fetch_results_batched(self, executes, query, key_is_unique):
         # We're expecting queries in a very specific form which is "select everything
         # from a single table with a patient_id column"; so we assert that each query
         # has this form and retrieve a reference to the table
         results_table = query.get_final_froms()[0]
         assert str(query) == str(sqlalchemy.select(results_table))
         assert "patient_id" in results_table.columns
+        key_column_index = results_table.columns.keys().index("patient_id")
+        # This value was copied from the previous cohortextractor. I suspect it
+        # has no real scientific basis. We use it as the smallest batch size, but
+        # allow batches to grow where rows are narrow and round trips quick.
+        batch_size = 32000
+        max_batch_size = 512000
 
-        return fetch_table_in_batches(
-            execute,
-            results_table,
-            key_column_index=results_table.columns.keys().index("patient_id"),
-            key_is_unique=key_is_unique,
-            # This value was copied from the previous cohortextractor. I suspect it
-            # has no real scientific basis.
-            batch_size=32000,
-            log=log.info,
-        )
+        if len(executes) > 1:
+            return fetch_table_in_partitions(
+                executes,
+                results_table,
+                key_column_index=key_column_index,
+                key_is_unique=key_is_unique,
+                partition_count=len(executes) * self.results_partitions_per_connection,
+                batch_size=batch_size,
+                log=log.info,
+                max_batch_size=max_batch_size,
+                max_resumes=self.results_fetch_max_resumes,
+                resume_sleep=self.results_fetch_resume_sleep,
+            )
+        else:
+            return fetch_table_in_batches(
+                executes[0],
+                results_table,
+                key_column_index=key_column_index,
+                key_is_unique=key_is_unique,
+                batch_size=batch_size,
+                log=log.info,
+                max_batch_size=max_batch_size,
+                # Fetch the next batch while the current one is being written
+                prefetch=True,
+                max_resumes=self.results_fetch_max_resumes,
+                resume_sleep=self.results_fetch_resume_sleep,
+            )
 
     def fetch_results_in_one_go(self, execute, query):
         results_table = query.get_final_froms()[0]
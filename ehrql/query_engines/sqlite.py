@@ -92,7 +92,7 @@ class SQLiteQueryEngine(BaseSQLQueryEngine):
         columns = get_cyclic_coalescence(columns)
         return aggregate_function(*columns)
 
-    def get_measure_queries(self, grouped_sum, results_query):
+    def get_measure_queries(self, grouped_sum, results_query, interval_column=None):
         """
         Return the SQL queries to fetch the results for a GroupedSum representing
         a collection of measures that share a denominator.
@@ -104,6 +104,9 @@ class SQLiteQueryEngine(BaseSQLQueryEngine):
         results_query is the result of calling get_queries on the dataset that
         the measures will aggregate over.
 
+        If interval_column is supplied then every grouping is additionally grouped by
+        this column, which is returned as the first column of the results.
+
         In order to return a result that is the equivalent to using
         GROUPING SETS, we take each collection of group-by columns (which would be a
         grouping set in other SQL engines) and calculate the sums for the
@@ -127,6 +130,10 @@ class SQLiteQueryEngine(BaseSQLQueryEngine):
         """
         measure_queries = []
 
+        interval_cols = (
+            [results_query.c[interval_column]] if interval_column is not None else []
+        )
+
         # dict of column name to column select query for each group by column,
         # maintaining the order of the columns
         all_group_by_cols = {
@@ -162,9 +169,9 @@ class SQLiteQueryEngine(BaseSQLQueryEngine):
                 all_group_by_cols.values(), group_by_cols
             )
             measure_queries.append(
-                sqlalchemy.select(*sum_overs, *group_select_cols, grouping_id).group_by(
-                    *group_by_cols
-                )
+                sqlalchemy.select(
+                    *interval_cols, *sum_overs, *group_select_cols, grouping_id
+                ).group_by(*interval_cols, *group_by_cols)
             )
 
         return [sqlalchemy.union_all(*measure_queries)]
@@ -19,6 +19,10 @@ log = logging.getLogger()
 class TrinoQueryEngine(BaseSQLQueryEngine):
     sqlalchemy_dialect = TrinoDialect
 
+    # Our "temporary" tables are really persistent tables with globally unique names
+    # so they can safely be created concurrently on separate connections
+    supports_concurrent_setup_queries = True
+
     def get_order_clauses(self, sort_conditions, position):
         order_clauses = super().get_order_clauses(sort_conditions, position)
         # Trino always sorts with nulls last by default. We need ascending sorts to
@@ -1,8 +1,13 @@
 from ehrql.query_model.nodes import (
+    Dataset,
+    Frame,
     InlinePatientTable,
+    SelectColumn,
     SelectPatientTable,
     SelectTable,
+    SeriesCollectionFrame,
     get_input_nodes,
+    get_root_frame,
 )
 
 
@@ -24,14 +29,16 @@ def node_types(tree):  # pragma: no cover
 
 
 def all_unique_nodes(*nodes):
-    found = set()
+    # We use a dict rather than a set so that nodes are returned in a consistent order
+    # (the order in which they're first encountered) regardless of their hash values
+    found = {}
     for node in nodes:
         gather_unique_nodes(node, found)
-    return found
+    return found.keys()
 
 
 def gather_unique_nodes(node, found):
-    found.add(node)
+    found[node] = None
     for subnode in get_input_nodes(node):
         if subnode not in found:
             gather_unique_nodes(subnode, found)
@@ -45,6 +52,36 @@ def get_table_nodes(*nodes):
     }
 
 
+def get_table_columns(*nodes):
+    """
+    Given some nodes, return a dict mapping each table they reference to the list of
+    names of the columns needed to evaluate them (in schema order)
+
+    Any frames derived from tables among the supplied nodes are assumed to be needed in
+    their entirety and so require all the columns of their underlying table.
+    """
+    used = {table: set() for table in get_table_nodes(*nodes)}
+    for node in nodes:
+        # Datasets and event tables are built up from series so they don't implicitly
+        # need any columns beyond those selected by their members
+        if isinstance(node, Frame) and not isinstance(
+            node, Dataset | SeriesCollectionFrame
+        ):
+            root = get_root_frame(node)
+            if root in used:
+                used[root].update(root.schema.column_names)
+    for node in all_unique_nodes(*nodes):
+        if (
+            isinstance(node, SelectColumn)
+            and (root := get_root_frame(node.source)) in used
+        ):
+            used[root].add(node.name)
+    return {
+        table: [name for name in table.schema.column_names if name in names]
+        for table, names in used.items()
+    }
+
+
 def all_inline_patient_ids(*nodes):
     """
     Given some nodes, return a set of all the patient IDs contained in any inline tables
@@ -1,5 +1,7 @@
 import dataclasses
+import threading
 import typing
+import weakref
 from collections.abc import Container, Iterable, Iterator, Mapping, Set
 from datetime import date
 from enum import Enum
@@ -83,15 +85,89 @@ class Position(Enum):
 # might they contain many rows?
 
 
-class Node:
+class NodeType(type):
+    """
+    Metaclass for query model nodes which "interns" them as they're constructed, so
+    that there is only ever one instance of each distinct node
+
+    Query graphs can contain tens of thousands of nodes and we compare and look them up
+    constantly, so we want equality checks to be cheap. Interning means that equal
+    nodes are identical, and so we can compare them by identity rather than by
+    recursively comparing their contents. It also means that graphs which are built
+    separately (e.g. by deserialization) automatically share their common parts.
+    """
+
+    def __call__(cls, *args, **kwargs):
+        node = super().__call__(*args, **kwargs)
+        key = get_interning_key(node)
+        # Query graphs may be built on several threads at once (e.g. when calculating
+        # measures concurrently) and `setdefault` isn't atomic, so without the lock two
+        # threads could each end up with their own instance of the same node
+        with INTERNED_NODES_LOCK:
+            return INTERNED_NODES.setdefault(key, node)
+
+
+# We only want to keep nodes alive while they're in use elsewhere
+INTERNED_NODES = weakref.WeakValueDictionary()
+INTERNED_NODES_LOCK = threading.Lock()
+
+
+def get_interning_key(node):
+    return (
+        node.__class__,
+        *[
+            get_value_key(getattr(node, name))
+            for name in get_field_names(node.__class__)
+        ],
+    )
+
+
+def get_value_key(value):
+    # Any nodes we contain have already been interned, so we can use them directly
+    if isinstance(value, Node):
+        return value
+    # We use dicts in several places in the query model and although they are not
+    # immutable we pinky-promise not to mutate them. Note that their order matters: for
+    # instance, `Case` operations use the first matching condition.
+    elif isinstance(value, dict):
+        return dict, tuple(
+            (get_value_key(k), get_value_key(v)) for k, v in value.items()
+        )
+    elif isinstance(value, tuple | frozenset):
+        return value.__class__, value.__class__(get_value_key(v) for v in value)
+    # Python treats certain differently typed values as equal (e.g. `1 == True` and `10
+    # == 10.0`) but we need to be stricter about types because some of the databases we
+    # run against are strict
+    else:
+        return value.__class__, value
+
+
+@cache
+def get_field_names(cls):
+    return tuple(field.name for field in dataclasses.fields(cls))
+
+
+class Node(metaclass=NodeType):
     "Abstract base class for all objects in the Query Model"
 
     def __init_subclass__(cls, **kwargs):
         # All nodes in the query model are frozen dataclasses
         dataclasses.dataclass(cls, frozen=True)
-        # The __hash__ method gets clobbered by dataclasses, so we need to explicitly
-        # set it.
+        # The __hash__ and __eq__ methods get clobbered by dataclasses, so we need to
+        # explicitly set them.
         cls.__hash__ = Node.__hash__
+        cls.__eq__ = Node.__eq__
+
+    def __eq__(self, other):
+        # Nodes are interned (see `NodeType`) so equal nodes are always identical
+        if not isinstance(other, Node):
+            return NotImplemented
+        return self is other
+
+    def __reduce__(self):
+        # Ensure that copied and unpickled nodes get interned too
+        values = [getattr(self, name) for name in get_field_names(self.__class__)]
+        return self.__class__, tuple(values)
 
     def __hash__(self):
         # Calculating the hash of an object requires recursively calculating the hashes
@@ -99,15 +175,17 @@ class Node:
         # given how frequently `__hash__()` is called, this can end up completely
         # dominating ehrQL's execution time. Given that these are immutable
         # objects we can cache the hash value instead of recalcuting it each time.
+        #
+        # Note that we can't just use the default identity-based hash: while interning
+        # means that it would be correct, it would vary from run to run and we rely on
+        # hashes to give a consistent order in some places.
         try:
             return self.__hash_cache__
         except AttributeError:
             pass
-        values = [getattr(self, field.name) for field in dataclasses.fields(self)]
-        # We use dicts in several places in the query model and although they are not
-        # immutable we pinky-promise not to mutate them and therefore want to make them
-        # hashable. The below recipe is based on a recommendation by Raymond Hettinger:
-        # https://stackoverflow.com/a/16162138
+        values = [getattr(self, name) for name in get_field_names(self.__class__)]
+        # See `get_value_key()` above regarding dicts. The below recipe is based on a
+        # recommendation by Raymond Hettinger: https://stackoverflow.com/a/16162138
         hashable_values = tuple(
             v if not isinstance(v, dict) else (frozenset(v), frozenset(v.values()))
             for v in values
@@ -197,8 +275,8 @@ class Value(OneRowPerPatientSeries[T]):
 
     def __post_init__(self):
         super().__post_init__()
-        # Because we need to be strict about equality (see `__eq__()` below) we can only
-        # accept container types for which we know how to handle equality
+        # Because we need to be strict about equality (see `get_value_key()` above) we
+        # can only accept container types for which we know how to handle equality
         if isinstance(self.value, Container) and not isinstance(
             self.value, frozenset | str
         ):
@@ -207,33 +285,6 @@ class Value(OneRowPerPatientSeries[T]):
                 f" {self.value!r}"
             )
 
-    # Python treats certain differently typed values as equal (e.g. `1 == True` and `10
-    # == 10.0`) but we need to be stricter about types because some of the databases we
-    # run against are strict
-    def __eq__(self, other):
-        if other.__class__ is self.__class__:
-            if self.value.__class__ is not other.value.__class__:
-                return False
-            elif isinstance(self.value, frozenset):
-                return self.__eq__frozenset(self.value, other.value)
-            else:
-                return self.value == other.value
-        return NotImplemented
-
-    @staticmethod
-    def __eq__frozenset(value, other_value):
-        # Cheap test for identical objects. I expect this to be hit quite frequently
-        # because the query model transformation process de-duplicates the query model
-        # so equivalent objects get replaced with identical objects.
-        if value is other_value:
-            return True
-        # Cheap test for obviously not equal sets
-        if len(value) != len(other_value):
-            return False
-        value_typed = {(i, type(i)) for i in value}
-        other_typed = {(i, type(i)) for i in other_value}
-        return value_typed == other_typed
-
 
 # `Parameter` is a placeholder for a value: it allows us to construct query "templates"
 # which can later be turned into queries by substituting in concrete values.
@@ -14,6 +14,7 @@ The transformations applied here are all about efficient execution, and therefor
 want to keep them separate from the core query model classes.
 """
 
+import functools
 from collections import defaultdict
 from collections.abc import Mapping, Set
 from typing import Any, TypeVar
@@ -22,6 +23,8 @@ from ehrql.query_model.introspection import all_unique_nodes
 from ehrql.query_model.nodes import (
     Case,
     Function,
+    InlinePatientTable,
+    Node,
     Parameter,
     PickOneRowPerPatient,
     SelectColumn,
@@ -72,6 +75,11 @@ class Coalesce(Series[T]):
 
 
 def apply_transforms(root_node, skip_optimizations=False):
+    # Simplifying the graph is purely a performance improvement, but it needs to happen
+    # before the other transforms so that they see the simplified nodes
+    if not skip_optimizations:
+        root_node = simplify(root_node)
+
     # Note that we're currently sharing `rewriter`, `nodes` and `reverse_index` across
     # transforms. While we only have one this is obviously fine! It _might_ be OK as we
     # add more depending on whether they're commutative but we should be careful here
@@ -117,6 +125,152 @@ def replace_nodes(root_node, replacements):
     return rewriter.rewrite(root_node)
 
 
+def simplify(root_node):
+    """
+    Return an equivalent graph in which expressions which differ only trivially are
+    rewritten into the same form, and boolean operations on constant values are folded
+
+    Query model nodes compare equal if they have the same structure and so any two
+    parts of the graph which are equal after simplification generate the same SQL and
+    temporary tables (e.g. `a & b` and `b & a` are only calculated once). We also make
+    sure that only one instance of each distinct node remains.
+    """
+    return simplify_value(root_node, {}, {})
+
+
+def simplify_value(value, cache, canonical):
+    if isinstance(value, Value | InlinePatientTable):
+        # Like the `QueryGraphRewriter` we don't recurse into static data
+        return canonical.setdefault(value, value)
+    elif isinstance(value, Node):
+        if value not in cache:
+            cache[value] = simplify_node(value, cache, canonical)
+        return cache[value]
+    elif isinstance(value, dict):
+        # Simplification may make some keys equal: where it does we keep the first as
+        # this gives the right "first match wins" behaviour for `Case` conditions
+        simplified = {}
+        for k, v in value.items():
+            k = simplify_value(k, cache, canonical)
+            if k not in simplified:
+                simplified[k] = simplify_value(v, cache, canonical)
+        return simplified
+    elif isinstance(value, frozenset | tuple):
+        return value.__class__(simplify_value(v, cache, canonical) for v in value)
+    else:
+        return value
+
+
+def simplify_node(node, cache, canonical):
+    attrs = {k: v for k, v in node.__dict__.items() if not k.startswith("_")}
+    new_attrs = simplify_value(attrs, cache, canonical)
+    # Avoid constructing (and hence revalidating) identical nodes
+    if new_attrs != attrs:
+        node = type(node)(**new_attrs)
+    node = simplify_operation(node)
+    return canonical.setdefault(node, node)
+
+
+def simplify_operation(node):
+    """
+    Given a node whose inputs have already been simplified, return a simplified
+    equivalent
+    """
+    if isinstance(node, Function.Not):
+        # Double negation is the identity, even in SQL's three-valued logic
+        if isinstance(node.source, Function.Not):
+            return node.source.source
+        if isinstance(node.source, Value):
+            return Value(not node.source.value)
+    elif isinstance(node, Function.EQ | Function.NE):
+        # Put any fixed value on the right-hand side
+        if isinstance(node.lhs, Value) and not isinstance(node.rhs, Value):
+            return type(node)(lhs=node.rhs, rhs=node.lhs)
+    elif isinstance(node, Function.And | Function.Or):
+        return simplify_logical_operation(node)
+    return node
+
+
+def simplify_logical_operation(node):
+    operation = type(node)
+    # For `And`, `False` determines the result and `True` has no effect, and vice versa
+    # for `Or`. This holds in three-valued logic too e.g. `NULL AND FALSE` is `FALSE`.
+    determining_value = Value(operation is Function.Or)
+    neutral_value = Value(operation is Function.And)
+
+    clauses = unpack_logical_operation(node, operation)
+    clauses = {clause: None for clause in clauses if clause != neutral_value}
+    if not clauses:
+        return neutral_value
+    # Replacing a many-rows-per-patient expression with a value would change its
+    # domain, so we can only do this for one-row-per-patient expressions
+    if determining_value in clauses and has_one_row_per_patient(node):
+        return determining_value
+    if operation is Function.Or:
+        clauses = merge_membership_tests(clauses)
+
+    # Both operations are commutative and associative so we rebuild them with their
+    # clauses in a canonical order. Ordering by hash is arbitrary, but it is consistent
+    # provided hash randomization is disabled (which we need for consistent output in
+    # any case).
+    clauses = sorted(clauses, key=hash)
+    simplified = functools.reduce(
+        lambda lhs, rhs: operation(lhs=lhs, rhs=rhs),
+        clauses,
+    )
+    return node if simplified == node else simplified
+
+
+def merge_membership_tests(clauses):
+    """
+    Given the clauses of an `Or` operation, merge all those which test the same series
+    for membership of a fixed set of values (or equality with a fixed value) into a
+    single `In` operation testing for membership of the union of those sets
+
+    This holds in three-valued logic too: if the series is NULL then both forms are NULL
+    (or both FALSE, if there are no values at all).
+    """
+    values_by_series = {}
+    for clause in clauses:
+        values = get_fixed_values(clause)
+        if values is not None:
+            values_by_series.setdefault(clause.lhs, []).append(values)
+
+    merged = []
+    for clause in clauses:
+        if get_fixed_values(clause) is None:
+            merged.append(clause)
+        elif clause.lhs in values_by_series:
+            values_list = values_by_series.pop(clause.lhs)
+            if len(values_list) == 1:
+                merged.append(clause)
+            else:
+                values = frozenset().union(*values_list)
+                merged.append(Function.In(clause.lhs, Value(values)))
+    return merged
+
+
+def get_fixed_values(clause):
+    # Return the set of fixed values which `clause` tests for membership of, or None if
+    # it's some other kind of operation
+    if isinstance(clause, Function.In) and isinstance(clause.rhs, Value):
+        return clause.rhs.value
+    elif isinstance(clause, Function.EQ) and isinstance(clause.rhs, Value):
+        return frozenset([clause.rhs.value])
+    else:
+        return None
+
+
+def unpack_logical_operation(node, operation):
+    clauses = []
+    for clause in (node.lhs, node.rhs):
+        if isinstance(clause, operation):
+            clauses.extend(unpack_logical_operation(clause, operation))
+        else:
+            clauses.append(clause)
+    return clauses
+
+
 def rewrite_sorts(rewriter, node, reverse_index):
     """
     Frames are sorted in order to then pick the first or last row for a patient. Multiple sorts
@@ -6,6 +6,7 @@ import pathlib
 
 from ehrql import serializer_registry
 from ehrql.codes import BaseCode, BaseMultiCodeString
+from ehrql.file_formats import FILE_FORMATS
 from ehrql.file_formats.base import BaseRowsReader
 from ehrql.loader_types import DefinitionError, ModuleDetails
 from ehrql.measures.measures import DisclosureControlConfig, Measure, MeasureCollection
@@ -19,7 +20,7 @@ from ehrql.query_model.nodes import (
     Value,
 )
 from ehrql.query_model.table_schema import BaseConstraint, Column, TableSchema
-from ehrql.utils.module_utils import get_all_subclasses
+from ehrql.utils.module_utils import get_all_subclasses, import_attribute
 
 
 class SerializerError(Exception):
@@ -53,18 +54,38 @@ TYPE_REGISTRY = {
         *get_all_subclasses(BaseCode),
         *get_all_subclasses(BaseMultiCodeString),
         *get_all_subclasses(BaseConstraint),
-        *get_all_subclasses(BaseRowsReader),
     ]
 }
 
 TYPE_REGISTRY_INVERSE = {type_: name for name, type_ in TYPE_REGISTRY.items()}
 
+# Rows readers are only imported when they're needed (see `FILE_FORMATS`) so we can't
+# include their types in the registry above. Instead we map their names to dotted paths
+# and import them on demand.
+ROWS_READER_REGISTRY = {
+    reader_path.rpartition(".")[2]: reader_path
+    for _, reader_path in FILE_FORMATS.values()
+}
+
 # Ensure no name clashes
 assert len(TYPE_REGISTRY) == len(TYPE_REGISTRY_INVERSE)
+assert TYPE_REGISTRY.keys().isdisjoint(ROWS_READER_REGISTRY.keys())
 
 
 def type_name(obj):
-    return TYPE_REGISTRY_INVERSE[type(obj)]
+    type_ = type(obj)
+    if isinstance(obj, BaseRowsReader):
+        name = type_.__qualname__
+        if ROWS_READER_REGISTRY.get(name) != f"{type_.__module__}.{name}":
+            raise KeyError(type_)
+        return name
+    return TYPE_REGISTRY_INVERSE[type_]
+
+
+def get_type(name):
+    if name in ROWS_READER_REGISTRY:
+        return import_attribute(ROWS_READER_REGISTRY[name])
+    return TYPE_REGISTRY[name]
 
 
 def serialize(value):
@@ -276,7 +297,7 @@ class Unmarshaller:
             # trying to create) but we can look up the dispatch target for the type and
             # call it directly. This avoids us having to write all the type matching
             # code ourselves.
-            type_ = TYPE_REGISTRY[type_name]
+            type_ = get_type(type_name)
             dispatch_target = self.unmarshal_for.dispatch(type_)
             return dispatch_target(self, type_, value)
 
@@ -0,0 +1,85 @@
+import collections
+import concurrent.futures
+import gzip
+import io
+
+
+# Each block of input is compressed independently, which loses the benefit of any
+# repetition across the boundaries between blocks. But DEFLATE only looks back 32KB
+# anyway so, provided blocks are much larger than this, the loss is negligible.
+BLOCK_SIZE = 1024 * 1024
+
+
+class ParallelGzipFile(io.RawIOBase):
+    """
+    A write-only binary file object which gzip compresses its input using a pool of
+    worker threads
+
+    The input is split into blocks which are each compressed as a separate gzip
+    "member". The gzip format allows any number of members to be concatenated and all
+    standard tools (including Python's `gzip` module) decompress the result to the
+    concatenation of their contents. This is the same approach taken by `pigz`.
+
+    Compression happens in `zlib` which releases the GIL, so the threads genuinely run
+    in parallel. To bound memory use we wait for the oldest block to be written before
+    submitting more than two blocks per thread.
+    """
+
+    def __init__(self, filename, compresslevel=6, threads=1, block_size=BLOCK_SIZE):
+        super().__init__()
+        self.compresslevel = compresslevel
+        self.threads = threads
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.block_count = 0
+        self.pending = collections.deque()
+        self.fileobj = open(filename, "wb")
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="ehrql-gzip"
+        )
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[: self.block_size]))
+            del self.buffer[: self.block_size]
+        return len(data)
+
+    def submit(self, block):
+        future = self.pool.submit(gzip.compress, block, self.compresslevel, mtime=0)
+        self.pending.append(future)
+        self.block_count += 1
+        while len(self.pending) > self.threads * 2:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # An empty file should still be a valid gzip file
+            if self.buffer or self.block_count == 0:
+                self.submit(bytes(self.buffer))
+                self.buffer.clear()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.fileobj.close()
+            super().close()
+
+
+def open_gzip_for_writing_text(filename, compresslevel=6, threads=1, newline=None):
+    """
+    Open `filename` for writing gzip compressed text, using `ParallelGzipFile` if more
+    than one thread is requested and `gzip.open` otherwise
+    """
+    if threads <= 1:
+        return gzip.open(filename, "wt", compresslevel=compresslevel, newline=newline)
+    fileobj = ParallelGzipFile(filename, compresslevel=compresslevel, threads=threads)
+    # Match the default encoding used by `gzip.open`
+    return io.TextIOWrapper(
+        io.BufferedWriter(fileobj), encoding=io.text_encoding(None), newline=newline
+    )
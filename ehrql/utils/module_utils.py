@@ -59,3 +59,14 @@ def get_all_subclasses(cls):
     for subclass in cls.__subclasses__():
         yield subclass
         yield from get_all_subclasses(subclass)
+
+
+def import_attribute(dotted_path):
+    """
+    Import and return the attribute given by a dotted path such as
+    `ehrql.file_formats.csv.CSVRowsReader`
+
+    This allows us to defer importing modules until they are actually needed.
+    """
+    module_name, _, attribute_name = dotted_path.rpartition(".")
+    return getattr(importlib.import_module(module_name), attribute_name)
@@ -1,9 +1,26 @@
+import collections
+import concurrent.futures
+import contextlib
+import itertools
+import queue
+import threading
 import time
 
-from sqlalchemy import select
+from sqlalchemy import func, select
 from sqlalchemy.exc import DBAPIError
 
 
+# When adapting batch sizes we aim for each batch to take roughly this long to fetch:
+# long enough that round trip latency is a small fraction of the total, short enough
+# that a retry doesn't lose much work
+TARGET_BATCH_SECONDS = 10.0
+# And we never let the (estimated) size of a single batch exceed this
+MAX_BATCH_BYTES = 256 * 1024 * 1024
+# When fetching a table in partitions, the number of batches of rows each partition can
+# have waiting to be consumed before its worker pauses
+PARTITION_QUEUE_SIZE = 2
+
+
 def fetch_table_in_batches(
     execute,
     table,
@@ -11,6 +28,12 @@ def fetch_table_in_batches(
     key_is_unique,
     batch_size=32000,
     log=lambda *_: None,
+    min_key=None,
+    max_key=None,
+    max_batch_size=None,
+    prefetch=False,
+    max_resumes=0,
+    resume_sleep=0,
 ):
     """
     Returns an iterator over all the rows in a table by querying it in batches
@@ -26,60 +49,129 @@ def fetch_table_in_batches(
             simpler and more efficient algorithm to do the paging
         batch_size: how many results to fetch in each batch
         log: callback to receive log messages
+        min_key: if supplied, only fetch rows with keys greater than this
+        max_key: if supplied, only fetch rows with keys less than or equal to this
+        max_batch_size: if supplied, the size of each batch is adjusted between
+            `batch_size` and this value based on how long previous batches took to
+            fetch and how wide their rows were (see `get_next_batch_size`)
+        prefetch: if True, fetch each batch on a background thread while the rows of
+            the previous batch are being consumed (`execute` must then be safe to call
+            from another thread)
+        max_resumes: if the fetch fails with a database error, the number of times to
+            resume it from the last row returned rather than raising (see
+            `resume_fetch_on_error`)
+        resume_sleep: how many seconds to wait before resuming
     """
-    if key_is_unique:
-        return fetch_table_in_batches_unique(
-            execute, table, key_column_index, batch_size, log
+    batch_sizes = (batch_size, max_batch_size or batch_size)
+
+    def fetch(min_key):
+        fetcher = BatchFetcher(execute, prefetch)
+        if key_is_unique:
+            return fetch_table_in_batches_unique(
+                fetcher, table, key_column_index, batch_sizes, log, min_key, max_key
+            )
+        else:
+            return fetch_table_in_batches_nonunique(
+                fetcher, table, key_column_index, batch_sizes, log, min_key, max_key
+            )
+
+    if max_resumes > 0:
+        return resume_fetch_on_error(
+            fetch, key_column_index, min_key, max_resumes, resume_sleep, log
         )
     else:
-        return fetch_table_in_batches_nonunique(
-            execute, table, key_column_index, batch_size, log
-        )
+        return fetch(min_key)
+
+
+def resume_fetch_on_error(
+    fetch, key_column_index, min_key, max_resumes, resume_sleep, log
+):
+    """
+    Returns an iterator over the rows returned by `fetch(min_key)` which, if this fails
+    with a database error, calls `fetch` again to resume from just after the last row
+    returned
+
+    Both batching algorithms only ever return complete sets of rows for each key before
+    requesting the next batch, so when a query fails every row with a key up to and
+    including the last one we returned has been returned, and no rows with later keys
+    have been.
+
+    This lets us recover from failures which outlast the retries in
+    `execute_with_retry` without losing the rows already fetched or the (potentially
+    very expensive) work which produced the table being fetched.
+    """
+    resumes = 0
+    while True:
+        try:
+            for row in fetch(min_key):
+                yield row
+                min_key = row[key_column_index]
+            return
+        except DBAPIError as e:
+            if resumes >= max_resumes:
+                raise
+            resumes += 1
+            log(f"{e.__class__.__name__}: {e}")
+            log(
+                f"Resuming fetch after key {min_key!r} in {resume_sleep}s "
+                f"(attempt {resumes} / {max_resumes})"
+            )
+            time.sleep(resume_sleep)
 
 
 def fetch_table_in_batches_unique(
-    execute, table, key_column_index, batch_size=32000, log=lambda *_: None
+    fetcher, table, key_column_index, batch_sizes, log, min_key, max_key
 ):
     """
     Returns an iterator over all the rows in a table by querying it in batches using a
     unique key column
     """
-    assert batch_size > 0
+    min_batch_size, max_batch_size = batch_sizes
+    assert min_batch_size > 0
+    batch_size = min_batch_size
     batch_count = 1
     total_rows = 0
-    min_key = None
 
     key_column = table.columns[key_column_index]
 
-    log(
-        f"Fetching rows from '{table}' in batches of {batch_size} using unique "
-        f"column '{key_column.name}'"
-    )
-    while True:
+    def get_query(min_key, batch_size):
         query = select(table).order_by(key_column).limit(batch_size)
         if min_key is not None:
             query = query.where(key_column > min_key)
+        if max_key is not None:
+            query = query.where(key_column <= max_key)
+        return query
 
-        log(f"Fetching batch {batch_count}")
-        results = execute(query)
+    log(
+        f"Fetching rows from '{table}' in batches of {batch_size} using unique "
+        f"column '{key_column.name}'"
+    )
+    log(f"Fetching batch {batch_count}")
+    with fetcher:
+        fetcher.start(get_query(min_key, batch_size))
+        while True:
+            rows, duration = fetcher.result()
+            total_rows += len(rows)
+            batch_count += 1
 
-        row_count = 0
-        for row in results:
-            row_count += 1
-            yield row
+            is_complete = len(rows) < batch_size
+            if not is_complete:
+                # Start the next batch before handing over the rows of this one
+                batch_size = get_next_batch_size(
+                    rows, duration, batch_size, min_batch_size, max_batch_size, log
+                )
+                log(f"Fetching batch {batch_count}")
+                fetcher.start(get_query(rows[-1][key_column_index], batch_size))
 
-        total_rows += row_count
-        batch_count += 1
+            yield from rows
 
-        if row_count < batch_size:
-            log(f"Fetch complete, total rows: {total_rows}")
-            break
-        else:
-            min_key = row[key_column_index]
+            if is_complete:
+                log(f"Fetch complete, total rows: {total_rows}")
+                break
 
 
 def fetch_table_in_batches_nonunique(
-    execute, table, key_column_index, batch_size=32000, log=lambda *_: None
+    fetcher, table, key_column_index, batch_sizes, log, min_key, max_key
 ):
     """
     Returns an iterator over all the rows in a table by querying it in batches using a
@@ -141,63 +233,281 @@ def fetch_table_in_batches_nonunique(
     given the likely sizes involved this seems very unlikely but we add a check to raise
     an explicit error if this ever happens.
     """
-    assert batch_size > 1
+    min_batch_size, max_batch_size = batch_sizes
+    assert min_batch_size > 1
+    batch_size = min_batch_size
     batch_count = 1
     total_rows = 0
-    current_key = None
-    last_fully_fetched_key = None
-    accumulated_rows = []
 
     key_column = table.columns[key_column_index]
 
+    def get_query(last_fully_fetched_key, batch_size):
+        query = select(table).order_by(key_column).limit(batch_size)
+        if last_fully_fetched_key is not None:
+            query = query.where(key_column > last_fully_fetched_key)
+        if max_key is not None:
+            query = query.where(key_column <= max_key)
+        return query
+
     log(
         f"Fetching rows from '{table}' in batches of {batch_size} using non-unique "
         f"column '{key_column.name}'"
     )
-    while True:
-        query = select(table).order_by(key_column).limit(batch_size)
-        if last_fully_fetched_key is not None:
-            query = query.where(key_column > last_fully_fetched_key)
+    log(f"Fetching batch {batch_count}")
+    with fetcher:
+        fetcher.start(get_query(min_key, batch_size))
+        while True:
+            rows, duration = fetcher.result()
+            batch_count += 1
+
+            if len(rows) < batch_size:
+                # If we got fewer rows than we asked for then we've reached the end of
+                # the table: emit all the rows, log, and exit
+                total_rows += len(rows)
+                yield from rows
+                log(f"Fetch complete, total rows: {total_rows}")
+                break
+
+            # Otherwise the rows with the final key in the batch may be incomplete, so
+            # we find where they start and emit only the rows before them
+            last_key = rows[-1][key_column_index]
+            complete_row_count = len(rows) - 1
+            while (
+                complete_row_count > 0
+                and rows[complete_row_count - 1][key_column_index] == last_key
+            ):
+                complete_row_count -= 1
+
+            if complete_row_count == 0:
+                # If we can't emit _any_ rows then we must have a group of rows with the
+                # same key that is equal to, or larger than, the batch size. We cannot
+                # handle this situation so we throw an error. (Given the sizes involved
+                # it seems unlikely we could hit this in production.)
+                raise AssertionError("`batch_size` too small to make progress")
+
+            # Start the next batch, which will include the incomplete rows again, before
+            # handing over the complete rows from this one
+            last_fully_fetched_key = rows[complete_row_count - 1][key_column_index]
+            batch_size = get_next_batch_size(
+                rows, duration, batch_size, min_batch_size, max_batch_size, log
+            )
+            log(f"Fetching batch {batch_count}")
+            fetcher.start(get_query(last_fully_fetched_key, batch_size))
+
+            total_rows += complete_row_count
+            yield from itertools.islice(rows, complete_row_count)
+
+
+class BatchFetcher:
+    """
+    Executes the query for each batch in turn, returning its rows as a list along with
+    how long it took to fetch them
+
+    If `prefetch` is True each query runs on a background thread so that, provided the
+    next query is started before the current batch is consumed, fetching overlaps with
+    consuming. Otherwise queries run on the calling thread when their result is
+    requested.
+
+    Usage is:
+
+        with BatchFetcher(execute, prefetch) as fetcher:
+            fetcher.start(query)
+            ...
+            rows, duration = fetcher.result()
+    """
 
-        log(f"Fetching batch {batch_count}")
-        results = execute(query)
-
-        # We iterate over the results for the batch, accumulating rows in a list
-        row_count = 0
-        for row in results:
-            row_count += 1
-            next_key = row[key_column_index]
-            # Whenever the value of the key changes we know we've now got a complete set
-            # of rows with the _previous_ key, so we emit those rows, empty the
-            # accumulator, and mark the new value of the key as the current one
-            if next_key != current_key:
-                yield from accumulated_rows
-                accumulated_rows.clear()
-                last_fully_fetched_key = current_key
-                current_key = next_key
-            accumulated_rows.append(row)
-
-        # The total number of rows we've emitted is the number we've read minus any
-        # still left in the accumulator
-        total_rows += row_count - len(accumulated_rows)
-        batch_count += 1
-
-        if row_count < batch_size:
-            # If we got fewer rows than we asked for then we've reach the end of the
-            # table: emit any remaining rows, log, and exit
-            yield from accumulated_rows
-            total_rows += len(accumulated_rows)
-            log(f"Fetch complete, total rows: {total_rows}")
-            break
-        elif row_count == len(accumulated_rows):
-            # If we didn't emit _any_ rows then we must have a group of rows with the
-            # same key that is equal to, or larger than, the batch size. We cannot
-            # handle this situation so we throw an error. (Given the sizes involved it
-            # seems unlikely we could hit this in production.)
-            raise AssertionError("`batch_size` too small to make progress")
+    def __init__(self, execute, prefetch):
+        self.execute = execute
+        self.prefetch = prefetch
+        self.pending = None
+
+    def __enter__(self):
+        if self.prefetch:
+            self.pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="ehrql-prefetch"
+            )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.prefetch:
+            # If we stop early, cancel the next batch if it hasn't started being
+            # fetched, otherwise wait for its query to finish before closing
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def start(self, query):
+        if self.prefetch:
+            self.pending = self.pool.submit(self.fetch, query)
         else:
-            # Otherwise we empty the accumulator and fetch another batch
-            accumulated_rows.clear()
+            self.pending = query
+
+    def result(self):
+        if self.prefetch:
+            return self.pending.result()
+        else:
+            return self.fetch(self.pending)
+
+    def fetch(self, query):
+        start = time.monotonic()
+        rows = list(self.execute(query))
+        return rows, time.monotonic() - start
+
+
+def get_next_batch_size(rows, duration, batch_size, min_size, max_size, log):
+    """
+    Return the size of the batch to fetch after a full batch of `rows` which took
+    `duration` seconds to fetch
+
+    We aim for batches which take `TARGET_BATCH_SECONDS` to fetch, and which take up no
+    more than `MAX_BATCH_BYTES`, but never more than double the size from one batch to
+    the next.
+    """
+    if min_size == max_size:
+        return batch_size
+    size_for_duration = batch_size * TARGET_BATCH_SECONDS / max(duration, 0.001)
+    size_for_bytes = MAX_BATCH_BYTES / estimate_row_bytes(rows)
+    next_size = min(size_for_duration, size_for_bytes, batch_size * 2)
+    next_size = int(max(min_size, min(next_size, max_size)))
+    if next_size != batch_size:
+        log(f"Adjusting batch size to {next_size}")
+    return next_size
+
+
+def estimate_row_bytes(rows, sample_size=100):
+    """
+    Return a rough estimate of the average size in bytes of the values in `rows`,
+    counting strings by their length and everything else as eight bytes
+    """
+    sample = rows[:: max(len(rows) // sample_size, 1)]
+    total = sum(
+        len(value) if isinstance(value, str | bytes) else 8
+        for row in sample
+        for value in row
+    )
+    return max(total / len(sample), 1)
+
+
+def fetch_table_in_partitions(
+    executes,
+    table,
+    key_column_index,
+    key_is_unique,
+    partition_count,
+    batch_size=32000,
+    log=lambda *_: None,
+    max_batch_size=None,
+    max_resumes=0,
+    resume_sleep=0,
+):
+    """
+    Returns an iterator over all the rows in a table, in key order, by splitting the
+    table into ranges of keys and fetching these concurrently
+
+    Each partition is fetched using `fetch_table_in_batches` on a pool of worker
+    threads, one for each of `executes`. These must be independent callables (e.g.
+    each wrapping a separate connection) which can safely be run concurrently. Rows are
+    handed back from the workers in batches via a bounded queue for each partition, so
+    memory use depends on the number of workers and the batch size rather than on the
+    size of the partitions.
+
+    Other arguments are as for `fetch_table_in_batches`, plus:
+
+        partition_count: the (maximum) number of partitions to split the table into
+    """
+    boundaries = get_key_boundaries(
+        executes[0], table, key_column_index, partition_count
+    )
+    key_ranges = list(zip([None, *boundaries], [*boundaries, None]))
+    log(
+        f"Fetching rows from '{table}' in {len(key_ranges)} partitions using "
+        f"{len(executes)} connections"
+    )
+
+    available_executes = queue.SimpleQueue()
+    for execute in executes:
+        available_executes.put(execute)
+    # Set when we stop consuming rows, so that workers don't block waiting for us
+    stopped = threading.Event()
+
+    def put_unless_stopped(batches, item):
+        while not stopped.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def fetch_partition(index, min_key, max_key, batches):
+        execute = available_executes.get()
+        try:
+            rows = fetch_table_in_batches(
+                execute,
+                table,
+                key_column_index,
+                key_is_unique=key_is_unique,
+                batch_size=batch_size,
+                log=lambda message: log(f"Partition {index}: {message}"),
+                min_key=min_key,
+                max_key=max_key,
+                max_batch_size=max_batch_size,
+                max_resumes=max_resumes,
+                resume_sleep=resume_sleep,
+            )
+            with contextlib.closing(rows):
+                for batch in itertools.batched(rows, batch_size):
+                    if not put_unless_stopped(batches, batch):
+                        break
+        finally:
+            available_executes.put(execute)
+            # Mark the end of the partition, whether or not it completed successfully
+            put_unless_stopped(batches, None)
+
+    partitions = iter(enumerate(key_ranges, start=1))
+    pending = collections.deque()
+    pool = concurrent.futures.ThreadPoolExecutor(
+        max_workers=len(executes), thread_name_prefix="ehrql-fetch"
+    )
+
+    def start_partitions(count):
+        for index, key_range in itertools.islice(partitions, count):
+            batches = queue.Queue(maxsize=PARTITION_QUEUE_SIZE)
+            future = pool.submit(fetch_partition, index, *key_range, batches)
+            pending.append((future, batches))
+
+    try:
+        start_partitions(len(executes))
+        while pending:
+            future, batches = pending.popleft()
+            start_partitions(1)
+            while (batch := batches.get()) is not None:
+                yield from batch
+            # Raise any error encountered while fetching the partition
+            future.result()
+    finally:
+        # If we stop early, cancel the partitions which haven't started and tell the
+        # running ones to stop, then wait for their current queries to finish
+        stopped.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def get_key_boundaries(execute, table, key_column_index, partition_count):
+    """
+    Return a sorted list of keys which divide the rows of `table` into (at most)
+    `partition_count` partitions of roughly equal size, with each boundary key being
+    the largest key in its partition
+
+    Rows with the same key always end up in the same partition, so heavily repeated
+    keys may result in fewer partitions than requested.
+    """
+    key_column = table.columns[key_column_index]
+    tiles = select(
+        key_column.label("key"),
+        func.ntile(partition_count).over(order_by=key_column).label("tile"),
+    ).subquery()
+    query = select(func.max(tiles.c.key)).group_by(tiles.c.tile)
+    largest_keys = sorted({row[0] for row in execute(query)})
+    # The largest key overall doesn't divide anything
+    return largest_keys[:-1]
 
 
 def execute_with_retry_factory(
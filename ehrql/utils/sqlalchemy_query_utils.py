@@ -1,4 +1,5 @@
 import collections
+import concurrent.futures
 from itertools import islice
 
 import sqlalchemy
@@ -115,23 +116,7 @@ def add_setup_and_cleanup_queries(queries):
     NOTE: If you are here because you are trying to debug why some temporary objects are
     being cleaned up too early then see the note in the GeneratedTable docstring.
     """
-    # We have a tree whose nodes consist of queries and the GeneratedTables on which
-    # they depend, and any GeneratedTable on which _those_ depend and so on recursively.
-    # We represent this using the two dicts below:
-    #
-    # Map nodes to a list of their immediate parents
-    parents = {}
-    # Map nodes to a list of all their ancestors
-    ancestors = {}
-    # Populate the dicts
-    for query in queries:
-        build_relations(parents, ancestors, query)
-
-    # Count how many direct children each node has (i.e. how many times it appears as a
-    # parent) so we can track when they are no longer needed
-    child_count = collections.Counter()
-    for parent_nodes in parents.values():
-        child_count.update(parent_nodes)
+    parents, ancestors, child_count = get_dependency_graph(queries)
 
     # We use a dictionary as a poor man's ordered set type which ensures we only add a
     # node once even if it's an ancestor of multiple other nodes
@@ -159,6 +144,133 @@ def add_setup_and_cleanup_queries(queries):
     return all_queries
 
 
+def get_dependency_graph(queries):
+    """
+    Given a list of SQLAlchemy queries, return a triple of:
+
+        parents: dict mapping each node to a list of its immediate parents
+        ancestors: dict mapping each node to a list of all its ancestors
+        child_count: Counter giving the number of immediate children of each node
+
+    Where the "nodes" are the queries themselves plus all the GeneratedTables on which
+    they depend, directly or indirectly.
+    """
+    # We have a tree whose nodes consist of queries and the GeneratedTables on which
+    # they depend, and any GeneratedTable on which _those_ depend and so on recursively.
+    # We represent this using the two dicts below:
+    #
+    # Map nodes to a list of their immediate parents
+    parents = {}
+    # Map nodes to a list of all their ancestors
+    ancestors = {}
+    # Populate the dicts
+    for query in queries:
+        build_relations(parents, ancestors, query)
+
+    # Count how many direct children each node has (i.e. how many times it appears as a
+    # parent) so we can track when they are no longer needed
+    child_count = collections.Counter()
+    for parent_nodes in parents.values():
+        child_count.update(parent_nodes)
+
+    return parents, ancestors, child_count
+
+
+class ConcurrentSetupRunner:
+    """
+    Runs the setup and cleanup queries required by a list of SQLAlchemy queries, using
+    a pool of worker threads to create independent GeneratedTables concurrently
+
+    This is the concurrent counterpart to `add_setup_and_cleanup_queries`: rather than
+    producing a single linear sequence of queries it treats the GeneratedTables as a
+    DAG and creates each table as soon as all of its parents exist. As before, each
+    table is cleaned up as soon as its last child has been created (or, for the
+    original queries, executed).
+
+    `execute` is called from the worker threads with a list of queries to be run in
+    sequence (the setup or cleanup queries for a single table). It must be safe to call
+    concurrently and it's the caller's responsibility to ensure that tables created by
+    one call are visible to all the others e.g. by not using session-scoped temporary
+    tables.
+
+    Usage is:
+
+        with ConcurrentSetupRunner(queries, execute, max_workers) as runner:
+            for query in queries:
+                runner.setup(query)
+                ... execute query ...
+                runner.cleanup(query)
+    """
+
+    def __init__(self, queries, execute, max_workers):
+        self.parents, self.ancestors, self.child_count = get_dependency_graph(queries)
+        self.execute = execute
+        self.max_workers = max_workers
+        self.created = set()
+        self.cleanup_futures = []
+
+    def __enter__(self):
+        self.pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="ehrql-setup"
+        )
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            return
+        # Wait for any outstanding cleanup, surfacing any errors it raised
+        try:
+            for future in self.cleanup_futures:
+                future.result()
+        finally:
+            self.pool.shutdown(wait=True)
+
+    def setup(self, query):
+        """
+        Create every table needed by `query` which doesn't already exist, blocking
+        until they are all ready
+        """
+        # Most distant ancestors come first, which keeps the submission order as close
+        # as possible to that produced by `add_setup_and_cleanup_queries`
+        pending = {
+            table: None
+            for table in reversed(self.ancestors.get(query, ()))
+            if table not in self.created
+        }
+        running = {}
+        while pending or running:
+            for table in list(pending):
+                if all(parent in self.created for parent in self.parents[table]):
+                    del pending[table]
+                    future = self.pool.submit(self.execute, get_node_queries(table))
+                    running[future] = table
+            # The tables form a DAG so if nothing is pending then something must be
+            # running
+            assert running
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                table = running.pop(future)
+                # Re-raise any exception from the worker thread
+                future.result()
+                self.created.add(table)
+                self.cleanup(table)
+
+    def cleanup(self, node):
+        """
+        Record that `node` has been created or executed and schedule cleanup for any
+        of its parents which are no longer needed
+        """
+        for parent in self.parents.get(node, ()):
+            self.child_count[parent] -= 1
+            if self.child_count[parent] == 0 and parent.cleanup_queries:
+                self.cleanup_futures.append(
+                    self.pool.submit(self.execute, parent.cleanup_queries)
+                )
+
+
 def build_relations(parents, ancestors, node):
     # Avoid re-recursing into nodes we've already seen: on some of our larger and more
     # nested query graphs this can get very expensive
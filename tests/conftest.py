@@ -13,6 +13,8 @@ import ehrql.__main__
 from ehrql import query_language as ql
 from ehrql.main import get_sql_strings
 from ehrql.query_engines.in_memory import InMemoryQueryEngine
+from ehrql.query_engines.in_memory_columnar import InMemoryColumnarQueryEngine
+from ehrql.query_engines.in_memory_columnar_database import ColumnarDatabase
 from ehrql.query_engines.mssql import MSSQLQueryEngine
 from ehrql.query_engines.sqlite import SQLiteQueryEngine
 from ehrql.query_engines.trino import TrinoQueryEngine
@@ -233,7 +235,7 @@ def sort_key_with_nones(row):
     return [(v is not None, v) for v in row]
 
 
-QUERY_ENGINE_NAMES = ("in_memory", "sqlite", "mssql", "trino")
+QUERY_ENGINE_NAMES = ("in_memory", "in_memory_columnar", "sqlite", "mssql", "trino")
 
 
 def engine_factory(request, engine_name, with_session_scope=False):
@@ -241,6 +243,12 @@ def engine_factory(request, engine_name, with_session_scope=False):
         return QueryEngineFixture(
             engine_name, InMemoryPythonDatabase(), InMemoryQueryEngine
         )
+    if engine_name == "in_memory_columnar":
+        return QueryEngineFixture(
+            engine_name,
+            InMemoryPythonDatabase(ColumnarDatabase),
+            InMemoryColumnarQueryEngine,
+        )
 
     if engine_name == "sqlite":
         database_fixture_name = "in_memory_sqlite_database"
@@ -3,7 +3,7 @@ import pytest
 
 def test_driver_in_container(call_cli_docker, engine):
     # This test doesn't make sense for these in-memory databases
-    if engine.name in {"in_memory", "sqlite"}:
+    if engine.name in {"in_memory", "in_memory_columnar", "sqlite"}:
         pytest.skip()
 
     backends = {
@@ -512,6 +512,50 @@ def test_generate_dataset_with_event_level_data(sqlite_engine, call_cli, tmp_pat
     ]
 
 
+def test_generate_dataset_with_arrow_output(sqlite_engine, call_cli, tmp_path):
+    # Arrow output is written directly from record batches rather than rows
+    engine = sqlite_engine
+
+    engine.populate(
+        {
+            core.patients: [
+                {"patient_id": 1, "date_of_birth": date(1980, 1, 1), "sex": "female"},
+                {"patient_id": 2, "date_of_birth": date(1990, 1, 1), "sex": "male"},
+            ],
+        }
+    )
+
+    @function_body_as_string
+    def dataset_definition():
+        from ehrql import create_dataset
+        from ehrql.tables.core import patients
+
+        dataset = create_dataset()
+        dataset.define_population(patients.exists_for_patient())
+        dataset.dob = patients.date_of_birth
+        dataset.sex = patients.sex
+
+    dataset_definition_path = tmp_path / "dataset_definition.py"
+    dataset_definition_path.write_text(dataset_definition)
+    output_path = tmp_path / "dataset.arrow"
+
+    call_cli(
+        "generate-dataset",
+        dataset_definition_path,
+        "--output",
+        output_path,
+        "--dsn",
+        engine.database.host_url(),
+        "--query-engine",
+        engine.name,
+    )
+
+    assert read_file_as_dicts(output_path) == [
+        {"patient_id": 1, "dob": date(1980, 1, 1), "sex": "female"},
+        {"patient_id": 2, "dob": date(1990, 1, 1), "sex": "male"},
+    ]
+
+
 def test_generate_dataset_with_dummy_event_level_data(call_cli, tmp_path):
     @function_body_as_string
     def dataset_definition():
@@ -0,0 +1,45 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+
+FIXTURES_PATH = Path(__file__).parents[1] / "fixtures" / "good_definition_files"
+
+# Packages which take a significant fraction of a second to import and which commands
+# that only load definition files shouldn't need
+SLOW_TO_IMPORT = {"networkx", "numpy", "pyarrow", "pydot", "sqlalchemy"}
+
+
+def get_imported_modules(args):
+    # We use `-X importtime` rather than inspecting `sys.modules` so that we see exactly
+    # what the command imports when run as it would be for real
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "ehrql", *args],
+        capture_output=True,
+        text=True,
+        check=True,
+        env={"PYTHONPATH": os.environ.get("PYTHONPATH", ""), "PYTHONHASHSEED": "0"},
+    )
+    return {
+        line.rpartition("|")[2].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["--help"],
+        ["serialize-definition", FIXTURES_PATH / "dataset_definition.py"],
+        ["serialize-definition", FIXTURES_PATH / "measure_definitions.py"],
+        ["serialize-definition", FIXTURES_PATH / "assurance.py"],
+    ],
+)
+def test_command_does_not_import_slow_packages(args):
+    imported = get_imported_modules(args)
+    assert "ehrql.main" in imported
+    assert imported & SLOW_TO_IMPORT == set()
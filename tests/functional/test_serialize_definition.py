@@ -25,3 +25,15 @@ def test_serialize_definition(definition_file, call_cli):
     assert json.loads(captured.out)
     # We shouldn't be producing any warnings or any other output
     assert captured.err == ""
+
+
+def test_serialize_definition_recording_inputs(call_cli):
+    definition_file = FIXTURES_PATH / "dataset_definition.py"
+    captured = call_cli(
+        "serialize-definition",
+        "--record-inputs",
+        definition_file,
+    )
+    output = json.loads(captured.out)
+    assert json.loads(output["definition"])
+    assert str(definition_file) in [path for path, _ in output["inputs"]]
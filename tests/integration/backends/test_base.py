@@ -38,7 +38,7 @@ class EventSource2(Base):
 
 
 def test_mapped_table(engine):
-    if engine.name == "in_memory":
+    if engine.name.startswith("in_memory"):
         pytest.skip("doesn't apply to non-SQL engines")
 
     class TestBackend(SQLBackend):
@@ -69,7 +69,7 @@ def test_mapped_table(engine):
 
 @pytest.mark.parametrize("materialize", [True, False])
 def test_query_table(engine, materialize):
-    if engine.name == "in_memory":
+    if engine.name.startswith("in_memory"):
         pytest.skip("doesn't apply to non-SQL engines")
 
     class TestBackend(SQLBackend):
@@ -126,7 +126,7 @@ def test_query_table(engine, materialize):
 
 
 def test_query_table_from_function(engine):
-    if engine.name == "in_memory":
+    if engine.name.startswith("in_memory"):
         pytest.skip("doesn't apply to non-SQL engines")
 
     class TestBackend(SQLBackend):
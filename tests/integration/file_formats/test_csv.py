@@ -2,7 +2,7 @@ import gzip
 
 import pytest
 
-from ehrql.file_formats import write_rows
+from ehrql.file_formats import read_rows, write_rows
 from ehrql.query_model.column_specs import ColumnSpec
 
 
@@ -42,3 +42,21 @@ def test_write_rows_csv(tmp_path, capsys, basename):
         "456,,",
         "789,1999,M",
     ]
+
+
+@pytest.mark.parametrize("threads", ["1", "4"])
+def test_write_rows_csv_gz_with_multiple_threads(tmp_path, threads, monkeypatch):
+    # Use small blocks so we get multiple gzip members
+    monkeypatch.setattr("ehrql.utils.gzip_utils.BLOCK_SIZE", 64)
+    filename = tmp_path / "file.csv.gz"
+    column_specs = {"patient_id": ColumnSpec(int), "s": ColumnSpec(str)}
+    results = [(i, f"value {i}") for i in range(1000)]
+    environ = {
+        "EHRQL_CSV_GZ_THREADS": threads,
+        "EHRQL_CSV_GZ_COMPRESSION_LEVEL": "1",
+    }
+
+    write_rows(filename, results, column_specs, environ=environ)
+
+    with read_rows(filename, column_specs) as reader:
+        assert list(reader) == results
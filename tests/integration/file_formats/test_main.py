@@ -9,9 +9,11 @@ from ehrql.file_formats import (
     FileValidationError,
     read_rows,
     read_tables,
+    write_batches,
     write_rows,
     write_tables,
 )
+from ehrql.file_formats.arrow import rows_to_record_batches
 from ehrql.query_model.column_specs import ColumnSpec
 from ehrql.sqlalchemy_types import TYPE_MAP
 from ehrql.utils.string_utils import strip_indent
@@ -121,6 +123,7 @@ def test_read_rows_validates_types(test_file):
     # with CSV we can only validate individual values
     errors = {
         "dataset.arrow": "expected <class 'int'>, got string",
+        "dataset.parquet": "expected <class 'int'>, got string",
         "dataset.csv": "invalid literal for int",
         "dataset.csv.gz": "invalid literal for int",
     }
@@ -145,6 +148,13 @@ def test_read_rows_validates_categories(test_file):
               Expected: X, Y
             """
         ),
+        "dataset.parquet": strip_indent(
+            """
+            Unexpected categories in column 'c'
+              Categories: A, B
+              Expected: X, Y
+            """
+        ),
         "dataset.csv": "'A' not in valid categories: 'X', 'Y'",
         "dataset.csv.gz": "'A' not in valid categories: 'X', 'Y'",
     }
@@ -240,6 +250,49 @@ def test_read_and_write_tables_roundtrip(tmp_path, extension):
     assert [list(rows) for rows in results] == tables
 
 
+@pytest.mark.parametrize("extension", FILE_FORMATS.keys())
+def test_write_tables_as_batches_roundtrip(tmp_path, extension):
+    table_specs = {
+        "table_1": TEST_FILE_SPECS,
+        "table_2": {
+            "patient_id": ColumnSpec(int),
+            "s": ColumnSpec(str),
+        },
+    }
+    tables = [
+        TEST_FILE_DATA,
+        [
+            (1, "a"),
+            (2, "b"),
+            (3, "c"),
+        ],
+    ]
+    batch_tables = [
+        rows_to_record_batches(rows, column_specs, batch_size=2)
+        for rows, column_specs in zip(tables, table_specs.values())
+    ]
+
+    write_tables(
+        tmp_path / f"output:{extension[1:]}",
+        batch_tables,
+        table_specs,
+        as_batches=True,
+    )
+    results = read_tables(tmp_path / "output", table_specs)
+
+    assert [list(rows) for rows in results] == tables
+
+
+@pytest.mark.parametrize("extension", FILE_FORMATS.keys())
+def test_write_batches_roundtrip(tmp_path, extension):
+    filename = tmp_path / f"dataset{extension}"
+    batches = rows_to_record_batches(TEST_FILE_DATA, TEST_FILE_SPECS, batch_size=2)
+    write_batches(filename, batches, TEST_FILE_SPECS)
+
+    with read_rows(filename, TEST_FILE_SPECS) as reader:
+        assert list(reader) == TEST_FILE_DATA
+
+
 def test_read_tables_allows_single_table_format_if_only_one_table(tmp_path):
     filename = tmp_path / "file.csv"
     filename.write_text("i,s\n1,a\n2,b\n3,c\n")
@@ -347,3 +400,16 @@ def test_write_tables_without_filename_writes_to_console(capsys):
     # wired up correctly
     assert "patient_id" in output
     assert "table_2" in output
+
+
+def test_write_tables_as_batches_without_filename_writes_to_console(capsys):
+    table_specs = {
+        "table_1": TEST_FILE_SPECS,
+    }
+    table_data = [
+        rows_to_record_batches(TEST_FILE_DATA, TEST_FILE_SPECS),
+    ]
+    write_tables(None, table_data, table_specs, as_batches=True)
+    output = capsys.readouterr().out
+    assert "patient_id" in output
+    assert "789" in output
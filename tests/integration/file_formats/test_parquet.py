@@ -0,0 +1,112 @@
+import pyarrow
+import pyarrow.parquet
+import pytest
+
+from ehrql.file_formats import (
+    FileValidationError,
+    read_rows,
+    write_batches,
+    write_rows,
+)
+from ehrql.file_formats.arrow import rows_to_record_batches
+from ehrql.file_formats.parquet import write_rows_parquet
+from ehrql.query_model.column_specs import ColumnSpec
+
+
+def test_write_rows_parquet(tmp_path):
+    filename = tmp_path / "somedir" / "file.parquet"
+    column_specs = {
+        "patient_id": ColumnSpec(int),
+        "year_of_birth": ColumnSpec(int, min_value=1900, max_value=2100),
+        "sex": ColumnSpec(str, categories=("M", "F", "I")),
+        "risk_score": ColumnSpec(float, categories=(0.0, 0.5, 1.0)),
+    }
+    results = [
+        (123, 1980, "F", 0.0),
+        (456, None, None, 0.5),
+        (789, 1999, "M", 1.0),
+    ]
+    write_rows(filename, results, column_specs)
+
+    table = pyarrow.parquet.read_table(filename)
+    output_columns = table.column_names
+    output_rows = [tuple(d.values()) for d in table.to_pylist()]
+
+    assert output_columns == list(column_specs.keys())
+    assert output_rows == results
+    assert pyarrow.types.is_dictionary(table.column("sex").type)
+    assert table.column("patient_id").type == pyarrow.int64()
+    assert table.column("year_of_birth").type == pyarrow.uint16()
+    assert not pyarrow.types.is_dictionary(table.column("risk_score").type)
+
+
+def test_write_rows_parquet_with_row_group_size(tmp_path):
+    filename = tmp_path / "file.parquet"
+    column_specs = {"patient_id": ColumnSpec(int), "i": ColumnSpec(int)}
+    results = [(n, n * 10) for n in range(5)]
+    write_rows_parquet(filename, results, column_specs, row_group_size=2)
+
+    assert pyarrow.parquet.ParquetFile(filename).num_row_groups == 3
+    with read_rows(filename, column_specs) as reader:
+        assert list(reader) == results
+
+
+def test_read_rows_parquet_with_no_rows(tmp_path):
+    filename = tmp_path / "file.parquet"
+    column_specs = {
+        "patient_id": ColumnSpec(int),
+        "c": ColumnSpec(str, categories=("A", "B")),
+    }
+    write_rows(filename, [], column_specs)
+
+    with read_rows(filename, column_specs) as reader:
+        assert list(reader) == []
+
+
+def test_write_batches_parquet_with_row_group_size_from_environ(tmp_path):
+    filename = tmp_path / "file.parquet"
+    column_specs = {"patient_id": ColumnSpec(int), "i": ColumnSpec(int)}
+    results = [(n, n * 10) for n in range(5)]
+    batches = rows_to_record_batches(results, column_specs)
+    write_batches(
+        filename,
+        batches,
+        column_specs,
+        environ={"EHRQL_PARQUET_ROW_GROUP_SIZE": "2"},
+    )
+
+    assert pyarrow.parquet.ParquetFile(filename).num_row_groups == 3
+
+
+def test_read_rows_parquet_validates_categories_in_every_row_group(tmp_path):
+    filename = tmp_path / "file.parquet"
+    column_specs = {
+        "patient_id": ColumnSpec(int),
+        "sex": ColumnSpec(str, categories=("male", "female")),
+    }
+    # Each row group gets its own dictionary, so only the second one contains the
+    # invalid category
+    schema = pyarrow.schema(
+        [
+            ("patient_id", pyarrow.int64()),
+            ("sex", pyarrow.dictionary(pyarrow.int8(), pyarrow.string())),
+        ]
+    )
+    with pyarrow.parquet.ParquetWriter(str(filename), schema) as writer:
+        for patient_id, sex in [(1, "male"), (2, "BOGUS")]:
+            writer.write_table(
+                pyarrow.table(
+                    [
+                        pyarrow.array([patient_id]),
+                        pyarrow.array([sex]).dictionary_encode(),
+                    ],
+                    schema=schema,
+                )
+            )
+    assert pyarrow.parquet.ParquetFile(filename).num_row_groups == 2
+
+    with read_rows(filename, column_specs) as reader:
+        with pytest.raises(
+            FileValidationError, match="Unexpected categories in column 'sex'"
+        ):
+            list(reader)
@@ -103,6 +103,75 @@ def test_get_measure_results(engine):
     assert set(results) == set(expected)
 
 
+def test_get_measure_results_with_batched_intervals(engine):
+    events_in_interval = events.where(events.date.is_during(INTERVAL))
+    event_count = events_in_interval.count_for_patient()
+    foo_event_count = events_in_interval.where(events.code == "foo").count_for_patient()
+
+    # Use a number of intervals which isn't a multiple of the batch size
+    intervals = years(3).starting_on("2020-01-01")
+    measures = Measures()
+
+    measures.define_measure(
+        "foo_events_by_sex",
+        numerator=foo_event_count,
+        denominator=event_count,
+        group_by=dict(sex=patients.sex),
+        intervals=intervals,
+    )
+    measures.define_measure(
+        "foo_events",
+        numerator=foo_event_count,
+        denominator=event_count,
+        intervals=intervals,
+    )
+
+    patient_data, address_data, event_data = generate_data(intervals)
+    engine.populate(
+        {patients: patient_data, addresses: address_data, events: event_data}
+    )
+
+    query_engine = engine.query_engine(
+        environ={"EHRQL_MEASURE_INTERVAL_BATCH_SIZE": "2"}
+    )
+    results = list(get_measure_results(query_engine, measures))
+    unbatched_results = list(get_measure_results(engine.query_engine(), measures))
+
+    # Results are returned in interval order, just as they are without batching
+    assert [row[1] for row in results] == sorted(row[1] for row in results)
+    assert sorted(results, key=repr) == sorted(unbatched_results, key=repr)
+    assert len(results) == len(set(results))
+
+
+def test_get_measure_results_with_concurrency(engine):
+    events_in_interval = events.where(events.date.is_during(INTERVAL))
+    event_count = events_in_interval.count_for_patient()
+    foo_event_count = events_in_interval.where(events.code == "foo").count_for_patient()
+
+    intervals = months(6).starting_on("2020-01-01")
+    measures = Measures()
+
+    measures.define_measure(
+        "foo_events_by_sex",
+        numerator=foo_event_count,
+        denominator=event_count,
+        group_by=dict(sex=patients.sex),
+        intervals=intervals,
+    )
+
+    patient_data, address_data, event_data = generate_data(intervals)
+    engine.populate(
+        {patients: patient_data, addresses: address_data, events: event_data}
+    )
+
+    query_engine = engine.query_engine()
+    results = list(get_measure_results(query_engine, measures, concurrency=3))
+    sequential_results = list(get_measure_results(query_engine, measures))
+
+    # Results are returned in exactly the same order as when run sequentially
+    assert results == sequential_results
+
+
 def test_get_measures_interval_dependent_denominator(engine):
     # Test results when an interval denominator is dependent on the specific interval
     # (i.e. values in other intervals affect the inclusion in this interval population)
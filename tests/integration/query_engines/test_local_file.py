@@ -1,8 +1,18 @@
+import collections
 from pathlib import Path
 
+import pytest
+
 from ehrql import Dataset
-from ehrql.query_engines.local_file import LocalFileQueryEngine
-from ehrql.tables import EventFrame, PatientFrame, Series, table
+from ehrql.file_formats import write_rows
+from ehrql.query_engines import local_file
+from ehrql.query_engines.local_file import (
+    TABLE_ROWS_CACHE,
+    ColumnarLocalFileQueryEngine,
+    LocalFileQueryEngine,
+)
+from ehrql.query_model.column_specs import ColumnSpec
+from ehrql.tables import Constraint, EventFrame, PatientFrame, Series, table
 
 
 FIXTURES = Path(__file__).parents[2] / "fixtures" / "local_file_engine"
@@ -20,7 +30,10 @@ class events(EventFrame):
     expected_missing = Series(bool)
 
 
-def test_local_file_query_engine():
+@pytest.mark.parametrize(
+    "query_engine_class", [LocalFileQueryEngine, ColumnarLocalFileQueryEngine]
+)
+def test_local_file_query_engine(query_engine_class):
     dataset = Dataset()
     dataset.sex = patients.sex
     dataset.total_score = events.score.sum_for_patient()
@@ -32,7 +45,7 @@ def test_local_file_query_engine():
     dataset.define_population(patients.exists_for_patient())
     dataset_qm = dataset._compile()
 
-    query_engine = LocalFileQueryEngine(FIXTURES)
+    query_engine = query_engine_class(FIXTURES)
     results = query_engine.get_results(dataset_qm)
 
     assert list(results) == [
@@ -40,3 +53,157 @@ def test_local_file_query_engine():
         (2, "F", 15, 2),
         (3, None, None, 0),
     ]
+
+
+def test_local_file_query_engine_caches_table_rows(tmp_path):
+    (tmp_path / "patients.csv").write_text("patient_id,sex\n1,M\n")
+    dataset = Dataset()
+    dataset.sex = patients.sex
+    dataset.define_population(patients.exists_for_patient())
+    dataset_qm = dataset._compile()
+
+    query_engine = LocalFileQueryEngine(tmp_path)
+    assert list(query_engine.get_results(dataset_qm)) == [(1, "M")]
+    (reader,) = [k for k in TABLE_ROWS_CACHE if k.filename.parent == tmp_path]
+    cached_rows = TABLE_ROWS_CACHE[reader][1]
+
+    # Reading the same unchanged file again reuses the same rows
+    assert list(query_engine.get_results(dataset_qm)) == [(1, "M")]
+    assert TABLE_ROWS_CACHE[reader][1] is cached_rows
+
+    # Changing the file invalidates the cache
+    (tmp_path / "patients.csv").write_text("patient_id,sex\n1,F\n2,M\n")
+    assert list(query_engine.get_results(dataset_qm)) == [(1, "F"), (2, "M")]
+
+
+def test_local_file_query_engine_table_rows_cache_is_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_file, "TABLE_ROWS_CACHE", collections.OrderedDict())
+    monkeypatch.setattr(local_file, "TABLE_ROWS_CACHE_SIZE", 2)
+    (tmp_path / "patients.csv").write_text("patient_id,sex\n1,M\n")
+    (tmp_path / "events.csv").write_text("patient_id,score\n1,5\n")
+    patients_dataset = Dataset()
+    patients_dataset.sex = patients.sex
+    patients_dataset.define_population(patients.exists_for_patient())
+    events_dataset = Dataset()
+    events_dataset.define_population(events.exists_for_patient())
+    events_dataset.total_score = events.score.sum_for_patient()
+
+    missing_dataset = Dataset()
+    missing_dataset.define_population(events.exists_for_patient())
+    missing_dataset.missing = events.expected_missing.count_distinct_for_patient()
+
+    def cached_files():
+        return [
+            (reader.filename.name, tuple(reader.column_specs))
+            for reader in local_file.TABLE_ROWS_CACHE
+        ]
+
+    query_engine = LocalFileQueryEngine(tmp_path)
+    query_engine.get_results_tables(patients_dataset._compile())
+    query_engine.get_results_tables(events_dataset._compile())
+    assert cached_files() == [
+        ("patients.csv", ("patient_id", "sex")),
+        ("events.csv", ("patient_id", "score")),
+    ]
+
+    # Only the most recently used entries are kept, with different sets of columns
+    # from the same file cached separately
+    query_engine.get_results_tables(missing_dataset._compile())
+    assert cached_files() == [
+        ("events.csv", ("patient_id", "score")),
+        ("events.csv", ("patient_id", "expected_missing")),
+    ]
+
+
+def test_local_file_query_engine_uses_cache_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "patients.csv").write_text("patient_id,sex\n1,M\n")
+    cache_dir = tmp_path / "cache"
+    dataset = Dataset()
+    dataset.sex = patients.sex
+    dataset.define_population(patients.exists_for_patient())
+    dataset_qm = dataset._compile()
+
+    query_engine = LocalFileQueryEngine(
+        data_dir, environ={"EHRQL_DUMMY_TABLES_CACHE_DIR": str(cache_dir)}
+    )
+    assert list(query_engine.get_results(dataset_qm)) == [(1, "M")]
+    assert [f.suffix for f in cache_dir.iterdir()] == [".arrow"]
+
+    # Simulate a new process, which should read from the cache directory
+    TABLE_ROWS_CACHE.clear()
+    (cache_file,) = cache_dir.iterdir()
+    cache_file_mtime = cache_file.stat().st_mtime_ns
+    assert list(query_engine.get_results(dataset_qm)) == [(1, "M")]
+    assert list(cache_dir.iterdir()) == [cache_file]
+    assert cache_file.stat().st_mtime_ns == cache_file_mtime
+
+
+def test_local_file_query_engine_does_not_cache_arrow_files_in_cache_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    write_rows(
+        data_dir / "patients.arrow",
+        [(1, "M")],
+        {"patient_id": ColumnSpec(int), "sex": ColumnSpec(str)},
+    )
+    cache_dir = tmp_path / "cache"
+    dataset = Dataset()
+    dataset.sex = patients.sex
+    dataset.define_population(patients.exists_for_patient())
+
+    query_engine = LocalFileQueryEngine(
+        data_dir, environ={"EHRQL_DUMMY_TABLES_CACHE_DIR": str(cache_dir)}
+    )
+    assert list(query_engine.get_results(dataset._compile())) == [(1, "M")]
+    assert not cache_dir.exists()
+
+
+@pytest.mark.parametrize(
+    "query_engine_class", [LocalFileQueryEngine, ColumnarLocalFileQueryEngine]
+)
+def test_local_file_query_engine_only_reads_used_columns(tmp_path, query_engine_class):
+    @table
+    class wide(PatientFrame):
+        used = Series(int)
+        invalid = Series(int)
+        missing = Series(int, constraints=[Constraint.NotNull()])
+
+    # The unused columns are invalid and missing respectively, which would be errors
+    # if we attempted to read them
+    (tmp_path / "wide.csv").write_text("patient_id,used,invalid\n1,10,foo\n")
+    dataset = Dataset()
+    dataset.used = wide.used
+    dataset.define_population(wide.exists_for_patient())
+
+    query_engine = query_engine_class(tmp_path)
+    assert list(query_engine.get_results(dataset._compile())) == [(1, 10)]
+    assert query_engine.database.tables["wide"].name_to_col.keys() == {
+        "patient_id",
+        "used",
+    }
+
+
+def test_columnar_local_file_query_engine_reads_arrow_files(tmp_path):
+    write_rows(
+        tmp_path / "patients.arrow",
+        [(1, "M"), (2, None)],
+        {"patient_id": ColumnSpec(int), "sex": ColumnSpec(str, categories=("F", "M"))},
+    )
+    write_rows(
+        tmp_path / "events.arrow",
+        [(1, 2), (2, None), (1, 3)],
+        {"patient_id": ColumnSpec(int), "score": ColumnSpec(int)},
+    )
+    dataset = Dataset()
+    dataset.sex = patients.sex
+    dataset.total_score = events.score.sum_for_patient()
+    dataset.missing = events.where(
+        events.expected_missing.is_null()
+    ).count_for_patient()
+    dataset.define_population(patients.exists_for_patient())
+    dataset_qm = dataset._compile()
+
+    expected = list(LocalFileQueryEngine(tmp_path).get_results(dataset_qm))
+    results = list(ColumnarLocalFileQueryEngine(tmp_path).get_results(dataset_qm))
+    assert results == expected == [(1, "M", 5, 2), (2, None, None, 1)]
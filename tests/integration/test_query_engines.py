@@ -7,6 +7,9 @@ import pytest
 import sqlalchemy
 
 from ehrql import create_dataset, maximum_of, minimum_of, when
+from ehrql.file_formats.arrow import record_batches_to_rows
+from ehrql.main import get_sql_strings
+from ehrql.query_model.column_specs import get_table_specs
 from ehrql.query_model.nodes import AggregateByPatient, Dataset, Function, Value
 from ehrql.tables import (
     EventFrame,
@@ -128,7 +131,7 @@ def test_handles_inline_patient_table_with_different_patients(engine):
 
 def test_cleans_up_temporary_tables(engine):
     # Cleanup doesn't apply to the in-memory engine
-    if engine.name == "in_memory":
+    if engine.name.startswith("in_memory"):
         pytest.skip()
 
     engine.populate(
@@ -243,6 +246,70 @@ def test_is_in_using_temporary_table(engine):
     ]
 
 
+def test_is_in_combined_with_or_uses_a_single_temporary_table(engine):
+    if engine.name.startswith("in_memory"):
+        pytest.skip("test does not apply to in-memory engine")
+
+    engine.populate(
+        {
+            events: [
+                dict(patient_id=1, code="123000"),
+                dict(patient_id=1, code="456000"),
+                dict(patient_id=2, code="123001"),
+                dict(patient_id=2, code="456001"),
+                dict(patient_id=2, code="789000"),
+            ]
+        }
+    )
+
+    dataset = create_dataset()
+    dataset.define_population(events.exists_for_patient())
+    matching = (
+        events.code.is_in(["123000", "123001"])
+        | events.code.is_in(["456001", "999999"])
+        | (events.code == "789000")
+    )
+    dataset.n = events.where(matching).count_for_patient()
+
+    environ = {"EHRQL_MAX_MULTIVALUE_PARAM_LENGTH": 1}
+    assert engine.extract(dataset, environ=environ) == [
+        {"patient_id": 1, "n": 1},
+        {"patient_id": 2, "n": 3},
+    ]
+    sql = "\n".join(engine.dump_dataset_sql(dataset, environ=environ))
+    assert len(set(re.findall(r"inline_data_\d+\b", sql))) == 1
+
+
+def test_tables_of_values_are_shared_across_queries(engine):
+    if engine.name.startswith("in_memory"):
+        pytest.skip("test does not apply to in-memory engine")
+
+    # Datasets which differ in their populations, as happens with measure intervals
+    matching = events.where(events.code.is_in(["123000", "123001"]))
+    datasets = []
+    for year in [2000, 2001]:
+        dataset = create_dataset()
+        dataset.define_population(
+            events.where(events.date.year == year).exists_for_patient()
+        )
+        dataset.n = matching.count_for_patient()
+        datasets.append(dataset._compile())
+
+    query_engine = engine.query_engine(
+        dsn=None, environ={"EHRQL_MAX_MULTIVALUE_PARAM_LENGTH": 1}
+    )
+    table_names = [
+        set(
+            re.findall(
+                r"inline_data_\d+\b", "\n".join(get_sql_strings(query_engine, dataset))
+            )
+        )
+        for dataset in datasets
+    ]
+    assert len(table_names[0]) == 1
+    assert table_names[0] == table_names[1]
+
+
 def as_query_model(query_lang_expr):
     return query_lang_expr._qm_node
 
@@ -443,7 +510,7 @@ def test_basic_event_level_data_support(engine):
 
 
 def test_max_join_count(engine, in_memory_engine):
-    if engine.name == in_memory_engine.name:
+    if engine.name.startswith("in_memory"):
         pytest.skip("test does not apply to in-memory engine")
 
     dataset = create_dataset()
@@ -516,8 +583,182 @@ def test_max_join_count(engine, in_memory_engine):
     assert len(queries_split) > len(queries_nosplit)
 
 
+def test_aggregations_over_same_domain_are_calculated_together(
+    engine, in_memory_engine
+):
+    if engine.name.startswith("in_memory"):
+        pytest.skip("test does not apply to in-memory engine")
+
+    code_events = events.where(events.code == "abc")
+    dataset = create_dataset()
+    dataset.define_population(code_events.exists_for_patient())
+    dataset.has_events = code_events.exists_for_patient()
+    dataset.count = code_events.count_for_patient()
+    dataset.count_distinct = code_events.i.count_distinct_for_patient()
+    dataset.sum = code_events.i.sum_for_patient()
+    dataset.min = code_events.date.minimum_for_patient()
+    dataset.max = code_events.date.maximum_for_patient()
+    dataset.mean = code_events.i.mean_for_patient()
+    # An aggregation involving another aggregation over the same domain must be
+    # calculated separately
+    dataset.nested = (
+        code_events.i - code_events.i.minimum_for_patient()
+    ).maximum_for_patient()
+
+    data = {
+        patients: [dict(patient_id=1), dict(patient_id=2), dict(patient_id=3)],
+        events: [
+            dict(patient_id=1, date=date(2000, 1, 1), code="abc", i=1),
+            dict(patient_id=1, date=date(2001, 1, 1), code="abc", i=4),
+            dict(patient_id=1, date=date(2002, 1, 1), code="def", i=8),
+            dict(patient_id=2, date=date(2003, 1, 1), code="abc", i=None),
+            dict(patient_id=3, date=date(2004, 1, 1), code="def", i=2),
+        ],
+    }
+    in_memory_engine.populate(data)
+    engine.populate(data)
+
+    assert engine.extract(dataset) == in_memory_engine.extract(dataset)
+    # One query for the aggregation used in the population, one for those used in the
+    # variables, and one for the nested aggregation
+    queries = engine.dump_dataset_sql(dataset)
+    assert sum(str(query).count("GROUP BY") for query in queries) == 3
+
+
+def test_picks_from_same_domain_share_a_table(engine, in_memory_engine):
+    if engine.name.startswith("in_memory"):
+        pytest.skip("test does not apply to in-memory engine")
+
+    code_events = events.where(events.code == "abc")
+    by_date = code_events.sort_by(code_events.date)
+    by_i = code_events.sort_by(code_events.i)
+    dataset = create_dataset()
+    dataset.define_population(patients.exists_for_patient())
+    dataset.first_date = by_date.first_for_patient().date
+    dataset.last_date = by_date.last_for_patient().date
+    dataset.last_i = by_date.last_for_patient().i
+    dataset.has_last = by_date.last_for_patient().exists_for_patient()
+    dataset.first_by_i = by_i.first_for_patient().date
+
+    data = {
+        patients: [dict(patient_id=1), dict(patient_id=2), dict(patient_id=3)],
+        events: [
+            dict(patient_id=1, date=date(2000, 1, 1), code="abc", i=5),
+            dict(patient_id=1, date=date(2001, 1, 1), code="abc", i=4),
+            dict(patient_id=1, date=date(2002, 1, 1), code="def", i=8),
+            dict(patient_id=2, date=date(2003, 1, 1), code="abc", i=None),
+            dict(patient_id=3, date=date(2004, 1, 1), code="def", i=2),
+        ],
+    }
+    in_memory_engine.populate(data)
+    engine.populate(data)
+
+    assert engine.extract(dataset) == in_memory_engine.extract(dataset)
+    queries = [str(query) for query in engine.dump_dataset_sql(dataset)]
+    window_queries = [query for query in queries if "row_number()" in query.lower()]
+    assert len(window_queries) == 1
+    assert window_queries[0].lower().count("row_number()") == 3
+
+
+def test_concurrent_setup_queries(engine, in_memory_engine):
+    if not getattr(
+        engine.query_engine_class, "supports_concurrent_setup_queries", False
+    ):
+        pytest.skip("engine does not support concurrent setup queries")
+
+    # Several variables each of which requires its own independent temporary table
+    dataset = create_dataset()
+    dataset.define_population(patients.exists_for_patient())
+    for code in ["abc", "def", "ghi"]:
+        code_events = events.where(events.code == code).sort_by(events.date)
+        dataset.add_column(f"{code}_count", code_events.count_for_patient())
+        dataset.add_column(f"{code}_first", code_events.first_for_patient().i)
+
+    data = {
+        patients: [dict(patient_id=1), dict(patient_id=2)],
+        events: [
+            dict(patient_id=1, date=date(2000, 1, 1), code="abc", i=1),
+            dict(patient_id=1, date=date(2001, 1, 1), code="def", i=2),
+            dict(patient_id=2, date=date(2002, 1, 1), code="abc", i=3),
+            dict(patient_id=2, date=date(2003, 1, 1), code="ghi", i=4),
+        ],
+    }
+    in_memory_engine.populate(data)
+    engine.populate(data)
+    original_tables = _get_tables(engine)
+
+    results = engine.extract(dataset, environ={"EHRQL_SETUP_QUERY_CONCURRENCY": "3"})
+
+    assert results == in_memory_engine.extract(dataset)
+    assert _get_tables(engine) == original_tables
+
+
+def test_concurrent_results_fetch(engine, in_memory_engine):
+    if not hasattr(engine.query_engine_class, "results_fetch_concurrency"):
+        pytest.skip("engine does not support concurrent results fetching")
+
+    dataset = create_dataset()
+    dataset.define_population(patients.exists_for_patient())
+    dataset.event_count = events.count_for_patient()
+    dataset.add_event_table("events", code=events.code, i=events.i)
+
+    data = {
+        patients: [dict(patient_id=i) for i in range(1, 21)],
+        events: [
+            dict(patient_id=i, code=code, i=i)
+            for i in range(1, 21)
+            for code in ["abc", "def"][: i % 3]
+        ],
+    }
+    in_memory_engine.populate(data)
+    engine.populate(data)
+
+    results = engine.get_results_tables(
+        dataset, environ={"EHRQL_RESULTS_FETCH_CONCURRENCY": "3"}
+    )
+
+    assert results == in_memory_engine.get_results_tables(dataset)
+
+
+def test_get_results_batches(engine):
+    dataset = create_dataset()
+    dataset.define_population(patients.exists_for_patient())
+    dataset.sex = patients.sex
+    dataset.date_of_birth = patients.date_of_birth
+    dataset.is_adult = patients.date_of_birth < date(2000, 1, 1)
+    dataset.event_count = events.count_for_patient()
+    dataset.add_event_table("events", date=events.date, code=events.code, i=events.i)
+
+    engine.populate(
+        {
+            patients: [
+                dict(patient_id=1, date_of_birth=date(1980, 1, 1), sex="female"),
+                dict(patient_id=2, date_of_birth=date(2010, 2, 2), sex="male"),
+                dict(patient_id=3),
+            ],
+            events: [
+                dict(patient_id=1, date=date(2020, 1, 1), code="abc", i=1),
+                dict(patient_id=1, date=date(2021, 1, 1), code="def", i=-2),
+                dict(patient_id=3, code="ghi", i=None),
+            ],
+        }
+    )
+    dataset_qm = dataset._compile()
+    table_specs = get_table_specs(dataset_qm)
+    query_engine = engine.query_engine()
+
+    batch_tables = query_engine.get_results_batches(dataset_qm, table_specs)
+    results = [sorted(record_batches_to_rows(batches)) for batches in batch_tables]
+
+    expected = [
+        sorted(tuple(row.values()) for row in table)
+        for table in engine.get_results_tables(dataset)
+    ]
+    assert results == expected
+
+
 def test_sql_logging(engine, caplog):
-    if engine.name == "in_memory":
+    if engine.name.startswith("in_memory"):
         pytest.skip("test does not apply to in-memory engine")
 
     # We don't care about the data or the results here; we just need the minimum to
@@ -1,8 +1,15 @@
+import contextlib
+import time
+
 import pytest
 import sqlalchemy
 import sqlalchemy.orm
 
-from ehrql.utils.sqlalchemy_exec_utils import fetch_table_in_batches
+from ehrql.utils import sqlalchemy_exec_utils
+from ehrql.utils.sqlalchemy_exec_utils import (
+    fetch_table_in_batches,
+    fetch_table_in_partitions,
+)
 
 
 Base = sqlalchemy.orm.declarative_base()
@@ -16,7 +23,7 @@ class SomeTable(Base):
 
 
 def test_fetch_table_in_batches_unique(engine):
-    if engine.name == "in_memory":
+    if engine.name.startswith("in_memory"):
         pytest.skip("SQL tests do not apply to in-memory engine")
 
     table_size = 15
@@ -42,7 +49,7 @@ def test_fetch_table_in_batches_unique(engine):
 
 
 def test_fetch_table_in_batches_nonunique(engine):
-    if engine.name == "in_memory":
+    if engine.name.startswith("in_memory"):
         pytest.skip("SQL tests do not apply to in-memory engine")
 
     batch_size = 6
@@ -65,3 +72,105 @@ def test_fetch_table_in_batches_nonunique(engine):
         results = sorted(results)
 
     assert results == table_data
+
+
+@pytest.mark.parametrize("key_is_unique", [True, False])
+def test_fetch_table_in_partitions(engine, key_is_unique):
+    if engine.name.startswith("in_memory"):
+        pytest.skip("SQL tests do not apply to in-memory engine")
+
+    if key_is_unique:
+        keys = list(range(15))
+    else:
+        repeats = [1, 2, 3, 4, 5, 0, 5, 4, 3, 2, 1]
+        keys = [key for key, n in enumerate(repeats) for _ in range(n)]
+    table_data = [(i, key, f"foo{i}") for i, key in enumerate(keys)]
+
+    engine.setup([SomeTable(pk=row[0], key=row[1], foo=row[2]) for row in table_data])
+
+    table = SomeTable.__table__
+    log_messages = []
+
+    with contextlib.ExitStack() as stack:
+        connections = [
+            stack.enter_context(threadsafe_sqlalchemy_engine(engine).connect())
+            for _ in range(2)
+        ]
+        results = fetch_table_in_partitions(
+            [connection.execute for connection in connections],
+            table,
+            1,
+            key_is_unique=key_is_unique,
+            partition_count=4,
+            batch_size=6,
+            log=log_messages.append,
+        )
+        results = list(results)
+
+    # Partitions are returned in key order, although rows within each key may not be
+    assert [row[1] for row in results] == keys
+    assert sorted(results) == table_data
+    assert "Fetching rows from 'some_table' in 4 partitions using 2 connections" in (
+        log_messages
+    )
+
+
+def test_fetch_table_in_partitions_stops_early(engine):
+    if engine.name.startswith("in_memory"):
+        pytest.skip("SQL tests do not apply to in-memory engine")
+
+    table_data = [(i, i, f"foo{i}") for i in range(20)]
+    engine.setup([SomeTable(pk=row[0], key=row[1], foo=row[2]) for row in table_data])
+
+    with threadsafe_sqlalchemy_engine(engine).connect() as connection:
+        results = fetch_table_in_partitions(
+            [connection.execute],
+            SomeTable.__table__,
+            0,
+            key_is_unique=True,
+            partition_count=4,
+            batch_size=3,
+        )
+        first_rows = [next(results) for _ in range(7)]
+        results.close()
+
+    assert first_rows == table_data[:7]
+
+
+def test_fetch_table_in_partitions_stops_early_when_workers_are_waiting(
+    engine, monkeypatch
+):
+    if engine.name.startswith("in_memory"):
+        pytest.skip("SQL tests do not apply to in-memory engine")
+
+    # Only allow a single batch of a single row to wait in each partition's queue
+    monkeypatch.setattr(sqlalchemy_exec_utils, "PARTITION_QUEUE_SIZE", 1)
+    table_data = [(i, i, f"foo{i}") for i in range(20)]
+    engine.setup([SomeTable(pk=row[0], key=row[1], foo=row[2]) for row in table_data])
+
+    with threadsafe_sqlalchemy_engine(engine).connect() as connection:
+        results = fetch_table_in_partitions(
+            [connection.execute],
+            SomeTable.__table__,
+            0,
+            key_is_unique=True,
+            partition_count=2,
+            batch_size=1,
+        )
+        first_row = next(results)
+        # Give the worker time to fill the queue and start waiting for us
+        time.sleep(0.3)
+        results.close()
+
+    assert first_row == table_data[0]
+
+
+def threadsafe_sqlalchemy_engine(engine):
+    # Partitions are fetched on worker threads, which SQLite connections disallow by
+    # default
+    sqlalchemy_engine = engine.sqlalchemy_engine()
+    if sqlalchemy_engine.name != "sqlite":
+        return sqlalchemy_engine
+    return sqlalchemy.create_engine(
+        sqlalchemy_engine.url, connect_args={"check_same_thread": False}
+    )
@@ -236,8 +236,8 @@ class InMemorySQLiteDatabase(DbDetails):
 
 
 class InMemoryPythonDatabase:
-    def __init__(self):
-        self.database = InMemoryDatabase()
+    def __init__(self, database_class=InMemoryDatabase):
+        self.database = database_class()
 
     def setup(self, *input_data, metadata=None):
         """
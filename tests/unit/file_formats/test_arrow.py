@@ -2,9 +2,13 @@ import pyarrow
 import pytest
 
 from ehrql.file_formats.arrow import (
+    ArrowRowsReader,
     batch_and_transpose,
     get_schema_and_convertor,
+    record_batches_to_rows,
+    rows_to_record_batches,
     smallest_int_type_for_range,
+    write_rows_arrow,
 )
 from ehrql.query_model.column_specs import ColumnSpec
 from ehrql.sqlalchemy_types import TYPE_MAP
@@ -41,6 +45,18 @@ def test_batch_and_transpose():
     ]
 
 
+def test_rows_to_record_batches_roundtrip():
+    column_specs = {
+        "i": ColumnSpec(int, min_value=0, max_value=10),
+        "c": ColumnSpec(str, categories=("a", "b")),
+    }
+    rows = [(1, "a"), (2, None), (None, "b"), (4, "a"), (5, "b")]
+    batches = list(rows_to_record_batches(rows, column_specs, batch_size=2))
+    assert [batch.num_rows for batch in batches] == [2, 2, 1]
+    assert batches[0].schema.field("i").type == pyarrow.uint8()
+    assert list(record_batches_to_rows(batches)) == rows
+
+
 @pytest.mark.parametrize(
     "min_value,max_value,expected_width",
     [
@@ -69,3 +85,29 @@ def test_smallest_int_type_for_range(min_value, max_value, expected_width):
 def test_smallest_int_type_for_range_default():
     assert smallest_int_type_for_range(None, 0) == pyarrow.int64()
     assert smallest_int_type_for_range(0, None) == pyarrow.int64()
+
+
+def test_arrow_rows_reader_iter_column_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr("ehrql.file_formats.arrow.ROWS_PER_BATCH", 2)
+    filename = tmp_path / "file.arrow"
+    write_rows_arrow(
+        filename,
+        [(1, "a"), (2, None), (3, "c")],
+        {"i": ColumnSpec(int), "s": ColumnSpec(str)},
+    )
+    column_specs = {
+        "i": ColumnSpec(int),
+        "s": ColumnSpec(str),
+        "missing": ColumnSpec(bool),
+    }
+    with ArrowRowsReader(filename, column_specs, allow_missing_columns=True) as reader:
+        batches = [
+            [column.to_pylist() for column in columns]
+            for columns in reader.iter_column_batches()
+        ]
+        rows = list(reader)
+    assert batches == [
+        [[1, 2], ["a", None], [None, None]],
+        [[3], ["c"], [None]],
+    ]
+    assert rows == [(1, "a", None), (2, None, None), (3, "c", None)]
@@ -1,7 +1,10 @@
+import csv
 import datetime
 from io import StringIO
 from pathlib import Path
+from unittest import mock
 
+import pyarrow
 import pytest
 
 from ehrql.file_formats.csv import (
@@ -50,14 +53,48 @@ def test_write_rows_csv_lines_params_are_exhaustive():
     assert set(types) == set(TYPE_MAP)
 
 
+@pytest.mark.parametrize(
+    "column_specs,rows",
+    [
+        (
+            {"i": ColumnSpec(int), "f": ColumnSpec(float), "b": ColumnSpec(bool)},
+            [(2**70, 1.0, True), (-1, -0.0, False), (None, 1e16, None)],
+        ),
+        (
+            {"i": ColumnSpec(int), "s": ColumnSpec(str)},
+            [(1, "a b"), (2, ' "quoted" '), (3, "comma,"), (4, "new\nline"), (5, "")],
+        ),
+        (
+            {"s": ColumnSpec(str)},
+            [("a",), ("",), (None,)],
+        ),
+    ],
+)
+def test_write_rows_csv_lines_matches_csv_writer(monkeypatch, column_specs, rows):
+    # Check batches are handled individually
+    monkeypatch.setattr("ehrql.file_formats.csv.ROWS_PER_BATCH", 2)
+    output = StringIO()
+    write_rows_csv_lines(output, rows, column_specs)
+
+    expected = StringIO()
+    writer = csv.writer(expected)
+    writer.writerow(column_specs.keys())
+    for row in rows:
+        writer.writerow(["T" if v is True else "F" if v is False else v for v in row])
+    assert output.getvalue() == expected.getvalue()
+
+
 # Allow testing CSV reader without needing a file on disk
 class StringIOCSVRowsReader(BaseCSVRowsReader):
-    def __init__(self, csv_data, column_specs):
+    def __init__(self, csv_data, column_specs, **kwargs):
         self.csv_data = csv_data
-        super().__init__(Path("test_file.csv"), column_specs)
+        super().__init__(Path("test_file.csv"), column_specs, **kwargs)
+
+    def _open_binary(self):
+        return pyarrow.BufferReader(self.csv_data.encode())
 
-    def _open(self):
-        self._fileobj = StringIO(self.csv_data)
+    def _open_text(self):
+        return StringIO(self.csv_data)
 
 
 @pytest.mark.parametrize(
@@ -93,6 +130,11 @@ class StringIOCSVRowsReader(BaseCSVRowsReader):
             "patient_id,age\n1",
             "'test_file.csv', row 1: expected 2 columns but got 1",
         ),
+        # Blank line
+        (
+            "patient_id,age\n1,65\n\n2,",
+            "'test_file.csv', row 2: expected 2 columns but got 0",
+        ),
     ],
 )
 def test_read_rows_csv_lines(csv, error):
@@ -179,3 +221,99 @@ def test_create_column_parser_params_are_exhaustive():
     params = test_create_column_parser.pytestmark[0].args[1]
     types = [arg[1].type for arg in params]
     assert set(types) == set(TYPE_MAP)
+
+
+@pytest.mark.parametrize(
+    "value,spec",
+    [
+        # Values which Arrow can convert
+        ("", ColumnSpec(int)),
+        ("-123", ColumnSpec(int)),
+        ("-1.5e3", ColumnSpec(float)),
+        (".5", ColumnSpec(float)),
+        ("2020-02-29", ColumnSpec(datetime.date)),
+        ("T", ColumnSpec(bool)),
+        ("foo", ColumnSpec(str)),
+        ("2", ColumnSpec(int, categories=(1, 2))),
+        # Values which Python accepts but Arrow doesn't
+        ("+5", ColumnSpec(int)),
+        (" 1", ColumnSpec(int)),
+        ("9999999999999999999", ColumnSpec(int)),
+        ("Infinity", ColumnSpec(float)),
+        ("20200229", ColumnSpec(datetime.date)),
+        # Values which Arrow accepts but Python doesn't
+        ("0x1", ColumnSpec(int)),
+        ("0x1p3", ColumnSpec(float)),
+        # Values which neither accepts
+        ("2021-02-29", ColumnSpec(datetime.date)),
+        ("t", ColumnSpec(bool)),
+        ("3", ColumnSpec(int, categories=(1, 2))),
+        ("baz", ColumnSpec(str, categories=("foo", "bar"))),
+        ("", ColumnSpec(str, nullable=False)),
+    ],
+)
+def test_read_rows_csv_matches_column_parser(value, spec):
+    # The values are read in blocks by Arrow where possible, falling back to the
+    # Python parsers otherwise, but either way the results should be the same
+    specs = {"patient_id": ColumnSpec(int), "value": spec}
+    csv = f"patient_id,value\n1,{value}\n"
+    parser = create_column_parser(["value"], "value", spec)
+    try:
+        expected = [(1, parser([value]))]
+    except ValueError as e:
+        with pytest.raises(FileValidationError) as exc:
+            StringIOCSVRowsReader(csv, specs)
+        assert str(exc.value) == f"'test_file.csv', row 1: {e}"
+    else:
+        assert list(StringIOCSVRowsReader(csv, specs)) == expected
+
+
+def test_read_rows_csv_uses_arrow_for_valid_values():
+    specs = {
+        "patient_id": ColumnSpec(int, nullable=False),
+        "b": ColumnSpec(bool),
+        "f": ColumnSpec(float),
+        "d": ColumnSpec(datetime.date),
+        "c": ColumnSpec(str, categories=("x", "y")),
+        "missing": ColumnSpec(int),
+    }
+    csv = "patient_id,b,f,d,c\n1,T,1.5,2020-01-01,x\n2,,,,\n3,F,-2,2021-12-31,y\n"
+    reader = StringIOCSVRowsReader(csv, specs, allow_missing_columns=True)
+    with mock.patch("ehrql.file_formats.csv.create_row_parser") as create_row_parser:
+        rows = list(reader)
+    create_row_parser.assert_not_called()
+    assert rows == [
+        (1, True, 1.5, datetime.date(2020, 1, 1), "x", None),
+        (2, None, None, None, None, None),
+        (3, False, -2.0, datetime.date(2021, 12, 31), "y", None),
+    ]
+
+
+@pytest.mark.parametrize(
+    "value,error",
+    [
+        (" 90", None),
+        ("ninety", "'test_file.csv', row 90: column 'value': invalid literal for int"),
+    ],
+)
+def test_read_rows_csv_falls_back_to_python_part_way_through(monkeypatch, value, error):
+    # Use small blocks so that rows are read by Arrow before we reach the value it can't
+    # handle
+    monkeypatch.setattr("ehrql.file_formats.csv.ARROW_BLOCK_SIZE", 64)
+    specs = {"patient_id": ColumnSpec(int), "value": ColumnSpec(int)}
+    values = [str(i) for i in range(1, 101)]
+    values[89] = value
+    csv = "patient_id,value\n" + "".join(f"{i},{v}\n" for i, v in enumerate(values))
+    reader = StringIOCSVRowsReader(csv, specs)
+    if error is None:
+        assert list(reader) == [(i, i + 1) for i in range(100)]
+    else:
+        with pytest.raises(FileValidationError, match=error):
+            list(reader)
+
+
+def test_read_rows_csv_with_no_columns_present():
+    specs = {"value": ColumnSpec(int)}
+    csv = "other\n1\n2\n"
+    reader = StringIOCSVRowsReader(csv, specs, allow_missing_columns=True)
+    assert list(reader) == [(None,), (None,)]
@@ -9,9 +9,12 @@ from ehrql.file_formats.main import (
     get_extension_from_directory,
     get_file_extension,
     get_table_filename,
+    get_writer,
+    output_supports_record_batches,
     read_rows,
     split_directory_and_extension,
 )
+from ehrql.file_formats.parquet import ParquetRowsReader
 from tests.lib.traceback_utils import assert_traceback_context_suppressed
 
 
@@ -49,6 +52,7 @@ def test_read_rows_raises_error_for_missing_files():
         CSVRowsReader,
         CSVGZRowsReader,
         ArrowRowsReader,
+        ParquetRowsReader,
     ],
 )
 def test_rows_reader_constructor_rejects_non_path(reader_class):
@@ -127,3 +131,32 @@ def test_split_directory_and_extension(filename, expected_dir, expected_ext):
     directory, extension = split_directory_and_extension(Path(filename))
     assert directory == Path(expected_dir)
     assert extension == expected_ext
+
+
+@pytest.mark.parametrize(
+    "filename,expected",
+    [
+        (None, False),
+        (Path("file.arrow"), True),
+        (Path("file.parquet"), True),
+        (Path("file.csv"), False),
+        (Path("file.csv.gz"), False),
+        (Path("some/dir:arrow"), True),
+        (Path("some/dir:csv"), False),
+    ],
+)
+def test_output_supports_record_batches(filename, expected):
+    assert output_supports_record_batches(filename) == expected
+
+
+def test_get_writer_configures_csv_gz_from_environ():
+    writer = get_writer(
+        ".csv.gz",
+        {"EHRQL_CSV_GZ_COMPRESSION_LEVEL": "9", "EHRQL_CSV_GZ_THREADS": "3"},
+    )
+    assert writer.keywords == {"compresslevel": 9, "threads": 3}
+
+
+def test_get_writer_configures_parquet_from_environ():
+    writer = get_writer(".parquet", {"EHRQL_PARQUET_ROW_GROUP_SIZE": "1000"})
+    assert writer.keywords == {"row_group_size": 1000}
@@ -0,0 +1,91 @@
+from unittest import mock
+
+from ehrql import Dataset, maximum_of
+from ehrql.file_formats.arrow import record_batches_to_rows
+from ehrql.query_engines.in_memory import InMemoryQueryEngine
+from ehrql.query_engines.in_memory_columnar import InMemoryColumnarQueryEngine
+from ehrql.query_engines.in_memory_columnar_database import ColumnarDatabase
+from ehrql.query_engines.in_memory_database import InMemoryDatabase
+from ehrql.query_model import nodes as qm
+from ehrql.query_model.column_specs import ColumnSpec, get_table_specs
+from ehrql.tables import PatientFrame, Series, table
+
+
+@table
+class patients(PatientFrame):
+    i = Series(int)
+    s = Series(str)
+
+
+def test_falls_back_to_per_value_functions():
+    table_data = {
+        patients._qm_node: [
+            (1, -(2**63), "a"),
+            (2, 1, "b"),
+        ],
+    }
+    dataset = Dataset()
+    dataset.define_population(patients.exists_for_patient())
+    # Negating the smallest int64 overflows so must be done using Python ints
+    dataset.negated = -patients.i
+    # Strings have no NumPy type
+    dataset.s_max = maximum_of(patients.s, "aa")
+    dataset_qm = dataset._compile()
+
+    expected = InMemoryQueryEngine(InMemoryDatabase(table_data)).get_results(dataset_qm)
+    results = InMemoryColumnarQueryEngine(ColumnarDatabase(table_data)).get_results(
+        dataset_qm
+    )
+    assert list(results) == list(expected) == [(1, 2**63, "aa"), (2, -1, "b")]
+
+
+def test_get_results_batches_splits_large_tables():
+    table_data = {
+        patients._qm_node: [(i, i, str(i)) for i in range(1, 6)],
+    }
+    dataset = Dataset()
+    dataset.define_population(patients.exists_for_patient())
+    dataset.i = patients.i
+    dataset_qm = dataset._compile()
+    table_specs = get_table_specs(dataset_qm)
+
+    engine = InMemoryColumnarQueryEngine(ColumnarDatabase(table_data))
+    with mock.patch("ehrql.query_engines.in_memory_columnar.ROWS_PER_BATCH", 2):
+        (batches,) = engine.get_results_batches(dataset_qm, table_specs)
+        batches = list(batches)
+
+    assert [batch.num_rows for batch in batches] == [2, 2, 1]
+    assert list(record_batches_to_rows(batches)) == [(i, i) for i in range(1, 6)]
+
+
+def test_get_results_batches_for_measures():
+    table_data = {
+        patients._qm_node: [(1, 1, "a"), (2, 2, "a"), (3, 3, "b")],
+    }
+    patient_table = patients._qm_node
+    dataset_qm = qm.Dataset(
+        population=qm.AggregateByPatient.Exists(patient_table),
+        variables={
+            "i": qm.SelectColumn(patient_table, "i"),
+            "s": qm.SelectColumn(patient_table, "s"),
+            "d": qm.Value(1),
+        },
+        events={},
+        measures=qm.GroupedSum(
+            numerators=("i",), denominator="d", group_bys={("s",): ("i",)}
+        ),
+    )
+    table_specs = {
+        "measures": {
+            "denominator": ColumnSpec(int),
+            "numerator": ColumnSpec(int),
+            "s": ColumnSpec(str),
+            "grouping_id": ColumnSpec(int),
+        }
+    }
+
+    engine = InMemoryColumnarQueryEngine(ColumnarDatabase(table_data))
+    (batches,) = engine.get_results_batches(dataset_qm, table_specs)
+    (rows,) = engine.get_results_tables(dataset_qm)
+
+    assert list(record_batches_to_rows(batches)) == list(rows)
@@ -0,0 +1,484 @@
+import datetime
+
+import numpy as np
+import pyarrow
+import pytest
+
+from ehrql.file_formats.arrow import get_field_and_convertor
+from ehrql.query_engines.in_memory_columnar_database import (
+    ColumnarDatabase,
+    ColumnarEventColumn,
+    ColumnarEventTable,
+    ColumnarPatientColumn,
+    ColumnarPatientTable,
+    apply_function,
+    make_array,
+    make_array_from_arrow,
+    make_arrow_array,
+    to_python_list,
+    where,
+)
+from ehrql.query_engines.in_memory_database import Rows, handle_null
+from ehrql.query_model.column_specs import ColumnSpec
+
+
+def test_patient_table_repr():
+    t = ColumnarPatientTable.parse(
+        """
+          |  i1 |  i2
+        --+-----+-----
+        1 | 101 | 111
+        2 | 201 |
+        """
+    )
+    assert ColumnarPatientTable.parse(repr(t)) == t
+
+
+def test_event_table_repr():
+    t = ColumnarEventTable.parse(
+        """
+          |   |  i1 |  i2
+        --+---+-----+-----
+        1 | 0 | 101 | 111
+        1 | 1 | 102 | 112
+        2 | 3 | 203 | 211
+        2 | 2 | 202 |
+        """
+    )
+    assert ColumnarEventTable.parse(repr(t)) == t
+
+
+def test_patient_column_repr():
+    c = ColumnarPatientColumn.parse(
+        """
+        1 | 101
+        2 |
+        """
+    )
+    assert ColumnarPatientColumn.parse(repr(c)) == c
+
+
+def test_event_column_repr():
+    c = ColumnarEventColumn.parse(
+        """
+        1 | 0 | 101
+        1 | 1 | 102
+        2 | 2 |
+        """
+    )
+    assert ColumnarEventColumn.parse(repr(c)) == c
+
+
+def test_patient_table_from_records_keeps_last_record_for_patient():
+    t = ColumnarPatientTable.from_records(
+        ["patient_id", "i"], [(2, 201), (1, 101), (2, 202)]
+    )
+    assert t["i"].to_dict() == {1: 101, 2: 202}
+
+
+def test_empty_tables():
+    patient_table = ColumnarPatientTable.from_records(["patient_id", "i"], [])
+    event_table = ColumnarEventTable.from_records(["patient_id", "row_id", "i"], [])
+    assert list(patient_table.to_records()) == []
+    assert list(event_table.to_records()) == []
+    assert event_table.count() == ColumnarPatientColumn.from_dict({}, default=0)
+
+
+def test_database_all_patients():
+    database = ColumnarDatabase()
+    database.add_table("p", True, ["patient_id", "i"], [(3, 1), (1, 2)])
+    database.add_table("e", False, ["patient_id", "i"], [(2, 1), (3, 2)])
+    assert database.all_patients == {1, 2, 3}
+    assert database.tables["e"]["row_id"].row_ids.tolist() == [1, 2]
+
+
+def test_database_add_empty_tables():
+    database = ColumnarDatabase()
+    database.add_table("p", True, ["patient_id", "i"], [])
+    database.add_table("e", False, ["patient_id", "i"], [])
+    assert database.all_patients == set()
+    assert list(database.tables["e"].to_records()) == []
+
+
+def test_event_column_getitem():
+    c = ColumnarEventColumn.parse(
+        """
+        1 | 0 | 101
+        1 | 1 | 102
+        """
+    )
+    assert c[1] == Rows({0: 101, 1: 102})
+    assert c[2] == Rows({})
+
+
+def test_patient_column_getitem_uses_default():
+    c = ColumnarPatientColumn.parse(
+        """
+        1 | 101
+        """,
+        default=0,
+    )
+    assert c[1] == 101
+    assert c[2] == 0
+
+
+def test_patient_column_lookup_with_no_patients():
+    c = ColumnarPatientColumn.from_dict({}, default=5)
+    values, nulls = c.lookup(np.array([1, 2]))
+    assert to_python_list(values, nulls) == [5, 5]
+
+
+def test_event_column_aggregate_values_ignores_nulls():
+    c = ColumnarEventColumn.parse(
+        """
+        1 | 0 | 101
+        1 | 1 |
+        2 | 2 |
+        """
+    )
+    assert c.aggregate_values(sum, default=None) == ColumnarPatientColumn.parse(
+        """
+        1 | 101
+        2 |
+        """
+    )
+
+
+def test_event_table_filter_then_aggregate():
+    t = ColumnarEventTable.parse(
+        """
+          |   |  i1
+        --+---+-----
+        1 | 0 | 101
+        1 | 1 | 102
+        1 | 2 | 103
+        2 | 3 | 203
+        3 | 4 | 301
+        """
+    )
+    predicate = ColumnarEventColumn.parse(
+        """
+        1 | 0 | T
+        1 | 1 |
+        1 | 2 | T
+        2 | 3 | T
+        3 | 4 | F
+        """
+    )
+    assert t.filter(predicate).count() == ColumnarPatientColumn.parse(
+        """
+        1 | 2
+        2 | 1
+        """,
+        default=0,
+    )
+
+
+def test_event_column_filter_by_patient_column():
+    c = ColumnarEventColumn.parse(
+        """
+        1 | 0 | 101
+        1 | 1 | 102
+        2 | 2 | 201
+        """
+    )
+    predicate = ColumnarPatientColumn.parse(
+        """
+        1 | F
+        2 | T
+        """
+    )
+    assert c.filter(predicate) == ColumnarEventColumn.parse(
+        """
+        2 | 2 | 201
+        """
+    )
+
+
+def test_event_column_filter_by_column_with_more_rows():
+    c = ColumnarEventColumn.parse(
+        """
+        1 | 1 | 102
+        2 | 2 | 201
+        """
+    )
+    predicate = ColumnarEventColumn.parse(
+        """
+        1 | 0 | F
+        1 | 1 | T
+        2 | 2 | F
+        """
+    )
+    assert c.filter(predicate) == ColumnarEventColumn.parse(
+        """
+        1 | 1 | 102
+        """
+    )
+
+
+def test_event_table_sort_then_pick_at_index():
+    t = ColumnarEventTable.parse(
+        """
+          |   |  i1 |  i2
+        --+---+-----+-----
+        1 | 0 | 101 | 112
+        1 | 1 | 102 | 111
+        1 | 2 | 103 |
+        2 | 3 | 203 | 211
+        2 | 4 | 202 | 211
+        """
+    )
+    sorted_t = t.sort(t["i2"].sort_index())
+    assert sorted_t["i1"] == ColumnarEventColumn.parse(
+        """
+        1 | 2 | 103
+        1 | 1 | 102
+        1 | 0 | 101
+        2 | 3 | 203
+        2 | 4 | 202
+        """
+    )
+    assert sorted_t.pick_at_index(0) == ColumnarPatientTable.parse(
+        """
+          |  i1 |  i2
+        --+-----+-----
+        1 | 103 |
+        2 | 203 | 211
+        """
+    )
+    assert sorted_t.pick_at_index(-1) == ColumnarPatientTable.parse(
+        """
+          |  i1 |  i2
+        --+-----+-----
+        1 | 101 | 112
+        2 | 202 | 211
+        """
+    )
+
+
+@pytest.mark.parametrize("ix", [0, -1])
+def test_event_table_sort_and_pick_at_index(ix):
+    t = ColumnarEventTable.parse(
+        """
+          |   |  i1 |  i2
+        --+---+-----+-----
+        1 | 0 | 101 | 112
+        1 | 1 | 102 | 111
+        1 | 2 | 103 | 111
+        2 | 3 | 201 |
+        2 | 4 | 202 | 211
+        2 | 5 | 202 | 211
+        """
+    )
+    sorted_t = t.sort(t["i1"].sort_index())
+    sorted_t = sorted_t.sort(sorted_t["i2"].sort_index())
+    assert t.sort_and_pick_at_index([t["i1"], t["i2"]], ix) == sorted_t.pick_at_index(
+        ix
+    )
+
+
+def test_event_column_sort_and_pick_at_index():
+    c = ColumnarEventColumn.parse(
+        """
+        1 | 0 | 102
+        1 | 1 |
+        1 | 2 | 101
+        2 | 3 | 201
+        """
+    )
+    sorted_c = c.sort(c.sort_index())
+    assert sorted_c == ColumnarEventColumn.parse(
+        """
+        1 | 1 |
+        1 | 2 | 101
+        1 | 0 | 102
+        2 | 3 | 201
+        """
+    )
+    assert sorted_c.pick_at_index(-1) == ColumnarPatientColumn.parse(
+        """
+        1 | 102
+        2 | 201
+        """
+    )
+
+
+def test_patients():
+    patient_table = ColumnarPatientTable.parse(
+        """
+          |  i1
+        --+-----
+        1 | 101
+        2 |
+        """
+    )
+    event_table = ColumnarEventTable.parse(
+        """
+          |   |  i1
+        --+---+-----
+        1 | 0 | 101
+        3 | 1 |
+        """
+    )
+    assert patient_table.patients() == {1, 2}
+    assert event_table.patients() == {1, 3}
+
+
+def test_apply_function_with_event_columns():
+    pc = ColumnarPatientColumn.parse(
+        """
+        1 | 101
+        3 | 301
+        """
+    )
+    ec1 = ColumnarEventColumn.parse(
+        """
+        1 | 0 | 111
+        1 | 1 | 112
+        5 | 2 | 511
+        """
+    )
+    # Same rows as `ec1` but in a different order
+    ec2 = ColumnarEventColumn.parse(
+        """
+        1 | 1 | 122
+        1 | 0 | 121
+        5 | 2 | 521
+        """
+    )
+    results = apply_function(handle_null(sum_), pc, ec1, ec2)
+    assert results == ColumnarEventColumn.parse(
+        """
+        1 | 0 | 333
+        1 | 1 | 335
+        5 | 2 |
+        """
+    )
+
+
+def test_apply_function_with_no_event_columns():
+    pc1 = ColumnarPatientColumn.parse(
+        """
+        1 | 101
+        2 | 201
+        """,
+        default=0,
+    )
+    pc2 = ColumnarPatientColumn.parse(
+        """
+        1 | 102
+        3 | 302
+        """,
+        default=0,
+    )
+    assert apply_function(sum_, pc1, pc2) == ColumnarPatientColumn.parse(
+        """
+        1 | 203
+        2 | 201
+        3 | 302
+        """,
+        default=0,
+    )
+
+
+@pytest.mark.parametrize(
+    "values,dtype",
+    [
+        ([True, None, False], np.dtype(bool)),
+        ([1, None, 2], np.dtype(np.int64)),
+        ([1.5, None], np.dtype(np.float64)),
+        ([datetime.date(2020, 1, 1), None], np.dtype("datetime64[D]")),
+        (["a", None], np.dtype(object)),
+        ([1, 1.5], np.dtype(object)),
+        ([2**70, None], np.dtype(object)),
+        ([frozenset({1}), None], np.dtype(object)),
+        ([], np.dtype(object)),
+    ],
+)
+def test_make_array_roundtrip(values, dtype):
+    array, nulls = make_array(values)
+    assert array.dtype == dtype
+    result = to_python_list(array, nulls)
+    assert result == values
+    assert [type(v) for v in result] == [type(v) for v in values]
+
+
+@pytest.mark.parametrize(
+    "if_true,if_false,expected",
+    [
+        ([1, 2], [None, None], [1, None]),
+        ([None, None], [1.5, 2.5], [None, 2.5]),
+        ([1, 2], ["a", "b"], [1, "b"]),
+    ],
+)
+def test_where(if_true, if_false, expected):
+    condition = np.array([True, False])
+    values, nulls = where(condition, make_array(if_true), make_array(if_false))
+    assert to_python_list(values, nulls) == expected
+
+
+def sum_(*args):
+    return sum(args)
+
+
+@pytest.mark.parametrize(
+    "chunks",
+    [
+        [pyarrow.array([True, None, False])],
+        [pyarrow.array([1, None], type=pyarrow.uint8()), pyarrow.array([-3, 4])],
+        [pyarrow.array([2**64 - 1, None], type=pyarrow.uint64())],
+        [pyarrow.array([1.5, None], type=pyarrow.float32())],
+        [pyarrow.array([datetime.date(2020, 1, 31), None])],
+        [pyarrow.array(["a", None, "b"])],
+        [
+            pyarrow.DictionaryArray.from_arrays(
+                pyarrow.array([1, None, 0], type=pyarrow.int8()),
+                pyarrow.array(["x", "y"]),
+            )
+        ],
+        [pyarrow.nulls(2)],
+        [],
+    ],
+)
+def test_make_array_from_arrow(chunks):
+    values, nulls = make_array_from_arrow(chunks)
+    expected_values, expected_nulls = make_array(
+        [v for chunk in chunks for v in chunk.to_pylist()]
+    )
+    assert values.dtype == expected_values.dtype
+    assert nulls.tolist() == expected_nulls.tolist()
+    assert to_python_list(values, nulls) == to_python_list(
+        expected_values, expected_nulls
+    )
+
+
+@pytest.mark.parametrize(
+    "values,spec",
+    [
+        ([True, None, False], ColumnSpec(bool)),
+        ([1, None, -3], ColumnSpec(int)),
+        ([1, None, 200], ColumnSpec(int, min_value=0, max_value=255)),
+        ([2**64 - 1, None], ColumnSpec(int, min_value=0, max_value=2**64 - 1)),
+        ([1.5, None], ColumnSpec(float)),
+        ([datetime.date(2020, 1, 31), None], ColumnSpec(datetime.date)),
+        (["a", None, "b"], ColumnSpec(str)),
+        (["b", None, "a"], ColumnSpec(str, categories=("a", "b"))),
+        ([None, None], ColumnSpec(int)),
+    ],
+)
+def test_make_arrow_array(values, spec):
+    field, column_to_pyarrow = get_field_and_convertor("col", spec)
+    array = make_arrow_array(*make_array(values), field.type, column_to_pyarrow)
+    # The array should be just the same as that produced from Python values
+    expected = column_to_pyarrow(values)
+    assert array.type == expected.type
+    assert array.equals(expected)
+
+
+def test_make_arrow_array_reports_errors_as_for_python_values():
+    field, column_to_pyarrow = get_field_and_convertor(
+        "col", ColumnSpec(int, min_value=0, max_value=255)
+    )
+    with pytest.raises(pyarrow.ArrowInvalid) as exc:
+        make_arrow_array(*make_array([1, 256]), field.type, column_to_pyarrow)
+    assert "Error when writing column 'col'" in exc.value.__notes__
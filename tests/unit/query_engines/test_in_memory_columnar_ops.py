@@ -0,0 +1,223 @@
+import datetime
+import operator
+
+import numpy as np
+import pytest
+
+from ehrql.query_engines import in_memory_columnar_ops as ops
+from ehrql.query_engines.in_memory_columnar_database import (
+    CannotVectorise,
+    make_array,
+    to_python_list,
+)
+from ehrql.query_engines.in_memory_database import disregard_null, handle_null
+from ehrql.utils import date_utils, math_utils
+
+
+d = datetime.date
+BIG = 2**62
+
+
+@pytest.mark.parametrize(
+    "fn,args",
+    [
+        (operator.eq, [[1, 2, None], [1, 3, 4]]),
+        (operator.eq, [["a", "b", None], ["a", "c", "d"]]),
+        (operator.ne, [[1.5, 2.0, None], [1, 3, 4]]),
+        (operator.lt, [[1, 2, None], [2, 2, 4]]),
+        (operator.le, [[d(2020, 1, 1), None], [d(2020, 1, 1), d(2021, 1, 1)]]),
+        (operator.gt, [[True, False, None], [False, False, True]]),
+        (operator.ge, [[1.5, 2.5, None], [1.5, 3.5, 1.0]]),
+        (operator.neg, [[1, -2, None]]),
+        (operator.abs, [[1.5, -2.5, None]]),
+        (operator.add, [[1, 2, None], [10, 20, 30]]),
+        (operator.sub, [[1.5, 2.0, None], [10, 20, 30]]),
+        (operator.mul, [[3, 2, None], [10.0, 0.5, 30.0]]),
+        (math_utils.truediv, [[1, 7, 5, None], [2, 0, -2, 1]]),
+        (math_utils.truediv, [[1.5, 7.0, None], [0.5, 0.0, 1.0]]),
+        (math_utils.floordiv, [[7, -7, 5, None], [2, 2, 0, 1]]),
+        (int, [[1.5, -2.7, None]]),
+        (int, [[1, None]]),
+        (int, [[True, False, None]]),
+        (float, [[1, 2, None]]),
+        (float, [[True, None]]),
+        (date_utils.year_from_date, [[d(1969, 6, 30), d(2020, 1, 1), None]]),
+        (date_utils.month_from_date, [[d(1969, 6, 30), d(2020, 12, 1), None]]),
+        (date_utils.day_from_date, [[d(1969, 6, 30), d(2020, 12, 31), None]]),
+        (date_utils.to_first_of_year, [[d(1969, 6, 30), None]]),
+        (date_utils.to_first_of_month, [[d(1969, 6, 30), None]]),
+        (date_utils.date_add_days, [[d(2020, 2, 28), None], [1, 2]]),
+        (
+            date_utils.date_add_months,
+            [
+                [d(2020, 1, 31), d(2020, 12, 31), d(2020, 3, 31), d(2000, 1, 1), None],
+                [1, 2, -13, -1, 1],
+            ],
+        ),
+        (
+            date_utils.date_add_years,
+            [[d(2020, 2, 29), d(2020, 2, 29), d(2020, 2, 28), None], [1, 4, -1, 1]],
+        ),
+        (
+            date_utils.date_difference_in_days,
+            [[d(2020, 3, 1), None], [d(2020, 2, 1), d(2020, 2, 1)]],
+        ),
+        (
+            date_utils.date_difference_in_months,
+            [
+                [d(2020, 3, 1), d(2020, 3, 31), d(2019, 1, 1), None],
+                [d(2020, 2, 2), d(2020, 2, 29), d(2020, 1, 1), d(2020, 1, 1)],
+            ],
+        ),
+        (
+            date_utils.date_difference_in_years,
+            [
+                [d(2021, 2, 28), d(2021, 3, 1), d(2021, 1, 1), d(2019, 6, 1), None],
+                [d(2020, 2, 29), d(2020, 2, 29), d(2020, 2, 1), d(2020, 6, 1), None],
+            ],
+        ),
+        # Entirely NULL arguments
+        (operator.add, [[None, None], [1, 2]]),
+    ],
+)
+def test_null_propagating_array_functions(fn, args):
+    array_fn = ops.get_null_propagating_array_function(fn)
+    result = to_python_list(*array_fn(*[make_array(arg) for arg in args]))
+    expected = [handle_null(fn)(*values) for values in zip(*args)]
+    assert result == expected
+    assert [type(v) for v in result] == [type(v) for v in expected]
+
+
+@pytest.mark.parametrize(
+    "fn,args",
+    [
+        # Values with no NumPy type
+        (operator.lt, [["a", None], ["b", "c"]]),
+        (operator.add, [["a", None], ["b", "c"]]),
+        (operator.neg, [[2**70, None]]),
+        (int, [["1", None]]),
+        (float, [["1.5", None]]),
+        (operator.eq, [[1, None], ["a", "b"]]),
+        # Integers which might not convert exactly to floats
+        (operator.lt, [[2**60, None], [1.5, 1.5]]),
+        (math_utils.truediv, [[2**60, None], [3, 3]]),
+        # Integer overflow
+        (operator.add, [[BIG, None], [BIG, 1]]),
+        (operator.mul, [[BIG, None], [2, 1]]),
+        (operator.neg, [[-(2**63), None]]),
+        (operator.abs, [[-(2**63), None]]),
+        (math_utils.floordiv, [[-(2**63), None], [-1, 1]]),
+        (int, [[float("inf"), None]]),
+        (int, [[1e30, None]]),
+        # Floats
+        (math_utils.floordiv, [[7.5, None], [2.0, 1.0]]),
+        # Dates out of range
+        (date_utils.date_add_days, [[d(9999, 12, 31), None], [1, 1]]),
+        (date_utils.date_add_days, [[d(2000, 1, 1), None], [10**9, 1]]),
+        (date_utils.date_add_months, [[d(9999, 12, 1), None], [1, 1]]),
+        (date_utils.date_add_months, [[d(2000, 1, 1), None], [10**6, 1]]),
+        (date_utils.date_add_years, [[d(1, 1, 1), None], [-1, 1]]),
+        (date_utils.date_add_years, [[d(2000, 1, 1), None], [10**6, 1]]),
+        # Wrong types
+        (date_utils.year_from_date, [[1, None]]),
+        (date_utils.month_from_date, [[1, None]]),
+        (date_utils.day_from_date, [[1, None]]),
+        (date_utils.to_first_of_year, [[1, None]]),
+        (date_utils.to_first_of_month, [[1, None]]),
+        (date_utils.date_difference_in_days, [[1, None], [1, 1]]),
+        (date_utils.date_difference_in_months, [[1, None], [1, 1]]),
+        (date_utils.date_difference_in_years, [[1, None], [1, 1]]),
+    ],
+)
+def test_null_propagating_array_functions_cannot_vectorise(fn, args):
+    array_fn = ops.get_null_propagating_array_function(fn)
+    with pytest.raises(CannotVectorise):
+        array_fn(*[make_array(arg) for arg in args])
+
+
+def test_get_null_propagating_array_function_for_unsupported_function():
+    assert ops.get_null_propagating_array_function(math_utils.power) is None
+
+
+T = True
+F = False
+N = None
+
+
+def test_and():
+    lhs = [T, T, T, N, N, N, F, F, F]
+    rhs = [T, N, F, T, N, F, T, N, F]
+    result = ops.and_(make_array(lhs), make_array(rhs))
+    assert to_python_list(*result) == [T, N, F, N, N, F, F, F, F]
+
+
+def test_or():
+    lhs = [T, T, T, N, N, N, F, F, F]
+    rhs = [T, N, F, T, N, F, T, N, F]
+    result = ops.or_(make_array(lhs), make_array(rhs))
+    assert to_python_list(*result) == [T, T, T, T, N, N, T, N, F]
+
+
+def test_not():
+    assert to_python_list(*ops.not_(make_array([T, N, F]))) == [F, N, T]
+
+
+def test_is_null():
+    assert to_python_list(*ops.is_null(make_array([1, N]))) == [F, T]
+
+
+def test_case_flattened():
+    default = make_array([0, 0, 0, None])
+    condition_1 = make_array([T, F, N, F])
+    value_1 = make_array([1, 1, 1, 1])
+    condition_2 = make_array([T, T, F, F])
+    value_2 = make_array([2, 2, 2, 2])
+    result = ops.case_flattened(default, condition_1, value_1, condition_2, value_2)
+    assert to_python_list(*result) == [1, 2, 0, None]
+
+
+@pytest.mark.parametrize(
+    "ufunc,fn,args",
+    [
+        (np.maximum, max, [[1, None, None, 4], [2, 3, None, None], [0, 0, None, 5]]),
+        (np.minimum, min, [[d(2020, 1, 1), None], [d(2019, 1, 1), d(2021, 1, 1)]]),
+        (np.maximum, max, [[None, None], [1.5, None]]),
+        (np.maximum, max, [[None, None], [None, None]]),
+    ],
+)
+def test_aggregate_disregarding_null(ufunc, fn, args):
+    array_fn = ops.aggregate_disregarding_null(ufunc)
+    result = to_python_list(*array_fn(*[make_array(arg) for arg in args]))
+    assert result == [disregard_null(fn)(*values) for values in zip(*args)]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        [["a", None], ["b", "c"]],
+        [[1, None], [1.5, 2.5]],
+    ],
+)
+def test_aggregate_disregarding_null_cannot_vectorise(args):
+    array_fn = ops.aggregate_disregarding_null(np.maximum)
+    with pytest.raises(CannotVectorise):
+        array_fn(*[make_array(arg) for arg in args])
+
+
+@pytest.mark.parametrize(
+    "values,items,expected",
+    [
+        ([1, 2, None], frozenset({1, 3}), [T, F, N]),
+        (["a", "b", None], frozenset({"a"}), [T, F, N]),
+        ([1, None], frozenset(), [F, F]),
+        ([d(2020, 1, 1), None], frozenset({d(2020, 1, 1)}), [T, N]),
+    ],
+)
+def test_isin(values, items, expected):
+    result = ops.isin(items)(make_array(values))
+    assert to_python_list(*result) == expected
+
+
+def test_isin_cannot_vectorise():
+    with pytest.raises(CannotVectorise):
+        ops.isin(frozenset({"a"}))(make_array([1, None]))
@@ -559,6 +559,50 @@ def test_event_table_pick_at_index():
     )
 
 
+def test_rows_pick_key_after_sorts():
+    rows = Rows({0: 101, 1: 102, 2: 103, 3: 104})
+    # Sorts are applied in order, so the last is the most significant
+    sort_keys = [Rows({0: 1, 1: 2, 2: None, 3: 2}), Rows({0: 1, 1: 0, 2: 0, 3: 0})]
+    assert rows.pick_key_after_sorts(sort_keys, 0) == 2
+    assert rows.pick_key_after_sorts(sort_keys, -1) == 0
+    # Ties keep their current order
+    assert rows.pick_key_after_sorts(sort_keys[:1], 0) == 2
+    assert rows.pick_key_after_sorts(sort_keys[:1], -1) == 3
+
+
+def test_event_table_sort_and_pick_at_index():
+    t = EventTable.parse(
+        """
+          |   |  i1 |  i2
+        --+---+-----+-----
+        1 | 0 | 101 | 112
+        1 | 1 | 102 | 111
+        1 | 2 | 103 | 111
+        2 | 3 | 201 |
+        2 | 4 | 202 | 211
+        """
+    )
+    sort_columns = [t["i1"], t["i2"]]
+
+    assert t.sort_and_pick_at_index(sort_columns, 0) == PatientTable.parse(
+        """
+          |  i1 |  i2
+        --+-----+-----
+        1 | 102 | 111
+        2 | 201 |
+        """
+    )
+
+    assert t.sort_and_pick_at_index(sort_columns, -1) == PatientTable.parse(
+        """
+          |  i1 |  i2
+        --+-----+-----
+        1 | 101 | 112
+        2 | 202 | 211
+        """
+    )
+
+
 def test_apply_function_with_event_columns():
     pc1 = PatientColumn.parse(
         """
@@ -0,0 +1,55 @@
+from ehrql.query_model.introspection import get_table_columns
+from ehrql.query_model.nodes import (
+    AggregateByPatient,
+    Column,
+    Filter,
+    Function,
+    InlinePatientTable,
+    PickOneRowPerPatient,
+    Position,
+    SelectColumn,
+    SelectPatientTable,
+    SelectTable,
+    Sort,
+    TableSchema,
+    Value,
+)
+
+
+patients = SelectPatientTable(
+    "patients", schema=TableSchema(i=Column(int), j=Column(int), k=Column(int))
+)
+events = SelectTable(
+    "events", schema=TableSchema(i=Column(int), j=Column(int), k=Column(int))
+)
+inline = InlinePatientTable(rows=((1, 2),), schema=TableSchema(i=Column(int)))
+
+
+def test_get_table_columns():
+    filtered = Filter(
+        source=events,
+        condition=Function.GT(SelectColumn(events, "k"), Value(0)),
+    )
+    first = PickOneRowPerPatient(
+        source=Sort(source=filtered, sort_by=SelectColumn(filtered, "j")),
+        position=Position.FIRST,
+    )
+    series = Function.Add(
+        SelectColumn(first, "k"),
+        Function.Add(SelectColumn(patients, "k"), SelectColumn(inline, "i")),
+    )
+    assert get_table_columns(series, AggregateByPatient.Exists(events)) == {
+        patients: ["k"],
+        events: ["j", "k"],
+    }
+
+
+def test_get_table_columns_returns_all_columns_for_frames():
+    filtered = Filter(
+        source=events,
+        condition=Function.GT(SelectColumn(events, "k"), Value(0)),
+    )
+    assert get_table_columns(filtered, inline, SelectColumn(patients, "j")) == {
+        patients: ["j"],
+        events: ["i", "j", "k"],
+    }
@@ -1,4 +1,11 @@
+import concurrent.futures
+import copy
 import datetime
+import gc
+import pickle
+import threading
+import time
+import weakref
 from collections.abc import Set
 from types import SimpleNamespace
 from typing import Any
@@ -6,6 +13,7 @@ from typing import Any
 import pytest
 
 from ehrql.codes import CTV3Code, SNOMEDCTCode
+from ehrql.query_model import nodes
 from ehrql.query_model.nodes import (
     AggregateByPatient,
     Case,
@@ -547,11 +555,8 @@ def test_cannot_define_operation_returning_any_type(queries):
         (frozenset({0}), "!=", frozenset({False})),
         (frozenset({0.0}), "!=", frozenset({False})),
         (frozenset({True, False}), "==", frozenset({False, True})),
-        # Test the fast path for identical frozensets
         (example := frozenset({1, 2, 3}), "==", example),
-        # Test the fast path for different sized frozensets
         (frozenset({1, 2, 3}), "!=", frozenset({1, 2})),
-        # Test the normal path for frozenset equality
         (frozenset({1, 2, 3}), "==", frozenset({3, 2, 1})),
         (frozenset({1, 2, 3}), "!=", frozenset({4, 5, 6})),
     ],
@@ -559,8 +564,10 @@ def test_cannot_define_operation_returning_any_type(queries):
 def test_comparisons_between_value_nodes_are_strict(lhs, cmp, rhs):
     if cmp == "==":
         assert Value(lhs) == Value(rhs)
+        assert Value(lhs) is Value(rhs)
     elif cmp == "!=":
         assert Value(lhs) != Value(rhs)
+        assert Value(lhs) is not Value(rhs)
     else:
         assert False
 
@@ -623,12 +630,85 @@ def test_hashing():
 
     # A dataclass object's hash gets computed on instantiation.  This involves
     # computing the hash of all of the object's children, so we expect the
-    # spy's hash function to have been called once.
+    # spy's hash function to have been called (as it also is when the object is
+    # interned).
     v = Value(spy)
-    assert spy.hash_call_count == 1
+    call_count = spy.hash_call_count
+    assert call_count > 0
 
     # If we compute the object's hash again, we expect the hashed value to be
     # retrieved from the cache, and so we don't expect the spy's hash function
     # to have been called again.
     hash(v)
-    assert spy.hash_call_count == 1
+    assert spy.hash_call_count == call_count
+
+
+# TEST INTERNING
+#
+
+
+def test_equal_nodes_are_identical():
+    events_1 = SelectTable("events", EVENTS_SCHEMA)
+    events_2 = SelectTable("events", EVENTS_SCHEMA)
+    code_1 = SelectColumn(events_1, "code")
+    code_2 = SelectColumn(events_2, "code")
+    assert code_1 is code_2
+    assert code_1 is not SelectColumn(events_1, "date")
+
+
+def test_order_of_dict_fields_matters_when_interning():
+    flag = SelectColumn(SelectTable("events", EVENTS_SCHEMA), "flag")
+    not_flag = Function.Not(flag)
+    case_1 = Case({flag: Value("a"), not_flag: Value("b")}, None)
+    case_2 = Case({not_flag: Value("b"), flag: Value("a")}, None)
+    assert case_1 is not case_2
+    assert case_1 is Case({flag: Value("a"), not_flag: Value("b")}, None)
+
+
+def test_interned_nodes_are_released_when_no_longer_used():
+    value = Value("some unique value for this test")
+    key = (Value, (str, "some unique value for this test"))
+    assert nodes.INTERNED_NODES[key] is value
+    del value
+    gc.collect()
+    assert key not in nodes.INTERNED_NODES
+
+
+def test_nodes_built_concurrently_are_identical(monkeypatch):
+    # Widen the window between looking up a node and inserting it, so that any race
+    # between threads doing this shows up reliably
+    class SlowWeakValueDictionary(weakref.WeakValueDictionary):
+        def setdefault(self, key, default):
+            existing = self.get(key)
+            if existing is not None:
+                return existing
+            time.sleep(0.001)
+            self[key] = default
+            return default
+
+    monkeypatch.setattr(nodes, "INTERNED_NODES", SlowWeakValueDictionary())
+    scores = SelectTable("scores", TableSchema(score=Column(int)))
+    score = SelectColumn(scores, "score")
+    thread_count = 8
+    barrier = threading.Barrier(thread_count)
+
+    def build_node(n):
+        barrier.wait()
+        return Function.Add(score, Value(n))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=thread_count) as pool:
+        for n in range(20):
+            built = list(pool.map(build_node, [n] * thread_count))
+            assert all(node is built[0] for node in built)
+
+
+def test_comparing_nodes_with_other_types_is_not_implemented():
+    assert Value(10).__eq__(10) is NotImplemented
+
+
+def test_copied_and_unpickled_nodes_are_interned():
+    code = SelectColumn(SelectTable("events", EVENTS_SCHEMA), "code")
+    series = Function.In(code, Value(frozenset({"abc", "def"})))
+    assert copy.copy(series) is series
+    assert copy.deepcopy(series) is series
+    assert pickle.loads(pickle.dumps(series)) is series
@@ -12,6 +12,7 @@ from ehrql.query_model.nodes import (
     PickOneRowPerPatient,
     Position,
     SelectColumn,
+    SelectPatientTable,
     SelectTable,
     Sort,
     TableSchema,
@@ -24,6 +25,7 @@ from ehrql.query_model.transforms import (
     apply_transforms,
     rewrite_case_to_coalesce,
     rewrite_case_to_fixed_value_map,
+    simplify,
     substitute_parameters,
     unpack_conjunction,
 )
@@ -617,6 +619,142 @@ def test_unpack_conjunction():
     }
 
 
+patients = SelectPatientTable(
+    "patients", TableSchema(b1=Column(bool), b2=Column(bool), b3=Column(bool))
+)
+b1 = SelectColumn(patients, "b1")
+b2 = SelectColumn(patients, "b2")
+b3 = SelectColumn(patients, "b3")
+
+
+def test_simplify_makes_commuted_operations_equal():
+    assert simplify(Function.And(b1, b2)) == simplify(Function.And(b2, b1))
+    assert simplify(Function.Or(Function.Or(b1, b2), b3)) == simplify(
+        Function.Or(b3, Function.Or(b2, b1))
+    )
+
+
+def test_simplify_removes_duplicate_clauses():
+    assert simplify(Function.And(b1, Function.And(b2, b1))) == simplify(
+        Function.And(b1, b2)
+    )
+    assert simplify(Function.Or(b1, b1)) == b1
+
+
+def test_simplify_does_not_mix_operations():
+    simplified = simplify(Function.And(Function.Or(b1, b2), b3))
+    assert isinstance(simplified, Function.And)
+    assert {simplified.lhs, simplified.rhs} == {simplify(Function.Or(b1, b2)), b3}
+
+
+def test_simplify_removes_double_negation():
+    assert simplify(Function.Not(Function.Not(b1))) == b1
+    as_int = Function.CastToInt(Function.Not(Function.Not(b1)))
+    assert simplify(Function.MaximumOf((as_int, Value(1)))) == Function.MaximumOf(
+        (Function.CastToInt(b1), Value(1))
+    )
+
+
+def test_simplify_puts_values_on_the_right():
+    assert simplify(Function.EQ(Value(1), i1)) == Function.EQ(i1, Value(1))
+    assert simplify(Function.NE(Value(1), i1)) == Function.NE(i1, Value(1))
+    assert simplify(Function.EQ(Value(1), Value(2))) == Function.EQ(Value(1), Value(2))
+
+
+@pytest.mark.parametrize(
+    "expr,expected",
+    [
+        (Function.And(b1, Value(True)), b1),
+        (Function.And(Value(False), b1), Value(False)),
+        (Function.Or(b1, Value(False)), b1),
+        (Function.Or(Value(True), b1), Value(True)),
+        (Function.And(Value(True), Value(True)), Value(True)),
+        (Function.Or(Value(False), Value(False)), Value(False)),
+        (Function.Not(Value(True)), Value(False)),
+        (Function.Not(Function.And(b1, Value(False))), Value(True)),
+    ],
+)
+def test_simplify_folds_constants(expr, expected):
+    assert simplify(expr) == expected
+
+
+def test_simplify_does_not_change_the_domain_of_expressions():
+    is_one = Function.EQ(i1, Value(1))
+    simplified = simplify(Function.And(is_one, Value(False)))
+    assert {simplified.lhs, simplified.rhs} == {is_one, Value(False)}
+
+
+def test_simplify_keeps_first_of_case_conditions_made_equal():
+    case = Case(
+        {
+            Function.And(b1, b2): Value(1),
+            Function.And(b2, b1): Value(2),
+        },
+        default=None,
+    )
+    assert simplify(case) == Case(
+        {simplify(Function.And(b1, b2)): Value(1)},
+        default=None,
+    )
+
+
+def test_simplify_returns_a_single_instance_of_each_node():
+    dataset = dataset_factory(
+        v1=Function.Not(Function.And(b1, b2)),
+        v2=Function.Not(Function.And(b2, b1)),
+    )
+    simplified = simplify(dataset)
+    assert simplified.variables["v1"] is simplified.variables["v2"]
+
+
+def test_simplify_merges_membership_tests_on_the_same_series():
+    expr = Function.Or(
+        Function.Or(
+            Function.In(s1, Value(frozenset({"a", "b"}))),
+            Function.In(s1, Value(frozenset({"b", "c"}))),
+        ),
+        Function.EQ(Value("d"), s1),
+    )
+    assert simplify(expr) == Function.In(s1, Value(frozenset({"a", "b", "c", "d"})))
+
+
+def test_simplify_merges_membership_tests_with_empty_sets():
+    expr = Function.Or(
+        Function.In(s1, Value(frozenset())),
+        Function.In(s1, Value(frozenset({"a"}))),
+    )
+    assert simplify(expr) == Function.In(s1, Value(frozenset({"a"})))
+
+
+def test_simplify_only_merges_membership_tests_on_the_same_series():
+    in_s1 = Function.In(s1, Value(frozenset({"a", "b"})))
+    eq_s1 = Function.EQ(s1, Value("c"))
+    in_i1 = Function.In(i1, Value(frozenset({1, 2})))
+    simplified = simplify(Function.Or(Function.Or(in_s1, in_i1), eq_s1))
+    assert unpack_disjunction(simplified) == {
+        Function.In(s1, Value(frozenset({"a", "b", "c"}))),
+        in_i1,
+    }
+
+
+def test_simplify_does_not_merge_membership_tests_in_conjunctions():
+    in_1 = Function.In(s1, Value(frozenset({"a", "b"})))
+    in_2 = Function.In(s1, Value(frozenset({"b", "c"})))
+    simplified = simplify(Function.And(in_1, in_2))
+    assert {simplified.lhs, simplified.rhs} == {in_1, in_2}
+
+
+def unpack_disjunction(node):
+    assert isinstance(node, Function.Or)
+    return {node.lhs, node.rhs}
+
+
+def test_apply_transforms_simplifies_unless_skipping_optimizations():
+    expr = Function.Not(Function.Not(b1))
+    assert apply_transforms(expr) == b1
+    assert apply_transforms(expr, skip_optimizations=True) == expr
+
+
 def dataset_factory(**variables):
     return Dataset(
         population=Value(False), variables=variables, events={}, measures=None
@@ -22,6 +22,7 @@ from ehrql.query_engines.base import BaseQueryEngine
 from ehrql.query_engines.base_sql import BaseSQLQueryEngine
 from ehrql.query_engines.debug import DebugQueryEngine
 from ehrql.query_engines.in_memory import InMemoryQueryEngine
+from ehrql.query_engines.in_memory_columnar import InMemoryColumnarQueryEngine
 from ehrql.utils.module_utils import get_sibling_subclasses
 
 
@@ -311,6 +312,7 @@ def test_all_query_engines_have_an_alias():
         if cls in [
             BaseSQLQueryEngine,
             InMemoryQueryEngine,
+            InMemoryColumnarQueryEngine,
             DebugQueryEngine,
         ]:
             continue
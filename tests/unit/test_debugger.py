@@ -1,3 +1,4 @@
+import collections
 import json
 import textwrap
 from datetime import date
@@ -10,6 +11,8 @@ from ehrql.debugger import (
     elements_are_related_series,
     related_patient_columns_to_records,
 )
+from ehrql.file_formats.csv import BaseCSVRowsReader
+from ehrql.query_engines import local_file
 from ehrql.query_engines.in_memory_database import PatientColumn
 from ehrql.tables import EventFrame, PatientFrame, Series, table
 
@@ -277,6 +280,37 @@ def test_render_related_event_series(dummy_tables_path):
     ]
 
 
+def test_render_reuses_tables_read_with_different_columns(
+    dummy_tables_path, monkeypatch
+):
+    monkeypatch.setattr(local_file, "TABLE_ROWS_CACHE", collections.OrderedDict())
+    parsed_columns = []
+    original_iter = BaseCSVRowsReader.__iter__
+
+    def recording_iter(self):
+        parsed_columns.append(tuple(self.column_specs))
+        return original_iter(self)
+
+    monkeypatch.setattr(BaseCSVRowsReader, "__iter__", recording_iter)
+    # Readers validate the first few rows of a file whenever they're opened; we're only
+    # interested in how many times the whole file is parsed
+    monkeypatch.setattr(BaseCSVRowsReader, "_validate_basic", lambda self: None)
+
+    with activate_debug_context(
+        dummy_tables_path=dummy_tables_path,
+        render_function=json_render_function,
+    ) as ctx:
+        for _ in range(3):
+            ctx.render(events.date)
+            ctx.render(events.code)
+
+    # Each set of columns is parsed just once
+    assert sorted(parsed_columns) == [
+        ("patient_id", "code"),
+        ("patient_id", "date"),
+    ]
+
+
 def test_render_dataset_event_tables_with_population(dummy_tables_path):
     dataset = create_dataset()
     dataset.define_population(patients.sex == "male")
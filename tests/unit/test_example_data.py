@@ -5,6 +5,7 @@ import pytest
 import ehrql
 from ehrql.query_engines.local_file import LocalFileQueryEngine
 from ehrql.query_language import BaseFrame
+from ehrql.query_model.introspection import get_table_columns
 from ehrql.tables import core
 
 
@@ -23,4 +24,6 @@ def test_populate_database_using_example_data(ql_table: BaseFrame):
     # The engine populates the database with the example data and validates the column
     # specs in the process
     engine = LocalFileQueryEngine(EXAMPLE_DATA_DIR)
-    engine.populate_database([ql_table._qm_node], allow_missing_columns=False)
+    engine.populate_database(
+        get_table_columns(ql_table._qm_node), allow_missing_columns=False
+    )
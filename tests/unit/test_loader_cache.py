@@ -0,0 +1,218 @@
+import importlib.util
+import os
+
+import ehrql
+from ehrql import loader_cache
+
+
+def test_record_inputs(tmp_path, monkeypatch):
+    module_dir = tmp_path / "lib"
+    module_dir.mkdir()
+    (module_dir / "loader_cache_test_module.py").write_text("VALUE = 1\n")
+    data_file = tmp_path / "data.csv"
+    data_file.write_text("a,b\n")
+    monkeypatch.syspath_prepend(module_dir)
+    monkeypatch.chdir(tmp_path)
+
+    with data_file.open() as f:
+        with loader_cache.record_inputs() as inputs:
+            import loader_cache_test_module  # noqa: F401
+
+            data_file.read_text()
+            # Listing the current directory passes None as the path
+            os.listdir()
+            open(os.devnull).close()
+            # Files opened by descriptor aren't recorded
+            open(f.fileno(), closefd=False).close()
+            # Cached bytecode is recorded as its source file, and bytecode without
+            # a source file is ignored
+            cache_path = importlib.util.cache_from_source(str(tmp_path / "helper.py"))
+            for bytecode_path in [cache_path, tmp_path / "sourceless.pyc"]:
+                try:
+                    open(bytecode_path).close()
+                except FileNotFoundError:
+                    pass
+            # Nor are ehrQL's own files
+            open(ehrql.__file__).close()
+
+    # Paths which were only checked for existence are tested separately (and coverage
+    # measurement can add some of its own)
+    fingerprints = {
+        path: fingerprint
+        for path, fingerprint in inputs
+        if not fingerprint.startswith("exists:")
+    }
+    assert set(fingerprints) == {
+        str(tmp_path),
+        str(module_dir),
+        str(module_dir / "loader_cache_test_module.py"),
+        str(data_file),
+        str(tmp_path / "helper.py"),
+        os.devnull,
+    }
+    assert fingerprints[str(tmp_path)].startswith("dir:")
+    assert fingerprints[str(data_file)].startswith("file:")
+    assert fingerprints[os.devnull] == "other"
+
+
+def test_record_inputs_records_nothing_outside_context(tmp_path):
+    with loader_cache.record_inputs() as inputs:
+        pass
+    (tmp_path / "file.txt").write_text("")
+    assert inputs == []
+    assert loader_cache.RECORDED_PATHS is None
+
+
+def test_record_inputs_records_existence_checks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    original_stat = os.stat
+    (tmp_path / "present.txt").write_text("")
+    (tmp_path / "read.txt").write_text("")
+
+    with loader_cache.record_inputs() as inputs:
+        (tmp_path / "missing.txt").exists()
+        os.path.isfile("present.txt")
+        os.lstat(tmp_path)
+        os.stat(os.devnull)
+        # Paths which are also read are fingerprinted by their contents
+        (tmp_path / "read.txt").exists()
+        (tmp_path / "read.txt").read_text()
+        # Checks by descriptor aren't recorded
+        os.stat(0)
+
+    fingerprints = dict(inputs)
+    assert fingerprints[str(tmp_path)] == "exists:dir"
+    assert fingerprints[str(tmp_path / "missing.txt")] == "unavailable"
+    assert fingerprints[str(tmp_path / "present.txt")] == "exists:file"
+    assert fingerprints[str(tmp_path / "read.txt")].startswith("file:")
+    assert fingerprints[os.devnull] == "exists:other"
+    # The original functions are restored afterwards
+    assert os.stat is original_stat
+
+
+def test_recording_stat_function_when_not_recording(monkeypatch):
+    monkeypatch.setattr(loader_cache, "CHECKED_PATHS", None)
+    loader_cache.recording_stat_function(os.stat)(".")
+    assert loader_cache.CHECKED_PATHS is None
+
+
+# Coverage isn't measured within audit hooks so we also call the hook directly
+def test_audit_hook(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(loader_cache, "RECORDED_PATHS", set())
+    loader_cache.audit_hook("open", ("file.txt", "r", 0))
+    loader_cache.audit_hook("open", (3, "r", 0))
+    loader_cache.audit_hook("os.listdir", (None,))
+    loader_cache.audit_hook("os.scandir", (b"subdir",))
+    loader_cache.audit_hook("os.remove", ("other.txt", -1))
+    assert loader_cache.RECORDED_PATHS == {
+        str(tmp_path),
+        str(tmp_path / "file.txt"),
+        str(tmp_path / "subdir"),
+    }
+
+
+def test_audit_hook_when_not_recording(monkeypatch):
+    monkeypatch.setattr(loader_cache, "RECORDED_PATHS", None)
+    loader_cache.audit_hook("open", ("file.txt", "r", 0))
+    assert loader_cache.RECORDED_PATHS is None
+
+
+def test_get_fingerprint_for_missing_file(tmp_path):
+    assert loader_cache.get_fingerprint(tmp_path / "missing") == "unavailable"
+
+
+def test_get_fingerprint_for_directory_changes_with_listing(tmp_path):
+    fingerprint_1 = loader_cache.get_fingerprint(tmp_path)
+    (tmp_path / "file.txt").write_text("")
+    fingerprint_2 = loader_cache.get_fingerprint(tmp_path)
+    assert fingerprint_1 != fingerprint_2
+
+
+def test_get_cache_file_depends_on_user_args(tmp_path):
+    cache_file_1 = loader_cache.get_cache_file(tmp_path, "dataset.py", ["--a"])
+    cache_file_2 = loader_cache.get_cache_file(tmp_path, "dataset.py", ["--b"])
+    assert cache_file_1.parent == cache_file_2.parent == tmp_path
+    assert cache_file_1 != cache_file_2
+
+
+def test_get_cache_file_depends_on_source_of_development_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(ehrql, "__version__", "dev")
+    monkeypatch.setattr(loader_cache, "get_source_hash", lambda directory: "abc")
+    cache_file_1 = loader_cache.get_cache_file(tmp_path, "dataset.py", [])
+    monkeypatch.setattr(loader_cache, "get_source_hash", lambda directory: "def")
+    cache_file_2 = loader_cache.get_cache_file(tmp_path, "dataset.py", [])
+    assert cache_file_1 != cache_file_2
+
+
+def test_get_ehrql_version_for_released_version(monkeypatch):
+    monkeypatch.setattr(ehrql, "__version__", "v1.2.3")
+    assert loader_cache.get_ehrql_version() == "v1.2.3"
+
+
+def test_get_source_hash(tmp_path):
+    (tmp_path / "module.py").write_text("VALUE = 1\n")
+    (tmp_path / "__pycache__").mkdir()
+    (tmp_path / "__pycache__" / "module.pyc").write_text("")
+    source_hash_1 = loader_cache.get_source_hash(tmp_path)
+
+    # Changes to cached bytecode don't matter
+    (tmp_path / "__pycache__" / "module.pyc").write_text("changed")
+    assert loader_cache.get_source_hash(tmp_path) == source_hash_1
+
+    # But changes to source do
+    (tmp_path / "module.py").write_text("VALUE = 2\n")
+    assert loader_cache.get_source_hash(tmp_path) != source_hash_1
+
+
+def test_read_cache_entry(tmp_path):
+    input_file = tmp_path / "input.txt"
+    input_file.write_text("original")
+    missing_file = tmp_path / "missing.txt"
+    cache_file = tmp_path / "cache" / "entry.json"
+    entry = {
+        "definition": "{}",
+        "stderr": "",
+        "inputs": loader_cache.get_input_fingerprints(
+            [str(input_file), str(missing_file)]
+        ),
+    }
+
+    assert loader_cache.read_cache_entry(cache_file) is None
+
+    loader_cache.write_cache_entry(cache_file, entry)
+    assert loader_cache.read_cache_entry(cache_file) == entry
+
+    input_file.write_text("changed")
+    assert loader_cache.read_cache_entry(cache_file) is None
+
+    input_file.write_text("original")
+    assert loader_cache.read_cache_entry(cache_file) == entry
+
+    # A file which was missing appearing also counts as a change
+    missing_file.write_text("")
+    assert loader_cache.read_cache_entry(cache_file) is None
+
+
+def test_read_cache_entry_with_checked_paths(tmp_path):
+    checked_file = tmp_path / "checked.txt"
+    checked_file.write_text("original")
+    missing_file = tmp_path / "missing.txt"
+    cache_file = tmp_path / "cache" / "entry.json"
+    entry = {
+        "definition": "{}",
+        "stderr": "",
+        "inputs": loader_cache.get_input_fingerprints(
+            [], [str(checked_file), str(missing_file)]
+        ),
+    }
+    loader_cache.write_cache_entry(cache_file, entry)
+
+    # Changing the contents of a file which was only checked for existence doesn't
+    # count as a change
+    checked_file.write_text("changed")
+    assert loader_cache.read_cache_entry(cache_file) == entry
+
+    # But a file appearing does
+    missing_file.write_text("")
+    assert loader_cache.read_cache_entry(cache_file) is None
@@ -0,0 +1,55 @@
+import io
+import json
+from pathlib import Path
+from unittest import mock
+
+from ehrql import loader_worker
+
+
+FIXTURES_GOOD = Path(__file__).parents[1] / "fixtures" / "good_definition_files"
+
+
+def run_worker(monkeypatch, stdin):
+    monkeypatch.setattr("sys.stdin", io.StringIO(stdin))
+    with mock.patch("os._exit") as exit_:
+        loader_worker.run()
+    return exit_
+
+
+def test_loader_worker_runs_command(monkeypatch, capsys):
+    args = ["serialize-definition", str(FIXTURES_GOOD / "dataset_definition.py")]
+    exit_ = run_worker(monkeypatch, json.dumps(args) + "\n")
+    exit_.assert_called_once_with(0)
+    assert json.loads(capsys.readouterr().out)
+
+
+def test_loader_worker_exits_with_command_exit_code(monkeypatch, capsys):
+    exit_ = run_worker(monkeypatch, json.dumps(["--no-such-argument"]) + "\n")
+    exit_.assert_called_once_with(2)
+    assert "unknown arguments" in capsys.readouterr().err
+
+
+def test_loader_worker_exits_with_message_passed_to_sys_exit(
+    monkeypatch, capsys, tmp_path
+):
+    definition_file = tmp_path / "dataset_definition.py"
+    definition_file.write_text("import sys\nsys.exit('bad parameter supplied')\n")
+    args = ["serialize-definition", str(definition_file)]
+    exit_ = run_worker(monkeypatch, json.dumps(args) + "\n")
+    exit_.assert_called_once_with(1)
+    assert "bad parameter supplied" in capsys.readouterr().err
+
+
+def test_loader_worker_exits_successfully_if_sys_exit_called_without_code(
+    monkeypatch, tmp_path
+):
+    definition_file = tmp_path / "dataset_definition.py"
+    definition_file.write_text("import sys\nsys.exit()\n")
+    args = ["serialize-definition", str(definition_file)]
+    exit_ = run_worker(monkeypatch, json.dumps(args) + "\n")
+    exit_.assert_called_once_with(0)
+
+
+def test_loader_worker_does_nothing_if_sent_nothing(monkeypatch):
+    exit_ = run_worker(monkeypatch, "")
+    exit_.assert_not_called()
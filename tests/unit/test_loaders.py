@@ -1,4 +1,6 @@
+import signal
 import sys
+import textwrap
 from functools import partial
 from pathlib import Path
 from types import SimpleNamespace
@@ -174,6 +176,136 @@ def test_load_dataset_definition_passes_stderr_through(funcs, capsys):
     assert capsys.readouterr().err == "I am a bit chatty\n"
 
 
+def test_load_dataset_definition_uses_cache(tmp_path, capsys):
+    definition_file = tmp_path / "dataset_definition.py"
+    definition_file.write_text(
+        (FIXTURES_GOOD / "dataset_definition_with_print.py").read_text()
+    )
+    environ = {"EHRQL_DEFINITION_CACHE_DIR": str(tmp_path / "cache")}
+    load = partial(
+        loaders.load_dataset_definition,
+        definition_file,
+        user_args=(),
+        environ=environ,
+    )
+    dataset_1, *_ = load()
+    assert capsys.readouterr().err == "user stdout\n"
+
+    with patch.object(loaders, "get_ehrql_command_output") as command_output:
+        dataset_2, *_ = load()
+    command_output.assert_not_called()
+    assert dataset_2 == dataset_1
+    # Output from the original run is replayed
+    assert capsys.readouterr().err == "user stdout\n"
+
+    # Changing the definition file means it's run again
+    definition_file.write_text(definition_file.read_text() + "\n# changed\n")
+    with patch.object(
+        loaders, "get_ehrql_command_output", wraps=loaders.get_ehrql_command_output
+    ) as command_output:
+        dataset_3, *_ = load()
+    command_output.assert_called_once()
+    assert dataset_3 == dataset_1
+
+
+def test_load_dataset_definition_cache_records_existence_checks(tmp_path):
+    definition_file = tmp_path / "dataset_definition.py"
+    definition_file.write_text(
+        textwrap.dedent(
+            """\
+            from pathlib import Path
+
+            from ehrql import create_dataset
+            from ehrql.tables.core import patients
+
+            dataset = create_dataset()
+            dataset.define_population(patients.exists_for_patient())
+            if Path(__file__).with_name("flag").exists():
+                dataset.sex = patients.sex
+            """
+        )
+    )
+    environ = {"EHRQL_DEFINITION_CACHE_DIR": str(tmp_path / "cache")}
+    load = partial(
+        loaders.load_dataset_definition,
+        definition_file,
+        user_args=(),
+        environ=environ,
+    )
+    dataset_1, *_ = load()
+    assert "sex" not in dataset_1.variables
+
+    # Creating the file the definition checks for means it's run again
+    (tmp_path / "flag").write_text("")
+    dataset_2, *_ = load()
+    assert "sex" in dataset_2.variables
+
+
+@pytest.fixture
+def no_worker_started(monkeypatch):
+    loaders.stop_spare_worker()
+    monkeypatch.setattr(loaders, "WORKER_STARTED", False)
+
+
+@pytest.fixture
+def worker_started(monkeypatch):
+    # Simulate a process which has already loaded a definition, and so expects to load
+    # more
+    monkeypatch.setattr(loaders, "WORKER_STARTED", True)
+
+
+def test_load_dataset_definition_uses_spare_worker_process(no_worker_started):
+    filename = FIXTURES_GOOD / "dataset_definition.py"
+    with patch.object(
+        loaders, "start_worker_process", wraps=loaders.start_worker_process
+    ) as start_worker_process:
+        # The first load starts just the worker process it uses
+        dataset_1, *_ = loaders.load_dataset_definition(filename, (), {})
+        assert start_worker_process.call_count == 1
+        assert loaders.SPARE_WORKER is None
+        # The second load starts the worker process it uses, plus a spare
+        dataset_2, *_ = loaders.load_dataset_definition(filename, (), {})
+        assert start_worker_process.call_count == 3
+        spare = loaders.SPARE_WORKER[1]
+        # The third load uses the spare and starts another
+        dataset_3, *_ = loaders.load_dataset_definition(filename, (), {})
+        assert start_worker_process.call_count == 4
+    assert spare.returncode == 0
+    assert dataset_1 == dataset_2 == dataset_3
+
+
+def test_spare_worker_process_not_used_from_different_directory(
+    tmp_path, monkeypatch, worker_started
+):
+    filename = FIXTURES_GOOD / "dataset_definition.py"
+    loaders.load_dataset_definition(filename, (), {})
+    spare = loaders.SPARE_WORKER[1]
+    monkeypatch.chdir(tmp_path)
+    loaders.load_dataset_definition(filename, (), {})
+    assert spare.returncode == -signal.SIGKILL
+
+
+def test_spare_worker_process_not_used_if_exited(worker_started):
+    filename = FIXTURES_GOOD / "dataset_definition.py"
+    loaders.load_dataset_definition(filename, (), {})
+    spare = loaders.SPARE_WORKER[1]
+    spare.kill()
+    spare.wait()
+    dataset, *_ = loaders.load_dataset_definition(filename, (), {})
+    assert isinstance(dataset, Dataset)
+    assert loaders.SPARE_WORKER[1] is not spare
+
+
+def test_stop_spare_worker(worker_started):
+    loaders.load_dataset_definition(FIXTURES_GOOD / "dataset_definition.py", (), {})
+    spare = loaders.SPARE_WORKER[1]
+    loaders.stop_spare_worker()
+    assert spare.returncode == -signal.SIGKILL
+    assert loaders.SPARE_WORKER is None
+    # Stopping again does nothing
+    loaders.stop_spare_worker()
+
+
 def test_load_dataset_definition_no_dataset(funcs):
     filename = FIXTURES_BAD / "no_dataset.py"
     with pytest.raises(
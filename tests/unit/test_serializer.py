@@ -12,6 +12,7 @@ from ehrql.file_formats import (
     read_rows,
     write_rows,
 )
+from ehrql.file_formats.csv import CSVRowsReader
 from ehrql.loader_types import DefinitionError, ModuleDetails
 from ehrql.query_language import (
     DummyDataConfig,
@@ -158,6 +159,17 @@ def test_rows_reader_cannot_be_deserialized_outside_of_root_dir(rows_reader):
         deserialize(serialized, root_dir=Path("/some/path"))
 
 
+def test_unregistered_rows_reader_cannot_be_serialized(tmp_path):
+    class CustomCSVRowsReader(CSVRowsReader):
+        pass
+
+    filename = tmp_path / "file.csv"
+    filename.write_text("patient_id\n1\n")
+    rows_reader = CustomCSVRowsReader(filename, {"patient_id": ColumnSpec(int)})
+    with pytest.raises(KeyError):
+        serialize(rows_reader)
+
+
 @pytest.mark.parametrize("type_name", ["SelectTable", "SelectPatientTable"])
 def test_prohibited_types_cannot_be_deserialized(type_name):
     structure = {
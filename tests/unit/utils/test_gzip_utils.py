@@ -0,0 +1,64 @@
+import gzip
+import zlib
+
+import pytest
+
+from ehrql.utils.gzip_utils import ParallelGzipFile, open_gzip_for_writing_text
+
+
+def count_gzip_members(data):
+    count = 0
+    while data:
+        decompressor = zlib.decompressobj(wbits=31)
+        decompressor.decompress(data)
+        data = decompressor.unused_data
+        count += 1
+    return count
+
+
+@pytest.mark.parametrize("threads", [1, 2, 4])
+def test_parallel_gzip_file_roundtrip(tmp_path, threads):
+    filename = tmp_path / "file.gz"
+    chunks = [f"line {i}\n".encode() * (i % 7) for i in range(200)]
+
+    with ParallelGzipFile(filename, threads=threads, block_size=100) as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+    data = filename.read_bytes()
+    assert gzip.decompress(data) == b"".join(chunks)
+    # Each block is a separate gzip member
+    assert count_gzip_members(data) == len(b"".join(chunks)) // 100 + 1
+
+
+def test_parallel_gzip_file_with_exact_multiple_of_block_size(tmp_path):
+    filename = tmp_path / "file.gz"
+    with ParallelGzipFile(filename, threads=2, block_size=10) as f:
+        f.write(b"0123456789" * 3)
+    data = filename.read_bytes()
+    assert gzip.decompress(data) == b"0123456789" * 3
+    assert count_gzip_members(data) == 3
+
+
+def test_parallel_gzip_file_empty(tmp_path):
+    filename = tmp_path / "file.gz"
+    ParallelGzipFile(filename, threads=2).close()
+    assert gzip.decompress(filename.read_bytes()) == b""
+
+
+def test_parallel_gzip_file_close_is_idempotent(tmp_path):
+    filename = tmp_path / "file.gz"
+    f = ParallelGzipFile(filename, threads=2)
+    f.write(b"hello")
+    f.close()
+    f.close()
+    assert gzip.decompress(filename.read_bytes()) == b"hello"
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_open_gzip_for_writing_text(tmp_path, threads):
+    filename = tmp_path / "file.gz"
+    with open_gzip_for_writing_text(filename, threads=threads, newline="") as f:
+        f.write("a,b\r\nc,d\r\n")
+    with gzip.open(filename, "rt", newline="") as f:
+        assert f.read() == "a,b\r\nc,d\r\n"
@@ -8,8 +8,10 @@ import sqlalchemy
 from sqlalchemy.exc import DBAPIError, InterfaceError, OperationalError
 
 from ehrql.utils.sqlalchemy_exec_utils import (
+    estimate_row_bytes,
     execute_with_retry_factory,
     fetch_table_in_batches,
+    get_next_batch_size,
 )
 from tests.lib.traceback_utils import get_traceback
 
@@ -167,9 +169,201 @@ def test_fetch_table_in_batches_nonunique_raises_if_batch_too_small(
         list(results)
 
 
+@hyp.given(
+    batch_size=batch_size,
+    table_data=batch_size.flatmap(
+        lambda batch_size: table_data_strategy(max_repeated_keys=batch_size - 1),
+    ),
+    key_is_unique=st.booleans(),
+    prefetch=st.booleans(),
+)
+def test_fetch_table_in_batches_adaptive(
+    batch_size, table_data, key_is_unique, prefetch
+):
+    if key_is_unique:
+        table_data = list({key: (key, value) for key, value in table_data}.values())
+    connection = FakeConnection(table_data)
+    log_messages = []
+
+    results = fetch_table_in_batches(
+        connection.execute,
+        sql_table,
+        0,
+        key_is_unique=key_is_unique,
+        batch_size=batch_size,
+        log=log_messages.append,
+        max_batch_size=batch_size * 3,
+        prefetch=prefetch,
+    )
+
+    assert sorted(results) == sorted(table_data)
+    assert f"Fetch complete, total rows: {len(table_data)}" in log_messages
+
+
+def test_fetch_table_in_batches_grows_batch_size():
+    table_data = [(i, i) for i in range(50)]
+    connection = FakeConnection(table_data)
+    log_messages = []
+
+    results = fetch_table_in_batches(
+        connection.execute,
+        sql_table,
+        0,
+        key_is_unique=True,
+        batch_size=5,
+        log=log_messages.append,
+        max_batch_size=15,
+    )
+
+    assert list(results) == table_data
+    # Batches of 5, 10, 15, 15, 15
+    assert connection.call_count == 5
+    assert "Adjusting batch size to 10" in log_messages
+    assert "Adjusting batch size to 15" in log_messages
+
+
+def test_fetch_table_in_batches_with_prefetch_stops_early():
+    table_data = [(i, i) for i in range(50)]
+    connection = FakeConnection(table_data)
+
+    results = fetch_table_in_batches(
+        connection.execute,
+        sql_table,
+        0,
+        key_is_unique=True,
+        batch_size=5,
+        prefetch=True,
+    )
+    first_rows = [next(results) for _ in range(7)]
+    results.close()
+
+    assert first_rows == table_data[:7]
+    # We only ever fetch one batch ahead
+    assert connection.call_count <= 3
+
+
+@pytest.mark.parametrize(
+    "duration,row,expected",
+    [
+        # Quick batches of narrow rows double in size
+        (0.1, (1, "a"), 2000),
+        # Slow batches shrink to fit the target duration
+        (20.0, (1, "a"), 500),
+        # But never below the minimum
+        (100.0, (1, "a"), 200),
+        # Wide rows are limited by the byte budget
+        (0.1, ("x" * 200_000,), 1342),
+    ],
+)
+def test_get_next_batch_size(duration, row, expected):
+    rows = [row] * 1000
+    next_size = get_next_batch_size(
+        rows, duration, 1000, 200, 5000, log=lambda *_: None
+    )
+    assert next_size == expected
+
+
+def test_get_next_batch_size_is_fixed_if_min_equals_max():
+    assert get_next_batch_size([(1,)], 100.0, 1000, 1000, 1000, log=None) == 1000
+
+
+def test_estimate_row_bytes():
+    rows = [(1, "abc", b"de", None)] * 500
+    assert estimate_row_bytes(rows) == 8 + 3 + 2 + 8
+
+
 ERROR = OperationalError("A bad thing happend", {}, None)
 
 
+class FlakyConnection(FakeConnection):
+    """
+    A FakeConnection which raises an error on the specified calls
+    """
+
+    def __init__(self, table_data, failing_calls):
+        super().__init__(table_data)
+        self.failing_calls = failing_calls
+
+    def execute(self, query):
+        results = super().execute(query)
+        if self.call_count in self.failing_calls:
+            raise ERROR
+        return results
+
+
+@mock.patch("time.sleep")
+@hyp.given(
+    batch_size=batch_size,
+    table_data=batch_size.flatmap(
+        lambda batch_size: table_data_strategy(max_repeated_keys=batch_size - 1),
+    ),
+    key_is_unique=st.booleans(),
+    prefetch=st.booleans(),
+    failing_calls=st.sets(st.integers(min_value=1, max_value=30), max_size=3),
+)
+def test_fetch_table_in_batches_resumes_on_error(
+    sleep, batch_size, table_data, key_is_unique, prefetch, failing_calls
+):
+    if key_is_unique:
+        table_data = list({key: (key, value) for key, value in table_data}.values())
+    connection = FlakyConnection(table_data, failing_calls)
+
+    results = fetch_table_in_batches(
+        connection.execute,
+        sql_table,
+        0,
+        key_is_unique=key_is_unique,
+        batch_size=batch_size,
+        prefetch=prefetch,
+        max_resumes=3,
+        resume_sleep=60,
+    )
+
+    # Every row is returned exactly once
+    assert sorted(results) == sorted(table_data)
+
+
+@mock.patch("time.sleep")
+def test_fetch_table_in_batches_resumes_after_last_row(sleep):
+    table_data = [(i, i) for i in range(10)]
+    connection = FlakyConnection(table_data, failing_calls={2})
+    log_messages = []
+
+    results = fetch_table_in_batches(
+        connection.execute,
+        sql_table,
+        0,
+        key_is_unique=True,
+        batch_size=3,
+        log=log_messages.append,
+        max_resumes=1,
+        resume_sleep=60,
+    )
+
+    assert list(results) == table_data
+    assert sleep.mock_calls == [mock.call(60)]
+    assert "Resuming fetch after key 2 in 60s (attempt 1 / 1)" in log_messages
+
+
+@mock.patch("time.sleep")
+def test_fetch_table_in_batches_resumes_exhausted(sleep):
+    table_data = [(i, i) for i in range(10)]
+    connection = FlakyConnection(table_data, failing_calls={2, 3})
+
+    results = fetch_table_in_batches(
+        connection.execute,
+        sql_table,
+        0,
+        key_is_unique=True,
+        batch_size=3,
+        max_resumes=1,
+        resume_sleep=60,
+    )
+
+    with pytest.raises(OperationalError):
+        list(results)
+
+
 @mock.patch("time.sleep")
 def test_execute_with_retry(sleep):
     log_messages = []
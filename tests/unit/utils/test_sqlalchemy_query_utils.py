@@ -1,3 +1,5 @@
+import threading
+
 import pytest
 import sqlalchemy
 from sqlalchemy.dialects.sqlite.pysqlite import SQLiteDialect_pysqlite
@@ -5,6 +7,7 @@ from sqlalchemy.engine.default import DefaultDialect
 from sqlalchemy.sql.visitors import iterate
 
 from ehrql.utils.sqlalchemy_query_utils import (
+    ConcurrentSetupRunner,
     CreateTableAs,
     GeneratedTable,
     InsertMany,
@@ -191,6 +194,84 @@ def test_add_setup_and_cleanup_queries_multiply_nested():
     ]
 
 
+def test_concurrent_setup_runner():
+    temp_table1 = _make_temp_table("temp_table1", "foo")
+    temp_table2 = _make_temp_table("temp_table2", "bar")
+    temp_table2.setup_queries.append(
+        temp_table2.insert().from_select(
+            [temp_table2.c.bar], sqlalchemy.select(temp_table1.c.foo)
+        ),
+    )
+    temp_table3 = _make_temp_table("temp_table3", "baz")
+    temp_table3.setup_queries.append(
+        temp_table3.insert().from_select(
+            [temp_table3.c.baz], sqlalchemy.select(temp_table1.c.foo)
+        ),
+    )
+    temp_table4 = _make_temp_table("temp_table4", "qux")
+
+    query_1 = sqlalchemy.select(temp_table3.c.baz, temp_table4.c.qux)
+    query_2 = sqlalchemy.select(temp_table2.c.bar)
+
+    executed = []
+    lock = threading.Lock()
+
+    def execute(queries):
+        with lock:
+            executed.extend(str(q).strip() for q in queries)
+
+    with ConcurrentSetupRunner([query_1, query_2], execute, max_workers=4) as runner:
+        for query in [query_1, query_2]:
+            runner.setup(query)
+            with lock:
+                executed.append(str(query).strip())
+            runner.cleanup(query)
+
+    # Every query is executed exactly once, the same as for the sequential version
+    assert sorted(executed) == sorted(_queries_as_strs([query_1, query_2]))
+
+    def position(prefix):
+        return next(i for i, q in enumerate(executed) if q.startswith(prefix))
+
+    # Tables are created after their parents and before their children
+    assert position("CREATE TABLE temp_table1") < position("CREATE TABLE temp_table3")
+    assert position("INSERT INTO temp_table3") < position("SELECT temp_table3.baz")
+    assert position("CREATE TABLE temp_table4") < position("SELECT temp_table3.baz")
+    # Tables are dropped only once their children are complete
+    assert position("INSERT INTO temp_table2") < position("DROP TABLE temp_table1")
+    assert position("INSERT INTO temp_table3") < position("DROP TABLE temp_table1")
+    assert position("SELECT temp_table3.baz") < position("DROP TABLE temp_table3")
+    assert position("SELECT temp_table2.bar") < position("DROP TABLE temp_table2")
+    # Tables not needed by the first query are not created until the second
+    assert position("SELECT temp_table3.baz") < position("CREATE TABLE temp_table2")
+
+
+def test_concurrent_setup_runner_raises_errors():
+    temp_table1 = _make_temp_table("temp_table1", "foo")
+    query = sqlalchemy.select(temp_table1.c.foo)
+
+    def execute(queries):
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError, match="failed"):
+        with ConcurrentSetupRunner([query], execute, max_workers=2) as runner:
+            runner.setup(query)
+
+
+def test_concurrent_setup_runner_raises_errors_from_cleanup():
+    temp_table1 = _make_temp_table("temp_table1", "foo")
+    query = sqlalchemy.select(temp_table1.c.foo)
+
+    def execute(queries):
+        if any(isinstance(q, sqlalchemy.schema.DropTable) for q in queries):
+            raise ValueError("failed")
+
+    with pytest.raises(ValueError, match="failed"):
+        with ConcurrentSetupRunner([query], execute, max_workers=2) as runner:
+            runner.setup(query)
+            runner.cleanup(query)
+
+
 def _make_temp_table(name, *columns):
     table = GeneratedTable(
         name, sqlalchemy.MetaData(), *[sqlalchemy.Column(c) for c in columns]